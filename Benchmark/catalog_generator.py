@@ -0,0 +1,87 @@
+"""Синтетический каталог для нагрузочных тестов.
+
+Размножает строки исходного каталога (daochai_parsed.xlsx или результат
+классификатора) до нужного числа позиций: новые id, разброс цен и наличия,
+при text_variants > 1 - варианты описаний с переставленными предложениями.
+Число различных текстов (а значит и эмбеддингов) ограничено
+len(source) * text_variants, поэтому каталог на 1M строк кодируется быстро.
+
+    python catalog_generator.py --source ../daochai_parsed.xlsx --rows 10000 100000 1000000
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import numpy as np
+import pandas as pd
+
+# Общий модуль catalog_io лежит в корне репозитория
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog_io import read_catalog, write_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_catalog(source: pd.DataFrame) -> pd.DataFrame:
+    """Приведение каталога к колонкам, которые ожидает бот"""
+    source = source.drop(columns=[column for column in source.columns if str(column).startswith('Unnamed:')])
+    source = source.copy()
+    # В выгрузке парсера дескрипторы сгруппированы по категориям
+    source['descriptors'] = [
+        [item for items in value.values() for item in items] if isinstance(value, dict) else list(value)
+        for value in source['descriptors']
+    ]
+    if 'bert_descriptors' not in source.columns:
+        source['bert_descriptors'] = [[] for _ in range(len(source))]
+    source['available_tea'] = source['available_tea'].astype(bool)
+    return source.reset_index(drop=True)
+
+
+def shuffle_sentences(text: str, seed: str) -> str:
+    """Вариант описания: те же предложения в другом порядке"""
+    sentences = [sentence.strip() for sentence in str(text).split('. ') if sentence.strip()]
+    random.Random(seed).shuffle(sentences)
+    return '. '.join(sentences)
+
+
+def generate_catalog(source: pd.DataFrame, rows: int, text_variants: int = 1, seed: int = 42) -> pd.DataFrame:
+    """Каталог из rows строк, собранный из строк source"""
+    source = normalize_catalog(source)
+    rng = np.random.default_rng(seed)
+
+    picks = rng.integers(0, len(source), rows)
+    data = source.iloc[picks].reset_index(drop=True)
+    data['id'] = np.arange(rows)
+    data['price'] = (data['price'].to_numpy() * rng.uniform(0.8, 1.2, rows)).round(2)
+    data['available_tea'] = rng.random(rows) < source['available_tea'].mean()
+
+    if text_variants > 1:
+        variants = rng.integers(0, text_variants, rows)
+        data['description'] = [
+            description if variant == 0 else shuffle_sentences(description, f'{pick}:{variant}')
+            for description, pick, variant in zip(data['description'], picks, variants)
+        ]
+    return data
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Генерация синтетического каталога')
+    parser.add_argument('--source', default='../daochai_parsed.xlsx', help='исходный каталог (.xlsx или .parquet)')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--text-variants', type=int, default=1, help='вариантов описания на исходную строку')
+    parser.add_argument('--output-dir', default='data')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    source = read_catalog(args.source)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for rows in args.rows:
+        path = os.path.join(args.output_dir, f'synthetic_catalog_{rows}.parquet')
+        write_catalog(generate_catalog(source, rows, args.text_variants, args.seed), path)
+        logger.info(f"Каталог на {rows} строк сохранён в {path}")
@@ -0,0 +1,136 @@
+"""Локальная замена Ollama /api/generate для нагрузочных тестов.
+
+Отвечает фиксированным текстом с настраиваемой задержкой, поддерживает
+стриминг (NDJSON) и обычный режим и возвращает статистику токенов в том же
+виде, что и Ollama. Запуск отдельным процессом:
+
+    python ollama_stub.py --port 11434 --latency 0.5 --tokens 60 --token-interval 0.02
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+from typing import Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_WORDS = (
+    "Рекомендую обратить внимание на этот чай: мягкий вкус, цветочный аромат "
+    "и долгое послевкусие хорошо подойдут для спокойного чаепития."
+).split()
+
+
+class OllamaStub:
+    """HTTP-заглушка Ollama.
+
+    latency - задержка до первого токена (с), jitter - случайная добавка к ней,
+    tokens - число токенов ответа, token_interval - пауза между токенами при стриминге,
+    error_rate - доля ответов 503 (для проверки повторов клиента)
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, tokens: int = 60,
+                 token_interval: float = 0.0, error_rate: float = 0.0, seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/api/generate', self.generate)
+        return app
+
+    def __words(self):
+        return [RESPONSE_WORDS[i % len(RESPONSE_WORDS)] for i in range(self.tokens)]
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.Response(status=503, text='stub overloaded')
+
+        await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+        stats = {
+            'model': payload.get('model'),
+            'done': True,
+            'prompt_eval_count': len(payload.get('prompt', '').split()),
+            'eval_count': self.tokens,
+        }
+        words = self.__words()
+
+        if not payload.get('stream', True):
+            await asyncio.sleep(self.token_interval * len(words))
+            return web.json_response({**stats, 'response': ' '.join(words)})
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for i, word in enumerate(words):
+            if i and self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            chunk = {'model': payload.get('model'), 'response': word if i == 0 else ' ' + word, 'done': False}
+            await response.write((json.dumps(chunk, ensure_ascii=False) + '\n').encode('utf-8'))
+        await response.write((json.dumps({**stats, 'response': ''}) + '\n').encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в текущем event loop; port=0 - свободный порт. Возвращает URL /api/generate"""
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://{host}:{port}/api/generate'
+        logger.info(f"Заглушка Ollama запущена: {self.url}")
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def start_in_thread(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в отдельном потоке со своим event loop (для синхронного кода)"""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name='ollama-stub', daemon=True).start()
+        started.wait()
+        return self.url
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Заглушка Ollama /api/generate')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка до первого токена, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    parser.add_argument('--tokens', type=int, default=60, help='число токенов в ответе')
+    parser.add_argument('--token-interval', type=float, default=0.0, help='пауза между токенами, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    args = parser.parse_args()
+
+    stub = OllamaStub(args.latency, args.jitter, args.tokens, args.token_interval, args.error_rate)
+
+    async def serve():
+        await stub.start(args.host, args.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
@@ -0,0 +1,192 @@
+"""Нагрузочный тест TeaSommelierBot без GPU и Telegram.
+
+Поднимает заглушку Ollama (или использует --ollama-url), загружает каталог
+и прогоняет корпус запросов:
+- search: find_recommendations последовательно (без LLM);
+- sync: recommend_tea последовательно;
+- async: recommend_tea_async (или стриминг) с заданным числом одновременных запросов.
+
+Для каждого прогона выводятся p50/p95/p99 по этапам (из трассировки metrics)
+и запросы в секунду.
+
+    python run_benchmark.py --catalog data/synthetic_catalog_100000.parquet --latency 0.5 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Tea_Sommelier_Bot'))
+
+from tea_sommelier_bot import TeaSommelierBot
+from metrics import set_trace_sample_rate, trace_request
+from ollama_stub import OllamaStub
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_queries(path: str) -> List[str]:
+    """Корпус запросов: по одному JSON-объекту {"query": ...} на строку"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['query'] for line in f if line.strip()]
+
+
+def summarize(durations: List[float]) -> Dict:
+    """Перцентили длительностей в миллисекундах"""
+    values = np.asarray(durations) * 1000
+    summary = {'count': len(values), 'mean': float(values.mean())}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f'p{percentile}'] = float(value)
+    return summary
+
+
+class BenchmarkRunner:
+    """Прогон корпуса запросов через TeaSommelierBot с замером этапов"""
+
+    def __init__(self, tea_bot: TeaSommelierBot, queries: List[str], repeat: int = 1):
+        self.tea_bot = tea_bot
+        self.queries = queries * repeat
+        # Каждый запрос трассируется; сами трассировки в лог не пишутся
+        set_trace_sample_rate(1.0)
+        logging.getLogger('tea_trace').setLevel(logging.WARNING)
+
+    @staticmethod
+    def report(name: str, stages: Dict[str, List[float]], elapsed: float) -> Dict:
+        total = stages['total']
+        return {
+            'name': name,
+            'queries': len(total),
+            'elapsed': elapsed,
+            'qps': len(total) / elapsed if elapsed else 0.0,
+            'stages': {stage: summarize(durations) for stage, durations in stages.items()},
+        }
+
+    def run_sequential(self, name: str, fn: Callable[[str], object]) -> Dict:
+        """Последовательный прогон синхронного метода"""
+        stages = defaultdict(list)
+        started = time.perf_counter()
+        for query in self.queries:
+            with trace_request(name) as trace:
+                query_started = time.perf_counter()
+                fn(query)
+                stages['total'].append(time.perf_counter() - query_started)
+            for stage, duration in trace.spans:
+                stages[stage].append(duration)
+        return self.report(name, stages, time.perf_counter() - started)
+
+    def run_search(self) -> Dict:
+        return self.run_sequential('search', self.tea_bot.find_recommendations)
+
+    def run_sync(self) -> Dict:
+        return self.run_sequential('sync', self.tea_bot.recommend_tea)
+
+    async def run_async(self, concurrency: int, stream: bool = False) -> Dict:
+        """Прогон асинхронного пути с ограничением числа одновременных запросов"""
+        name = f"{'stream' if stream else 'async'}_x{concurrency}"
+        semaphore = asyncio.Semaphore(concurrency)
+        stages = defaultdict(list)
+
+        async def run_query(query: str):
+            async with semaphore:
+                with trace_request(name) as trace:
+                    query_started = time.perf_counter()
+                    if stream:
+                        recommendations = await self.tea_bot.find_recommendations_async(query)
+                        async for _ in self.tea_bot.generate_recommendation_stream(query, recommendations):
+                            pass
+                    else:
+                        await self.tea_bot.recommend_tea_async(query)
+                    stages['total'].append(time.perf_counter() - query_started)
+                for stage, duration in trace.spans:
+                    stages[stage].append(duration)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_query(query) for query in self.queries))
+        return self.report(name, stages, time.perf_counter() - started)
+
+
+def print_report(report: Dict):
+    print(f"\n== {report['name']}: {report['queries']} запросов за {report['elapsed']:.2f} с, "
+          f"{report['qps']:.1f} запросов/с")
+    print(f"{'этап':<20}{'count':>8}{'mean, мс':>12}" + ''.join(f"{'p' + str(p) + ', мс':>12}" for p in PERCENTILES))
+    for stage, summary in report['stages'].items():
+        print(f"{stage:<20}{summary['count']:>8}{summary['mean']:>12.2f}"
+              + ''.join(f"{summary['p' + str(p)]:>12.2f}" for p in PERCENTILES))
+
+
+async def run_async_modes(runner: BenchmarkRunner, concurrency: List[int], modes: List[str]) -> List[Dict]:
+    """Асинхронные прогоны в одном event loop (сессия клиента Ollama привязана к нему)"""
+    reports = []
+    try:
+        for stream in (False, True):
+            if ('stream' if stream else 'async') not in modes:
+                continue
+            for level in concurrency:
+                reports.append(await runner.run_async(level, stream))
+    finally:
+        await runner.tea_bot.close()
+    return reports
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Нагрузочный тест рекомендаций')
+    parser.add_argument('--catalog', required=True, help='каталог (.parquet или .xlsx)')
+    parser.add_argument('--queries', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.jsonl'))
+    parser.add_argument('--repeat', type=int, default=1, help='повторов корпуса')
+    parser.add_argument('--modes', nargs='+', default=['search', 'sync', 'async'],
+                        choices=['search', 'sync', 'async', 'stream'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--ollama-url', help='настоящий Ollama вместо заглушки')
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка заглушки до первого токена, с')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--tokens', type=int, default=60)
+    parser.add_argument('--token-interval', type=float, default=0.0)
+    parser.add_argument('--model', default='gemma3:1b')
+    parser.add_argument('--cache-size', type=int, default=0, help='размер кеша бота (0 - без кеша)')
+    parser.add_argument('--ann-index', choices=['ivf', 'hnsw'])
+    parser.add_argument('--embedding-cache-dir', default='embedding_cache')
+    parser.add_argument('--output', help='JSON-файл с результатами')
+    args = parser.parse_args()
+
+    ollama_url = args.ollama_url or OllamaStub(
+        args.latency, args.jitter, args.tokens, args.token_interval
+    ).start_in_thread()
+
+    started = time.perf_counter()
+    tea_bot = TeaSommelierBot(
+        args.catalog, ollama_url, args.model, args.embedding_cache_dir,
+        ann_index=args.ann_index, cache_size=args.cache_size,
+        max_llm_concurrency=max(args.concurrency)
+    )
+    startup = time.perf_counter() - started
+    print(f"Каталог: {len(tea_bot.data)} строк, запуск {startup:.2f} с")
+
+    runner = BenchmarkRunner(tea_bot, load_queries(args.queries), args.repeat)
+    reports = []
+    if 'search' in args.modes:
+        reports.append(runner.run_search())
+    if 'sync' in args.modes:
+        reports.append(runner.run_sync())
+    reports.extend(asyncio.run(run_async_modes(runner, args.concurrency, args.modes)))
+
+    for report in reports:
+        print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'catalog': args.catalog, 'rows': len(tea_bot.data), 'startup': startup,
+                       'reports': reports}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,177 @@
+"""Локальная замена сайта магазина для проверки tea_crawler.py.
+
+Отдаёт AJAX-страницы списка товаров и страницы товаров с той же разметкой,
+что и daochai.ru, с заголовками ETag и Last-Modified и ответом 304 на
+условные запросы. update меняет товар, чтобы проверить инкрементальное
+обновление. Запуск отдельным процессом:
+
+    python shop_stub.py --port 8080 --products 500 --latency 0.05
+    python ../tea_crawler.py stub_catalog.xlsx --base-url http://127.0.0.1:8080
+"""
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import formatdate
+from typing import Dict, List, Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ['Улун', 'Пуэр', 'Красный чай', 'Зелёный чай', 'Белый чай']
+DESCRIPTORS = ['цветочный', 'медовый', 'фруктовый', 'древесный', 'ореховый', 'пряный', 'сливочный', 'травяной']
+
+
+class ShopStub:
+    """HTTP-заглушка магазина.
+
+    products - число товаров, page_size - товаров на странице списка,
+    latency - задержка ответа (с), validators - отдавать ли ETag/Last-Modified
+    (без них проверяется повторное скачивание неизменённых страниц);
+    failing_pages - номера страниц списка, на которые отдаётся 503
+    """
+
+    def __init__(self, products: int = 100, page_size: int = 24, latency: float = 0.0, validators: bool = True,
+                 seed: int = 42):
+        self.page_size = page_size
+        self.latency = latency
+        self.validators = validators
+        self.failing_pages = set()
+        self.random = random.Random(seed)
+        self.pages: Dict[int, Dict] = {}
+        for index in range(products):
+            self.update(index)
+        self.requests = 0
+        self.not_modified = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    def update(self, index: int, description: Optional[str] = None):
+        """Новая версия страницы товара (или новый товар)"""
+        descriptors = self.random.sample(DESCRIPTORS, 3)
+        description = description or f'Чай №{index}: {", ".join(descriptors)} аромат, версия {time.time_ns()}.'
+        body = self.__product_html(index, description, descriptors).encode('utf-8')
+        self.pages[index] = {
+            'body': body,
+            'etag': '"' + hashlib.md5(body).hexdigest() + '"',
+            'last_modified': formatdate(time.time(), usegmt=True),
+        }
+
+    def remove(self, index: int):
+        self.pages.pop(index, None)
+
+    def __product_html(self, index: int, description: str, descriptors: List[str]) -> str:
+        category = CATEGORIES[index % len(CATEGORIES)]
+        breadcrumbs = ''.join(
+            f'<a class="ty-breadcrumbs__a" href="#">{name}</a>' for name in ['Главная', 'Каталог', 'Вид чая', category]
+        )
+        return (
+            '<html><body><div class="cm-warehouse-block-depends-by-location">'
+            f'{breadcrumbs}<h1 class="ut2-pb__title">Чай {index}</h1>'
+            f'<span class="ty-price"><span class="ty-price-num">{100 + index}\xa0</span></span>'
+            '<i class="ty-icon-ok"></i>'
+            f'<div id="content_description">{html.escape(description)}</div>'
+            '<div class="descriptors-descriptor-data"><div class="descriptors-descriptor-data-name">Аромат</div>'
+            + ''.join(f'<span class="descriptor-data-name">{name}</span>' for name in descriptors) +
+            '</div><div class="ty-product-feature"><span class="ty-product-feature__label">Год:</span>'
+            f'<div class="ty-product-feature__value">{2015 + index % 10}</div></div>'
+            '</div><div id="content_discussion">'
+            f'<div class="ty-discussion-post__message">Отзыв о чае {index}</div></div></body></html>'
+        )
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/vid-chaya/page-{page}/', self.listing)
+        app.router.add_get('/product-{index}.html', self.product)
+        return app
+
+    async def listing(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        page_number = int(request.match_info['page'])
+        if page_number in self.failing_pages:
+            return web.Response(status=503, text='stub overloaded')
+        indices = sorted(self.pages)
+        start = (page_number - 1) * self.page_size
+        page = indices[start:start + self.page_size]
+        if not page:
+            # Как у магазина за последней страницей: ответ без блока товаров
+            return web.json_response({'html': {}})
+        content = ''.join(f'<a class="product-title" href="/product-{index}.html">Чай {index}</a>' for index in page)
+        return web.Response(
+            text=json.dumps({'html': {'categories_view_pagination_contents': content}}, ensure_ascii=False),
+            content_type='application/json'
+        )
+
+    async def product(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        page = self.pages.get(int(request.match_info['index']))
+        if page is None:
+            raise web.HTTPNotFound()
+        if not self.validators:
+            return web.Response(body=page['body'], content_type='text/html', charset='utf-8')
+
+        headers = {'ETag': page['etag'], 'Last-Modified': page['last_modified']}
+        if request.headers.get('If-None-Match') == page['etag']:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=page['body'], content_type='text/html', charset='utf-8', headers=headers)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в текущем event loop; port=0 - свободный порт. Возвращает адрес магазина"""
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://{host}:{port}'
+        logger.info(f"Заглушка магазина запущена: {self.url}, товаров {len(self.pages)}")
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def start_in_thread(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в отдельном потоке со своим event loop (для синхронного кода)"""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name='shop-stub', daemon=True).start()
+        started.wait()
+        return self.url
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description='Заглушка сайта магазина чая')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=24)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа, с')
+    parser.add_argument('--no-validators', action='store_true', help='не отдавать ETag и Last-Modified')
+    args = parser.parse_args()
+
+    stub = ShopStub(args.products, args.page_size, args.latency, not args.no_validators)
+
+    async def serve():
+        await stub.start(args.host, args.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """Ограничение числа одновременных запросов, подстраиваемое по схеме AIMD.
+
+    Пока задержка остаётся близкой к лучшей наблюдавшейся, а все места заняты,
+    лимит растёт на единицу за каждые limit успешных ответов. При ошибках,
+    сигналах перегрузки сервера или росте задержки больше чем в latency_tolerance
+    раз лимит умножается на decrease_factor - не чаще одного раза за время
+    ответа, чтобы одна волна медленных ответов не обрушила его до минимума.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease_factor: float = 0.5,
+                 latency_tolerance: float = 2.0, smoothing: float = 0.3, baseline_drift: float = 0.01):
+        """
+        Задержка сравнивается в пересчёте на сгенерированный токен, чтобы длинные
+        ответы не считались признаком перегрузки. baseline_drift - насколько лучшая
+        задержка «забывается» за ответ, чтобы лимит восстановился, если сервер
+        стал медленнее насовсем (например, сменилась модель)
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.baseline_drift = baseline_drift
+
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.average: Optional[float] = None
+        self.response_time = 0.0
+        self.hold_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency: float, tokens: int):
+        """Учёт успешного ответа; вызывается до release"""
+        per_token = latency / max(tokens, 1)
+        if self.baseline is None:
+            self.baseline = self.average = per_token
+            self.response_time = latency
+        self.baseline = min(per_token, self.baseline * (1 + self.baseline_drift))
+        self.average += self.smoothing * (per_token - self.average)
+        self.response_time += self.smoothing * (latency - self.response_time)
+
+        if self.average > self.baseline * self.latency_tolerance:
+            self.decrease('рост задержки')
+        elif self.in_flight >= int(self.limit) and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self, reason: str):
+        now = time.monotonic()
+        if now < self.hold_until:
+            return
+        previous = int(self.limit)
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        self.hold_until = now + self.response_time
+        if int(self.limit) != previous:
+            logger.info(f"Параллельность снижена {previous} -> {int(self.limit)} ({reason})")
+
+
+class AdaptiveOllamaClient:
+    """Асинхронный клиент Ollama API для пакетной обработки.
+
+    Число запросов в работе подбирается по задержке и ошибкам (AdaptiveLimiter),
+    на ответы 429/503 клиент выжидает время из Retry-After и снижает нагрузку.
+    Ведётся статистика запросов и сгенерированных токенов в секунду.
+    """
+
+    RETRY_STATUSES = (500, 502, 504)
+    BACKPRESSURE_STATUSES = (429, 503)
+
+    def __init__(self, ollama_url: str, timeout: float = 600.0, connect_timeout: float = 5.0, retries: int = 3,
+                 backoff_factor: float = 1.0, initial_concurrency: int = 2, min_concurrency: int = 1,
+                 max_concurrency: int = 16, **limiter_options):
+        self.ollama_url = ollama_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrency = max_concurrency
+        self.limiter = AdaptiveLimiter(initial_concurrency, min_concurrency, max_concurrency, **limiter_options)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Сессия создаётся лениво внутри работающего event loop"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    @staticmethod
+    def retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+        """Пауза из заголовка Retry-After (секунды или HTTP-дата)"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    async def generate(self, payload: Dict) -> Dict:
+        """Запрос к /api/generate без стриминга; возвращает JSON ответа"""
+        for attempt in range(self.retries + 1):
+            delay = self.backoff_factor * (2 ** attempt)
+            await self.limiter.acquire()
+            try:
+                started = time.monotonic()
+                async with self.get_session().post(self.ollama_url, json=payload) as response:
+                    if response.status in self.BACKPRESSURE_STATUSES:
+                        self.limiter.decrease(f'ответ {response.status}')
+                        delay = self.retry_after(response) or delay
+                        error = f'ответ {response.status}'
+                    else:
+                        response.raise_for_status()
+                        result = await response.json()
+                        tokens = result.get('eval_count', 0)
+                        self.limiter.on_success(time.monotonic() - started, tokens)
+                        self.requests += 1
+                        self.tokens += tokens
+                        return result
+            except aiohttp.ClientResponseError as e:
+                if e.status not in self.RETRY_STATUSES:
+                    self.errors += 1
+                    raise
+                self.limiter.decrease(f'ответ {e.status}')
+                error = repr(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.limiter.decrease('сетевая ошибка')
+                error = repr(e)
+            finally:
+                await self.limiter.release()
+
+            self.errors += 1
+            if attempt >= self.retries:
+                raise RuntimeError(f"Ollama не ответила после {self.retries + 1} попыток: {error}")
+            logger.warning(f"Ошибка при запросе к Ollama ({error}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, float]:
+        """Пропускная способность с момента создания клиента"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'requests_per_second': self.requests / elapsed,
+            'tokens_per_second': self.tokens / elapsed,
+            'concurrency': int(self.limiter.limit),
+            'requests': self.requests,
+            'errors': self.errors,
+        }
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterator, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AugmentationLog:
+    """Журнал аугментации: одна JSON-строка на каждый готовый перефразированный текст.
+
+    Запись дописывается сразу после ответа модели, поэтому при падении теряются
+    только запросы в процессе. При повторном запуске пары (id строки, раунд),
+    уже попавшие в журнал с теми же параметрами генерации, пропускаются.
+    """
+
+    def __init__(self, path: str, **settings):
+        """
+        settings - параметры генерации (модель, хеш промпта), которые пишутся в каждую запись.
+        Записи, сделанные с другими параметрами, остаются в журнале, но не считаются
+        готовыми и не попадают в результат: иначе после смены модели возобновлённый
+        запуск молча взял бы перефразирования прежней
+        """
+        self.path = path
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.file = None
+
+    def records(self) -> Iterator[Dict]:
+        """Записи журнала с текущими параметрами генерации"""
+        return (record for record in self.__read() if self.__matches(record))
+
+    def __read(self) -> Iterator[Dict]:
+        """Все записи журнала; недописанная последняя строка (после падения) пропускается"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Повреждённая строка {line_number} в {self.path} пропущена")
+
+    def __matches(self, record: Dict) -> bool:
+        return all(record.get(key) == value for key, value in self.settings.items())
+
+    def completed(self) -> Set[Tuple]:
+        """Пары (id, раунд), для которых текст с текущими параметрами уже получен"""
+        completed = set()
+        other = 0
+        for record in self.__read():
+            if self.__matches(record):
+                completed.add((record['id'], record['round']))
+            else:
+                other += 1
+        if other:
+            logger.info(f"В {self.path} записей с другой моделью или промптами: {other}, они не учитываются")
+        return completed
+
+    def append(self, row_id, round_number: int, augmented_text: str, **extra):
+        """Дописывает результат и сбрасывает его на диск"""
+        line = json.dumps(
+            {'id': row_id, 'round': round_number, 'augmented_text': augmented_text, **self.settings, **extra},
+            ensure_ascii=False
+        )
+        with self.lock:
+            if self.file is None:
+                self.file = self.__open()
+            self.file.write(line + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def __open(self):
+        # Недописанную после падения строку завершаем, чтобы новая запись не склеилась с ней
+        broken_tail = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                broken_tail = f.read(1) != b'\n'
+        file = open(self.path, 'a', encoding='utf-8')
+        if broken_tail:
+            file.write('\n')
+        return file
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,110 @@
+import json
+import logging
+import math
+from typing import Dict, Iterable, Optional
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+
+class AugmentationPlanner:
+    """План аугментации: сколько перефразирований нужно каждой строке.
+
+    Каждое перефразирование строки добавляет по одному примеру всем её
+    дескрипторам. Нужно, чтобы у каждого дескриптора было не меньше target_count
+    примеров, при наименьшем числе новых строк. Задача решается жадно по
+    разреженной матрице «строка x дескриптор»: на каждом шаге выбирается строка,
+    закрывающая больше всего ещё недобранных дескрипторов, а при равенстве -
+    с меньшим числом уже добранных (их раздувать незачем). Строке сразу
+    назначается столько копий, сколько можно добавить до насыщения одного из её
+    дескрипторов, - шаги жадного алгоритма в этом промежутке одинаковы.
+    """
+
+    def __init__(self, data: pd.DataFrame, target_count: int, max_per_row: int, variants_per_request: int = 1,
+                 candidates: Optional[Iterable] = None):
+        """
+        data - подготовленная таблица с колонками id и descriptors (списки), по ней
+        считается число примеров дескрипторов.
+        max_per_row - предел перефразирований одной строки.
+        candidates - id строк, которые можно перефразировать (по умолчанию все)
+        """
+        self.ids = data['id'].tolist()
+        if candidates is None:
+            self.allowed = np.ones(len(self.ids), dtype=bool)
+        else:
+            self.allowed = data['id'].isin(set(candidates)).to_numpy()
+        self.target_count = target_count
+        self.max_per_row = max_per_row
+        self.variants_per_request = variants_per_request
+        self.unmet: Dict[str, int] = {}
+
+        self.descriptors = sorted({item for items in data['descriptors'] for item in items})
+        positions = {descriptor: index for index, descriptor in enumerate(self.descriptors)}
+        indptr = [0]
+        indices = []
+        for items in data['descriptors']:
+            indices.extend(sorted({positions[item] for item in items}))
+            indptr.append(len(indices))
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(self.ids), len(self.descriptors))
+        )
+        self.counts = np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    def plan(self) -> pd.Series:
+        """Число перефразирований по id строки (только ненулевые)"""
+        deficit = np.maximum(self.target_count - self.counts, 0)
+        row_sizes = np.diff(self.matrix.indptr)
+        copies = np.zeros(len(self.ids), dtype=np.int64)
+
+        while deficit.any():
+            gain = self.matrix @ (deficit > 0).astype(np.int32)
+            gain[(copies >= self.max_per_row) | ~self.allowed] = 0
+            if not gain.any():
+                break
+            waste = row_sizes - gain
+            # Наибольший выигрыш, при равенстве - меньше лишних дескрипторов
+            row = int(np.lexsort((waste, -gain))[0])
+
+            columns = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+            needed = deficit[columns]
+            batch = min(int(needed[needed > 0].min()), self.max_per_row - int(copies[row]))
+            copies[row] += batch
+            deficit[columns] = np.maximum(needed - batch, 0)
+
+        plan = pd.Series(copies, index=pd.Index(self.ids, name='id'), name='count')
+        self.unmet = {
+            self.descriptors[column]: int(deficit[column]) for column in np.flatnonzero(deficit)
+        }
+        if self.unmet:
+            logger.warning(f"Не хватает строк, чтобы добрать дескрипторов: {len(self.unmet)} (предел {self.max_per_row} на строку)")
+        return plan[plan > 0]
+
+    def estimated_calls(self, plan: pd.Series) -> int:
+        """Число запросов к модели с учётом нескольких вариантов за запрос"""
+        return int(sum(math.ceil(count / self.variants_per_request) for count in plan))
+
+    def summary(self, plan: pd.Series) -> Dict:
+        return {
+            'target_count': self.target_count,
+            'max_per_row': self.max_per_row,
+            'candidate_rows': int(self.allowed.sum()),
+            'variants_per_request': self.variants_per_request,
+            'descriptors_below_target': int((self.counts < self.target_count).sum()),
+            'rows': int(len(plan)),
+            'augmentations': int(plan.sum()),
+            'estimated_calls': self.estimated_calls(plan),
+            'unmet': self.unmet,
+            'per_row': {str(row_id): int(count) for row_id, count in plan.items()},
+        }
+
+    def save_plan(self, plan: pd.Series, path: str):
+        summary = self.summary(plan)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(
+            f"План аугментации: строк {summary['rows']}, перефразирований {summary['augmentations']}, "
+            f"запросов к модели ~{summary['estimated_calls']}"
+        )
@@ -1,6 +1,6 @@
 import logging
 import pandas as pd
-import ast
+from catalog_io import read_catalog
 
 
 logger = logging.getLogger(__name__)
@@ -8,14 +8,9 @@ logger = logging.getLogger(__name__)
 
 class DFPreparingService:
     def __init__(self, path_to_excel: str):
-        # Загрузка данных
-        self.data = pd.read_excel(path_to_excel)
+        # Загрузка данных (Parquet или Excel); колонки-коллекции сразу приходят списками и словарями
+        self.data = read_catalog(path_to_excel)
         logger.debug("Загрузили файл")
-        # Превратим текст из колонок в коллекции
-        self.data['descriptors'] = self.data['descriptors'].apply(lambda x: ast.literal_eval(x))
-        self.data['feature'] = self.data['feature'].apply(lambda x: ast.literal_eval(x))
-        self.data['tea_category'] = self.data['tea_category'].apply(lambda x: ast.literal_eval(x))
-        self.data['comments'] = self.data['comments'].apply(lambda x: ast.literal_eval(x))
         # Соединяем комментарии с описаниями
         self.data['description_with_comments'] = self.data.apply(DFPreparingService.__set_description_with_comments, axis=1)
         # Извлекли дескрипторы из классов
@@ -59,10 +54,10 @@ class DFPreparingService:
         """Выделяем из датафрейма редкие дескрипторы"""
         tea_df_flat = self.data.explode('descriptors')
         grouped_df = tea_df_flat.groupby('descriptors').size().reset_index(name='count')
-        rare_descriptors = grouped_df[grouped_df['count'] < 10]['descriptors'].tolist()
+        rare_descriptors = set(grouped_df[grouped_df['count'] < 10]['descriptors'])
 
         for_augment_df = self.data[
-            self.data['descriptors'].apply(lambda x: any(item in rare_descriptors for item in x)) > 0].copy()
+            self.data['descriptors'].apply(lambda x: not rare_descriptors.isdisjoint(x))].copy()
         logger.debug("Выделяем из датафрейма редкие дескрипторы")
         return for_augment_df
 
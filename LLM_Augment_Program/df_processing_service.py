@@ -1,90 +1,271 @@
+import asyncio
+import hashlib
+import json
 import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from tqdm import tqdm
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from adaptive_ollama_client import AdaptiveOllamaClient
+from augmentation_log import AugmentationLog
+from response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+# Описание обрезается до этой длины, чтобы промпт поместился в контекст модели
+MAX_TEXT_LENGTH = 5363
+
+PARAPHRASE_PROMPT = """
+                У меня есть описание чая с комментариями. Не добавляй новых комментариев. Перефразируй текст, не теряя смысла.
+                Сделай текст более выразительным и литературным. 
+                Выводи только финальный текст на русском языке без форматирования. Вот исходный текст:
+                "{text}"
+                """
+
+VARIANTS_PROMPT = """
+                У меня есть описание чая с комментариями. Не добавляй новых комментариев. Перефразируй текст {count} раз разными способами, не теряя смысла.
+                Каждый вариант сделай более выразительным и литературным, варианты не должны повторять друг друга.
+                Ответ верни в формате JSON: {{"variants": ["первый вариант", "второй вариант", ...]}} - ровно {count} строк на русском языке без форматирования. Вот исходный текст:
+                "{text}"
+                """
+
+# Хеш промптов пишется в журнал: после их изменения готовые тексты генерируются заново
+PROMPT_HASH = hashlib.sha256((PARAPHRASE_PROMPT + VARIANTS_PROMPT).encode('utf-8')).hexdigest()[:16]
 
 
 class DFProcessingService:
-    def __init__(self, ollama_url: str, model_name: str, range_count: int):
+    def __init__(self, ollama_url: str, model_name: str, range_count: int,
+                 log_path: str = "augmentation_log.jsonl", max_concurrency: int = 16,
+                 stats_interval: float = 60.0, variants_per_request: int = 1,
+                 min_length_ratio: float = 0.3, max_length_ratio: float = 3.0,
+                 options: Optional[Dict] = None, cache_dir: Optional[str] = "llm_cache",
+                 cache_max_bytes: int = 1 << 30):
+        """
+        log_path - журнал готовых перефразирований; при повторном запуске с тем же
+        журналом уже обработанные пары (id строки, раунд) пропускаются, если они
+        получены той же моделью с теми же промптами.
+        max_concurrency - верхняя граница числа запросов в работе, само число
+        подбирается по задержке ответов сервера.
+        variants_per_request - сколько перефразирований просить за один запрос (JSON-ответ):
+        описание кодируется моделью один раз на все варианты. Недостающие или
+        отбракованные варианты добираются одиночными запросами. Длина варианта должна
+        быть в пределах [min_length_ratio, max_length_ratio] от длины исходного текста.
+        options - параметры генерации Ollama; seed каждому запросу задаётся по номеру
+        раунда, поэтому ответы воспроизводимы и кешируются в cache_dir (None - без кеша)
+        """
         # Настройки Ollama
         self.ollama_url = ollama_url
         self.ollama_model = model_name
         self.range_count = range_count
-        self.session = self.__create_retry_session()
+        self.max_concurrency = max_concurrency
+        self.stats_interval = stats_interval
+        self.variants_per_request = variants_per_request
+        self.min_length_ratio = min_length_ratio
+        self.max_length_ratio = max_length_ratio
+        self.options = options or {}
+        self.cache = ResponseCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.log = AugmentationLog(log_path, model=model_name, prompt=PROMPT_HASH)
+        self.client: Optional[AdaptiveOllamaClient] = None
+        # Число перефразирований по id строки для текущего запуска
+        self.round_counts: Dict = {}
+
+    def processing(self, for_augment_df: pd.DataFrame, counts: Optional[pd.Series] = None) -> pd.DataFrame:
+        """Синхронная обёртка над processing_async для скриптов.
 
-    def processing(self, for_augment_df: pd.DataFrame) -> pd.DataFrame:
+        В Jupyter и другом коде с уже запущенным event loop используйте
+        await processing_async(...)
+        """
+        return asyncio.run(self.processing_async(for_augment_df, counts))
+
+    async def processing_async(self, for_augment_df: pd.DataFrame, counts: Optional[pd.Series] = None) -> pd.DataFrame:
+        """Исходные строки и перефразирования описания каждой из них.
+
+        counts - число перефразирований по id строки (план AugmentationPlanner),
+        по умолчанию range_count для каждой строки
+        """
         augment_df = for_augment_df.copy()
-        augment_df['augmented'] = False
-        for i in range(self.range_count):
-            i_for_log = i + 1
-            logger.debug(f'Обрабатываем range: {i_for_log}')
-            augment_df_for_processing = augment_df[augment_df['augmented'] == False]
-            augment_new_rows_list: [pd.DataFrame] = self.__processing_range(augment_df_for_processing)
-            augment_df['augmented'] = True
-            for augment_new_row in augment_new_rows_list:
-                augment_df = pd.concat( [augment_df, augment_new_row], ignore_index=True)
-        return augment_df
-
-    def __processing_range(self, augment_df_for_processing: pd.DataFrame) -> [pd.DataFrame]:
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            futures = [
-                executor.submit(self.__processing_row, idx, row, augment_df_for_processing.columns)
-                for idx, row in augment_df_for_processing.iterrows()
-            ]
-            dfs = [f.result() for f in tqdm(as_completed(futures), total=len(futures))]
-        return dfs
-
-    def __processing_row(self, index: int, augment_row: pd.Series, columns: pd.Index):
-        current_pd = pd.DataFrame(columns=columns)
-        current_pd.loc[len(current_pd)] = augment_row.copy()
-        current_pd['augmented_text'] = current_pd['description'].apply(lambda x: self.__request_to_gpt(x))
-        current_pd['original'] = False
-        return current_pd
-
-    def __request_to_gpt(self, text: str) -> str:
-
-        # Создание промпта
-        prompt = f"""
-                У меня есть описание чая с комментариями. Не добавляй новых комментариев. Перефразируй текст, не теряя смысла.
-                Сделай текст более выразительным и литературным. 
-                Выводи только финальный текст на русском языке без форматирования. Вот исходный текст:
-                "{text[:5363]}"
-                """
+        descriptions = dict(zip(augment_df['id'].tolist(), augment_df['description'].tolist()))
+        self.round_counts = {
+            row_id: int(counts.get(row_id, 0)) if counts is not None else self.range_count
+            for row_id in descriptions
+        }
+        completed = self.log.completed()
+        # Задача - до variants_per_request раундов одной строки. Задачи идут по раундам,
+        # чтобы прерванный запуск покрывал все строки равномерно
+        tasks = []
+        for first_round in range(1, max(self.round_counts.values(), default=0) + 1, self.variants_per_request):
+            for row_id in descriptions:
+                last_round = min(first_round + self.variants_per_request, self.round_counts[row_id] + 1)
+                rounds = [r for r in range(first_round, last_round) if (row_id, r) not in completed]
+                if rounds:
+                    tasks.append((row_id, rounds))
+        remaining = sum(len(rounds) for _, rounds in tasks)
+        logger.info(
+            f'Перефразирований к генерации: {remaining}, запросов: {len(tasks)}, '
+            f'уже готово: {sum(self.round_counts.values()) - remaining}'
+        )
+        try:
+            await self.__processing_tasks(tasks, descriptions)
+        finally:
+            self.log.close()
+        return self.__assemble(augment_df)
+
+    async def __processing_tasks(self, tasks: List[Tuple], descriptions: Dict):
+        self.client = AdaptiveOllamaClient(self.ollama_url, max_concurrency=self.max_concurrency)
+        progress = tqdm(total=len(tasks))
+        reporter = asyncio.create_task(self.__report_stats())
+        try:
+            # Задачи ждут места в ограничителе клиента, поэтому их можно создать сразу все
+            results = await asyncio.gather(*(
+                self.__processing_task(row_id, rounds, descriptions[row_id], progress)
+                for row_id, rounds in tasks
+            ))
+        finally:
+            reporter.cancel()
+            progress.close()
+            await self.client.close()
+        self.__log_stats()
+        failed = sum(results)
+        if failed:
+            logger.warning(f'Не обработано запросов: {failed}, они будут повторены при следующем запуске')
+
+    async def __processing_task(self, row_id, rounds: List[int], description: str, progress: tqdm) -> int:
+        """Генерация раундов rounds строки; возвращает число неполученных текстов"""
+        variants = []
+        if len(rounds) > 1:
+            variants = await self.__request_variants(description, len(rounds), seed=rounds[0])
+            for round_number, augmented_text in zip(rounds, variants):
+                self.log.append(row_id, round_number, augmented_text)
+
+        missing = rounds[len(variants):]
+        if variants and missing:
+            logger.debug(f'Строка {row_id}: получено вариантов {len(variants)} из {len(rounds)}, остальные запрашиваются по одному')
+        texts = await asyncio.gather(*(self.__request_to_gpt(description, seed) for seed in missing))
+        for round_number, augmented_text in zip(missing, texts):
+            if augmented_text is not None:
+                self.log.append(row_id, round_number, augmented_text)
+        progress.update()
+        return texts.count(None)
+
+    async def __report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.__log_stats()
+
+    def __log_stats(self):
+        stats = self.client.stats()
+        logger.info(
+            f"Ollama: {stats['requests_per_second']:.2f} запросов/с, {stats['tokens_per_second']:.1f} токенов/с, "
+            f"параллельность {stats['concurrency']}, ошибок {stats['errors']}"
+        )
+        if self.cache is not None:
+            stats = self.cache.stats()
+            logger.info(
+                f"Кеш ответов: попаданий {stats['hits']}, промахов {stats['misses']} ({stats['hit_rate']:.0%}), "
+                f"вытеснено {stats['evictions']}, {stats['bytes'] / 2 ** 20:.1f} МБ"
+            )
+
+    def __assemble(self, augment_df: pd.DataFrame) -> pd.DataFrame:
+        """Сборка итоговой таблицы из журнала одним проходом"""
+        generated = pd.DataFrame(list(self.log.records()), columns=['id', 'round', 'augmented_text'])
+        generated = generated[generated['round'] <= generated['id'].map(self.round_counts)]
+        generated = generated.drop_duplicates(['id', 'round'], keep='last')
+
+        augment_df['augmented'] = True
+        new_rows = (
+            augment_df.drop(columns=['augmented_text', 'original'])
+            .reset_index(drop=True)
+            .rename_axis('position')
+            .reset_index()
+            .merge(generated, on='id')
+            .sort_values(['round', 'position'])
+        )
+        new_rows['original'] = False
+        new_rows = new_rows[augment_df.columns]
+        logger.info(f'Собрано перефразирований: {len(new_rows)} из {sum(self.round_counts.values())}')
+        return pd.concat([augment_df, new_rows], ignore_index=True)
+
+    async def __generate(self, template: str, text: str, seed: int, parse: Callable[[str], Any],
+                         response_format: Optional[str] = None, **fields) -> Any:
+        """Запрос к Ollama API с проверкой кеша ответов.
+
+        parse разбирает и проверяет ответ (None - ответ непригоден). В кеш попадают только
+        пригодные ответы: иначе неудачный ответ повторялся бы из кеша при каждом запуске
+        """
+        text = text[:MAX_TEXT_LENGTH]
+        options = {**self.options, "seed": seed}
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(
+                self.ollama_model, template, text, {**options, **fields, "format": response_format}, seed
+            )
+            response = self.cache.get(key)
+            parsed = parse(response) if response is not None else None
+            if parsed is not None:
+                return parsed
 
-        """Запрос к Ollama API"""
         payload = {
             "model": self.ollama_model,
-            "prompt": prompt,
+            "prompt": template.format(text=text, **fields),
+            "options": options,
             "stream": False
         }
+        if response_format:
+            payload["format"] = response_format
+        result = await self.client.generate(payload)
+        response = result['response']
+        parsed = parse(response)
+        if key is not None and parsed is not None:
+            self.cache.put(key, response)
+        return parsed
+
+    async def __request_variants(self, text: str, count: int, seed: int) -> List[str]:
+        """Запрос count перефразирований одним вызовом; возвращает прошедшие проверку варианты"""
+        def parse(response: str) -> Optional[List[str]]:
+            try:
+                answer = json.loads(response)
+            except ValueError:
+                logger.warning(f"Ответ модели - не JSON: {response[:200]!r}")
+                return None
+            if isinstance(answer, dict):
+                answer = answer.get('variants')
+            if not isinstance(answer, list):
+                logger.warning(f"Ответ модели не содержит списка вариантов: {response[:200]!r}")
+                return None
+            return self.validate_variants(answer, text[:MAX_TEXT_LENGTH], count) or None
 
         try:
-            response = self.session.post(self.ollama_url, json=payload, timeout=600)
-            response.raise_for_status()
-            return response.json()['response']
+            variants = await self.__generate(VARIANTS_PROMPT, text, seed, parse, response_format="json", count=count)
         except Exception as e:
-            logger.error(f"Ошибка при запросе к Ollama: {e}")
-            return "Ошибка обработки данных их GPT"
-
-    def __create_retry_session(self, total_retries=3, backoff_factor=1.0) -> requests.Session:
-        retry = Retry(
-            total=total_retries,
-            read=total_retries,
-            connect=total_retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=(500, 502, 503, 504),
-            allowed_methods=frozenset(['POST']),
-            raise_on_status=False
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session = requests.Session()
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        return session
+            logger.error(f"Ошибка при запросе вариантов к Ollama: {e}")
+            return []
+        return variants or []
+
+    def validate_variants(self, variants: List, source: str, count: int) -> List[str]:
+        """Непустые строки разумной длины, отличные от исходного текста и друг от друга"""
+        def normalize(value: str) -> str:
+            return re.sub(r'\W+', ' ', value.lower()).strip()
 
+        seen = {normalize(source)}
+        valid = []
+        for variant in variants:
+            if not isinstance(variant, str):
+                continue
+            variant = variant.strip().strip('"').strip()
+            key = normalize(variant)
+            if not key or key in seen:
+                continue
+            if not self.min_length_ratio * len(source) <= len(variant) <= self.max_length_ratio * len(source):
+                continue
+            seen.add(key)
+            valid.append(variant)
+        return valid[:count]
+
+    async def __request_to_gpt(self, text: str, seed: int) -> Optional[str]:
+        try:
+            # Пустой ответ не кешируется и не попадает в журнал
+            return await self.__generate(PARAPHRASE_PROMPT, text, seed, lambda response: response if response.strip() else None)
+        except Exception as e:
+            # Ошибка не попадает в журнал, и запрос повторится при следующем запуске
+            logger.error(f"Ошибка при запросе к Ollama: {e}")
+            return None
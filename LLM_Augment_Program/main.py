@@ -1,6 +1,14 @@
 import logging
+import os
+import sys
+
+# Общий модуль catalog_io лежит в корне репозитория
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from df_preparing_service import DFPreparingService
 from df_processing_service import DFProcessingService
+from augmentation_planner import AugmentationPlanner
+from catalog_io import write_catalog
 import pandas as pd
 
 # Настройка логгирования
@@ -17,14 +25,38 @@ if __name__ == "__main__":
     path_to_excel = "../daochai_parsed.xlsx"
     preparing_service = DFPreparingService(path_to_excel)
     original_df = preparing_service.get_loaded_df()
+    # Перефразируются только строки с редкими дескрипторами (меньше 10 примеров)
     rare_descriptor_rows = preparing_service.get_rare_descriptor_rows()
 
     ollama_url = "http://localhost:8080/api/generate"
     model_name = "gemma3:1b"
+    # Предел перефразирований одной строки
     range_count = 50
-    processing_service = DFProcessingService(ollama_url, model_name, range_count)
-    processed_df = processing_service.processing(rare_descriptor_rows)
+    # Сколько примеров должно быть у каждого дескриптора после аугментации
+    target_count = 50
+    # Журнал готовых перефразирований: после перезапуска обработка продолжается с места остановки
+    log_path = "augmentation_log.jsonl"
+    # Перефразирований за один запрос к модели
+    variants_per_request = 5
+    # Кеш ответов модели: повторный запуск с теми же данными и настройками не обращается к Ollama
+    cache_dir = "llm_cache"
+
+    # План составляется до запросов к модели: сколько перефразирований нужно каждой строке.
+    # Примеры дескрипторов считаются по всему каталогу, копии выбираются среди строк с редкими дескрипторами
+    planner = AugmentationPlanner(
+        original_df, target_count, range_count, variants_per_request, candidates=rare_descriptor_rows["id"]
+    )
+    plan = planner.plan()
+    planner.save_plan(plan, "augmentation_plan.json")
+    rows_for_augment = original_df[original_df["id"].isin(plan.index)]
+
+    processing_service = DFProcessingService(
+        ollama_url, model_name, range_count, log_path, variants_per_request=variants_per_request,
+        cache_dir=cache_dir
+    )
+    processed_df = processing_service.processing(rows_for_augment, plan)
     processed_df_ids = processed_df["id"].unique()
     original_df = original_df[~original_df["id"].isin(processed_df_ids)]
     original_df = pd.concat([original_df, processed_df], ignore_index=True)
-    original_df.to_excel("processed_df.xlsx", index=False)
\ No newline at end of file
+    original_df.to_excel("processed_df.xlsx", index=False)
+    write_catalog(original_df, "processed_df.parquet")
\ No newline at end of file
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Дисковый кеш ответов модели, адресуемый по содержимому запроса.
+
+    Ключ - sha256 от модели, шаблона промпта, входного текста, параметров
+    генерации и seed варианта, поэтому при изменении любого из них ответ
+    запрашивается заново. Ответы лежат отдельными файлами; при превышении
+    max_bytes удаляются давно не использованные (по времени изменения файла,
+    которое обновляется при каждом попадании).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Размер и время последнего использования каждого файла кеша
+        self.entries: Dict[str, tuple] = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.json'):
+                    stat = os.stat(os.path.join(root, name))
+                    self.entries[name[:-5]] = (stat.st_mtime, stat.st_size)
+        self.size = sum(size for _, size in self.entries.values())
+        logger.info(f"Кеш ответов {directory}: записей {len(self.entries)}, {self.size / 2 ** 20:.1f} МБ")
+
+    @staticmethod
+    def make_key(model: str, template: str, text: str, options: Dict, seed: int) -> str:
+        content = json.dumps(
+            {'model': model, 'template': template, 'text': text, 'options': options, 'seed': seed},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self.entries:
+            path = self.__path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = json.load(f)['response']
+                os.utime(path)
+                self.entries[key] = (time.time(), self.entries[key][1])
+                self.hits += 1
+                return value
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Повреждённая запись кеша {key}: {e!r}")
+                self.__remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str):
+        path = self.__path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл, чтобы при падении не осталось недописанного ответа
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'response': value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        if key in self.entries:
+            self.size -= self.entries[key][1]
+        size = os.path.getsize(path)
+        self.entries[key] = (time.time(), size)
+        self.size += size
+        if self.size > self.max_bytes:
+            self.__evict()
+
+    def __evict(self):
+        """Удаление давно не использованных записей до 90% лимита"""
+        for key in sorted(self.entries, key=lambda k: self.entries[k][0]):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            self.__remove(key)
+            self.evictions += 1
+
+    def __remove(self, key: str):
+        _, size = self.entries.pop(key)
+        self.size -= size
+        try:
+            os.remove(self.__path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
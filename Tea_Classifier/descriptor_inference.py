@@ -0,0 +1,228 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import torch
+from transformers import BertForSequenceClassification, BertTokenizerFast
+
+logger = logging.getLogger(__name__)
+
+
+class BaseDescriptorPredictor(ABC):
+    """Пакетное предсказание дескрипторов чая сохранённой моделью (папка final_tea_model).
+
+    В отличие от TeaModelTrainer.predict тексты обрабатываются батчами: внутри
+    порции они сортируются по длине, и каждый батч дополняется только до длины
+    самого длинного текста в нём, а не до max_len. Результаты возвращаются в
+    исходном порядке. Наследники реализуют logits для своей среды выполнения
+    (PyTorch, ONNX Runtime), остальное у них общее.
+    """
+
+    def __init__(self, model_dir: str, batch_size: int = 32, max_len: int = 512,
+                 truncation_side: Optional[str] = None):
+        """
+        model_dir - папка, сохранённая TeaModelTrainer.save_model (модель, токенизатор, metrics.json).
+        max_len - длина, с которой модель обучалась; truncation_side ('left'/'right') по
+        умолчанию берётся из сохранённого токенизатора
+        """
+        with open(os.path.join(model_dir, 'metrics.json'), 'r', encoding='utf-8') as f:
+            self.target_labels: List[str] = json.load(f)['target_labels']
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+        if truncation_side:
+            self.tokenizer.truncation_side = truncation_side
+
+    @abstractmethod
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Логиты модели для батча (batch x n_labels)"""
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        """Вероятности дескрипторов для списка текстов (n_texts x n_labels)"""
+        probs = np.zeros((len(texts), len(self.target_labels)), dtype=np.float32)
+        if not texts:
+            return probs
+        encoded = self.tokenizer(
+            [str(text) for text in texts], max_length=self.max_len, truncation=True,
+            return_attention_mask=False, return_token_type_ids=False
+        )['input_ids']
+        # Тексты близкой длины попадают в один батч, и дополнение почти не нужно
+        order = np.argsort([len(ids) for ids in encoded], kind='stable')
+
+        for start in range(0, len(order), self.batch_size):
+            batch_indices = order[start:start + self.batch_size]
+            logits = self.logits(*self.__pad([encoded[i] for i in batch_indices]))
+            probs[batch_indices] = 1 / (1 + np.exp(-np.clip(logits, -50, 50)))
+        return probs
+
+    def __pad(self, sequences: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Дополнение батча до самой длинной последовательности в нём"""
+        length = max(len(ids) for ids in sequences)
+        input_ids = np.full((len(sequences), length), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), length), dtype=np.int64)
+        for row, ids in enumerate(sequences):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        return input_ids, attention_mask
+
+    def iter_proba(self, texts: Iterable[str], chunk_size: int = 1024) -> Iterator[np.ndarray]:
+        """Вероятности для потока текстов порциями по chunk_size (сортировка по длине внутри порции)"""
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) >= chunk_size:
+                yield self.predict_proba(chunk)
+                chunk = []
+        if chunk:
+            yield self.predict_proba(chunk)
+
+    def select(self, probs: np.ndarray, percentile: float = 95, threshold: float = 0.3) -> List[List[Tuple[str, float]]]:
+        """Дескрипторы, как в TeaModelTrainer.predict и predict_for_empty: не ниже перцентиля
+        вероятностей текста и выше threshold"""
+        cutoffs = np.percentile(probs, percentile, axis=1, keepdims=True)
+        selected = (probs >= cutoffs) & (probs > threshold)
+        return [
+            [(self.target_labels[i], float(row_probs[i])) for i in np.flatnonzero(row_selected)]
+            for row_probs, row_selected in zip(probs, selected)
+        ]
+
+    def predict(self, texts: List[str], percentile: float = 95, threshold: float = 0.3) -> List[List[Tuple[str, float]]]:
+        """Список (дескриптор, вероятность) для каждого текста"""
+        return self.select(self.predict_proba(texts), percentile, threshold)
+
+    def predict_for_empty(self, data: pd.DataFrame, text_column: str = 'description', percentile: float = 95,
+                          threshold: float = 0.3, chunk_size: int = 1024) -> pd.Series:
+        """Колонка bert_descriptors: предсказания для строк без дескрипторов, для остальных - пустые списки"""
+        empty = data['descriptors'].apply(lambda x: not isinstance(x, (list, tuple, np.ndarray)) or len(x) == 0)
+        result = pd.Series([[] for _ in range(len(data))], index=data.index, name='bert_descriptors', dtype=object)
+        rows = data.index[empty]
+        texts = data.loc[rows, text_column].fillna('').astype(str)
+        position = 0
+        for probs in self.iter_proba(texts, chunk_size):
+            for row, descriptors in zip(rows[position:position + len(probs)], self.select(probs, percentile, threshold)):
+                result.at[row] = [descriptor for descriptor, _ in descriptors]
+            position += len(probs)
+        return result
+
+    def predict_to_file(self, texts: Iterable[str], path: str, percentile: float = 95, threshold: float = 0.3,
+                        chunk_size: int = 1024) -> int:
+        """Потоковая запись предсказаний в JSONL (строка на текст, в исходном порядке); возвращает число текстов"""
+        count = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            for probs in self.iter_proba(texts, chunk_size):
+                for descriptors in self.select(probs, percentile, threshold):
+                    f.write(json.dumps(
+                        {'index': count, 'descriptors': [{'descriptor': d, 'probability': round(p, 4)} for d, p in descriptors]},
+                        ensure_ascii=False
+                    ) + '\n')
+                    count += 1
+                f.flush()
+        return count
+
+
+class DescriptorPredictor(BaseDescriptorPredictor):
+    """Предсказание моделью PyTorch"""
+
+    def __init__(self, model_dir: str, batch_size: int = 32, max_len: int = 512, num_threads: Optional[int] = None,
+                 device: Optional[str] = None, truncation_side: Optional[str] = None):
+        """num_threads - потоки torch на CPU"""
+        super().__init__(model_dir, batch_size, max_len, truncation_side)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.model = BertForSequenceClassification.from_pretrained(model_dir).to(self.device)
+        self.model.eval()
+        logger.info(
+            f"Модель {model_dir} загружена: дескрипторов {len(self.target_labels)}, устройство {self.device}, "
+            f"потоков {torch.get_num_threads()}"
+        )
+
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=torch.from_numpy(input_ids).to(self.device),
+                attention_mask=torch.from_numpy(attention_mask).to(self.device)
+            )
+        return outputs.logits.float().cpu().numpy()
+
+
+class OnnxDescriptorPredictor(BaseDescriptorPredictor):
+    """Предсказание моделью ONNX (в том числе квантованной в int8) через ONNX Runtime на CPU"""
+
+    def __init__(self, model_dir: str, model_file: str = 'model.onnx', batch_size: int = 32, max_len: int = 512,
+                 num_threads: Optional[int] = None, truncation_side: Optional[str] = None):
+        """model_dir - папка, подготовленная onnx_export.export_onnx; num_threads - потоки ONNX Runtime"""
+        import onnxruntime
+
+        super().__init__(model_dir, batch_size, max_len, truncation_side)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=['CPUExecutionProvider']
+        )
+        logger.info(f"Модель {model_dir}/{model_file} загружена в ONNX Runtime: дескрипторов {len(self.target_labels)}")
+
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.session.run(['logits'], {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+
+
+def load_predictor(model_dir: str, backend: str = 'torch', **kwargs) -> BaseDescriptorPredictor:
+    """Предсказатель для среды выполнения backend: 'torch', 'onnx' или 'onnx-int8'"""
+    if backend == 'torch':
+        return DescriptorPredictor(model_dir, **kwargs)
+    if backend == 'onnx':
+        return OnnxDescriptorPredictor(model_dir, 'model.onnx', **kwargs)
+    if backend == 'onnx-int8':
+        return OnnxDescriptorPredictor(model_dir, 'model_int8.onnx', **kwargs)
+    raise ValueError(f"Неизвестная среда выполнения: {backend}")
+
+
+def flatten_descriptors(descriptors) -> list:
+    """Уникальные дескрипторы из словаря категорий (как get_descriptors в ноутбуках)"""
+    if isinstance(descriptors, dict):
+        return list({item for items in descriptors.values() for item in items})
+    if isinstance(descriptors, (list, tuple, np.ndarray)):
+        return list(descriptors)
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Предсказание дескрипторов для чаёв каталога без дескрипторов')
+    parser.add_argument('model_dir', help='папка сохранённой модели (final_tea_model)')
+    parser.add_argument('catalog', help='каталог (Excel или Parquet)')
+    parser.add_argument('output', help='куда сохранить каталог с колонкой bert_descriptors (Excel или Parquet)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-len', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=None, help='потоки на CPU')
+    parser.add_argument('--backend', choices=['torch', 'onnx', 'onnx-int8'], default='torch',
+                        help='onnx и onnx-int8 - папка после onnx_export.py')
+    parser.add_argument('--threshold', type=float, default=0.3)
+    parser.add_argument('--percentile', type=float, default=95)
+    args = parser.parse_args()
+
+    # Общий модуль catalog_io лежит в корне репозитория
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from catalog_io import read_catalog, write_catalog
+
+    predictor = load_predictor(
+        args.model_dir, args.backend, batch_size=args.batch_size, max_len=args.max_len, num_threads=args.threads
+    )
+    tea_df = read_catalog(args.catalog)
+    tea_df['descriptors'] = tea_df['descriptors'].apply(flatten_descriptors)
+
+    started = time.perf_counter()
+    tea_df['bert_descriptors'] = predictor.predict_for_empty(tea_df, threshold=args.threshold, percentile=args.percentile)
+    logger.info(f"Предсказания готовы за {time.perf_counter() - started:.1f} с")
+    write_catalog(tea_df, args.output)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
@@ -0,0 +1,440 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import torch
+from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import MultiLabelBinarizer
+from torch.optim import AdamW
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+from training_data import TokenCache, create_data_loaders
+
+logger = logging.getLogger(__name__)
+
+
+def binary_labels(descriptors: List[str], target_labels: List[str]) -> List[int]:
+    """Бинарный вектор меток, как TeaDataPreprocessor.create_binary_labels"""
+    return [int(label in descriptors) for label in target_labels]
+
+
+def get_pos_weights(labels: List[List[int]]) -> torch.Tensor:
+    """Веса положительных примеров для несбалансированных классов (TeaModelTrainer.get_pos_weights)"""
+    labels = np.array(labels)
+    pos_counts = labels.sum(axis=0)
+    neg_counts = len(labels) - pos_counts
+    return torch.tensor(neg_counts / (pos_counts + 1e-6), dtype=torch.float)
+
+
+def train_epoch(model, data_loader, optimizer, loss_fn, device) -> float:
+    """Одна эпоха обучения (TeaModelTrainer.train_epoch)"""
+    model.train()
+    total_loss = 0
+    for batch in data_loader:
+        optimizer.zero_grad()
+        outputs = model(
+            input_ids=batch['input_ids'].to(device),
+            attention_mask=batch['attention_mask'].to(device)
+        )
+        loss = loss_fn(outputs.logits, batch['labels'].to(device))
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        total_loss += loss.item()
+    return total_loss / len(data_loader)
+
+
+def evaluate(model, data_loader, loss_fn, device, target_labels: List[str]) -> Tuple[float, str]:
+    """Оценка с порогом по 95-му перцентилю для каждого дескриптора (TeaModelTrainer.evaluate)"""
+    model.eval()
+    total_loss = 0
+    all_preds = []
+    all_labels = []
+    with torch.inference_mode():
+        for batch in data_loader:
+            labels = batch['labels'].to(device)
+            outputs = model(
+                input_ids=batch['input_ids'].to(device),
+                attention_mask=batch['attention_mask'].to(device)
+            )
+            total_loss += loss_fn(outputs.logits, labels).item()
+            all_preds.append(torch.sigmoid(outputs.logits).cpu().numpy())
+            all_labels.append(labels.cpu().numpy())
+
+    all_preds = np.concatenate(all_preds)
+    all_labels = np.concatenate(all_labels)
+    thresholds = np.percentile(all_preds, 95, axis=0)
+    preds = (all_preds > thresholds).astype(int)
+    report = classification_report(all_labels, preds, target_names=target_labels, zero_division=0)
+    return total_loss / len(data_loader), report
+
+
+def write_json(path: str, data: Dict):
+    """Запись через временный файл: файл либо целый, либо отсутствует"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def description_with_comments(data: pd.DataFrame) -> pd.Series:
+    """Описание вместе с отзывами, как set_description_with_comments в ноутбуках"""
+    return data['description'].fillna('').astype(str) + ' ' + data['comments'].apply(' '.join)
+
+
+def load_training_data(data_path: str, catalog_path: Optional[str] = None,
+                       with_catalog: bool = False) -> Tuple[pd.DataFrame, List[str]]:
+    """Обучающая таблица и список дескрипторов, как их собирают ноутбуки.
+
+    with_catalog - добавить позиции каталога с дескрипторами (ноутбуки с синонимами)
+    """
+    # Общий модуль catalog_io лежит в корне репозитория
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from catalog_io import read_catalog
+    from descriptor_inference import flatten_descriptors
+
+    if with_catalog and not catalog_path:
+        raise ValueError('with_catalog требует каталог')
+
+    data = read_catalog(data_path)
+    data['descriptors'] = data['descriptors'].apply(flatten_descriptors)
+    label_source = data
+    if catalog_path:
+        label_source = read_catalog(catalog_path)
+        label_source['descriptors'] = label_source['descriptors'].apply(flatten_descriptors)
+        if with_catalog:
+            # tea_df_for_train из ноутбуков с синонимами: исходные позиции с дескрипторами и аугментации
+            catalog_rows = label_source[label_source['descriptors'].apply(len) > 0].copy()
+            catalog_rows['description_with_comments'] = description_with_comments(catalog_rows)
+            data = pd.concat([catalog_rows, data.drop(columns=['augmented'], errors='ignore')], ignore_index=True)
+    target_labels = sorted({item for items in label_source['descriptors'] for item in items})
+    return data, target_labels
+
+
+def final_test_split(data: pd.DataFrame, target_labels: List[str],
+                     random_state: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame, MultiLabelBinarizer]:
+    """Основная часть и финальный тест (20%), как в run_kfold_training"""
+    filtered_df = data[data['descriptors'].apply(len) > 0].copy()
+    filtered_df['binary_label_descriptors'] = filtered_df['descriptors'].apply(
+        lambda descriptors: binary_labels(descriptors, target_labels)
+    )
+    mlb = MultiLabelBinarizer()
+    multilabel_targets = mlb.fit_transform(filtered_df['binary_label_descriptors'].tolist())
+    main_df, final_test_df = train_test_split(
+        filtered_df, test_size=0.2, random_state=random_state, stratify=multilabel_targets
+    )
+    return main_df, final_test_df, mlb
+
+
+def init_worker(level: int):
+    """Настройка логирования в процессе-воркере (spawn не наследует настройки родителя)"""
+    logging.basicConfig(format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s', level=level)
+
+
+def train_fold(task: Dict) -> Dict:
+    """Обучение одного фолда в процессе-воркере; лучший чекпоинт и отчёт сохраняются в папку фолда"""
+    torch.set_num_threads(task['threads'])
+    torch.manual_seed(task['random_state'] + task['fold'])
+    fold_dir = task['fold_dir']
+    os.makedirs(fold_dir, exist_ok=True)
+    device = torch.device(task['device'])
+    started = time.perf_counter()
+
+    tokenizer = BertTokenizerFast.from_pretrained(task['model_name'], truncation_side=task['truncation_side'])
+    config = BertConfig.from_pretrained(task['model_name'], **task['config'])
+    model = BertForSequenceClassification.from_pretrained(task['model_name'], config=config).to(device)
+
+    train_df, val_df = task['train_df'], task['val_df']
+    loss_fn = torch.nn.BCEWithLogitsLoss(
+        pos_weight=get_pos_weights(train_df['binary_label_descriptors'].tolist()).to(device)
+    )
+    train_loader, val_loader = create_data_loaders(
+        train_df, val_df, tokenizer, task['max_len'], task['batch_size'],
+        cache=TokenCache(task['cache_dir']), num_workers=0, seed=task['random_state'] + task['fold'],
+        text_column=task['text_column']
+    )
+    optimizer = AdamW(model.parameters(), lr=task['learning_rate'], weight_decay=0.01)
+
+    # Обучение с ранней остановкой: сохраняется модель с наименьшими потерями на валидации
+    checkpoint_path = os.path.join(fold_dir, 'best_model.pt')
+    best_loss = float('inf')
+    best_report = ''
+    current_patience = 0
+    epochs_run = 0
+    for epoch in range(task['epochs']):
+        train_loss = train_epoch(model, train_loader, optimizer, loss_fn, device)
+        val_loss, val_report = evaluate(model, val_loader, loss_fn, device, task['target_labels'])
+        epochs_run = epoch + 1
+        logger.info(f"Фолд {task['fold'] + 1}, эпоха {epochs_run}: train {train_loss:.4f}, val {val_loss:.4f}")
+        if val_loss < best_loss:
+            best_loss = val_loss
+            best_report = val_report
+            torch.save(model.state_dict(), checkpoint_path)
+            current_patience = 0
+        else:
+            current_patience += 1
+            if current_patience >= task['patience']:
+                break
+
+    with open(os.path.join(fold_dir, 'classification_report.txt'), 'w', encoding='utf-8') as f:
+        f.write(best_report)
+    result = {
+        'fold': task['fold'] + 1,
+        'best_val_loss': best_loss,
+        'last_val_loss': val_loss,
+        'epochs': epochs_run,
+        'seconds': time.perf_counter() - started,
+        'report': best_report,
+    }
+    # metrics.json пишется последним: по нему фолд считается завершённым
+    write_json(os.path.join(fold_dir, 'metrics.json'), result)
+    return result
+
+
+class FoldRunner:
+    """Кросс-валидация run_kfold_training с фолдами в отдельных процессах.
+
+    Разбиение на финальный тест и фолды то же, что в ноутбуках. Каждый фолд
+    обучается в своём процессе со своей долей потоков torch; по завершении фолда
+    на диск сохраняются лучший чекпоинт, метрики и classification_report.
+    При повторном запуске с той же папкой обучаются только недостающие фолды;
+    папка привязана к данным и параметрам прогона (run.json) и с другими не используется.
+    """
+
+    def __init__(self, output_dir: str, model_name: str = "cointegrated/rubert-tiny", truncation_side: str = 'left',
+                 n_splits: int = 5, epochs: int = 50, patience: int = 2, batch_size: int = 8, max_len: int = 512,
+                 learning_rate: float = 2e-5, dropout: float = 0.3, workers: Optional[int] = None,
+                 random_state: int = 42, device: Optional[str] = None, text_column: str = 'augmented_text'):
+        """workers - число одновременно обучаемых фолдов (по умолчанию n_splits, но не больше числа ядер);
+        text_column - колонка с текстами ('description_with_comments' для ноутбуков с синонимами)"""
+        self.output_dir = output_dir
+        self.model_name = model_name
+        self.truncation_side = truncation_side
+        self.n_splits = n_splits
+        self.epochs = epochs
+        self.patience = patience
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.learning_rate = learning_rate
+        self.dropout = dropout
+        self.random_state = random_state
+        self.text_column = text_column
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or min(n_splits, cpu_count)
+        self.threads = max(1, cpu_count // self.workers)
+        self.cache_dir = os.path.join(output_dir, 'token_cache')
+        self.final_dir = os.path.join(output_dir, 'final_tea_model')
+
+    def config_options(self, target_labels: List[str]) -> Dict:
+        return {
+            'hidden_dropout_prob': self.dropout,
+            'attention_probs_dropout_prob': self.dropout,
+            'num_labels': len(target_labels),
+            'problem_type': "multi_label_classification",
+        }
+
+    def split(self, data: pd.DataFrame, target_labels: List[str]):
+        """Финальный тест (20%) и фолды основной части, как в run_kfold_training"""
+        main_df, final_test_df, mlb = final_test_split(data, target_labels, self.random_state)
+        main_targets = mlb.transform(main_df['binary_label_descriptors'].tolist())
+        mlskf = MultilabelStratifiedKFold(n_splits=self.n_splits, shuffle=True, random_state=self.random_state)
+        folds = list(mlskf.split(main_df, main_targets))
+        return main_df, final_test_df, folds
+
+    def fingerprint(self, data: pd.DataFrame, target_labels: List[str]) -> Dict:
+        """Данные и параметры, от которых зависят результаты фолдов"""
+        digest = hashlib.sha256()
+        for text, descriptors in zip(data[self.text_column].astype(str), data['descriptors']):
+            digest.update(json.dumps([text, sorted(descriptors)], ensure_ascii=False).encode('utf-8'))
+        return {
+            'data_sha256': digest.hexdigest(),
+            'rows': len(data),
+            'target_labels': list(target_labels),
+            'text_column': self.text_column,
+            'model_name': self.model_name,
+            'truncation_side': self.truncation_side,
+            'n_splits': self.n_splits,
+            'epochs': self.epochs,
+            'patience': self.patience,
+            'batch_size': self.batch_size,
+            'max_len': self.max_len,
+            'learning_rate': self.learning_rate,
+            'dropout': self.dropout,
+            'random_state': self.random_state,
+        }
+
+    def check_fingerprint(self, fingerprint: Dict):
+        """Запись отпечатка прогона в новую папку или проверка совпадения с уже записанным"""
+        path = os.path.join(self.output_dir, 'run.json')
+        if not os.path.exists(path):
+            if any(self.completed(fold) is not None for fold in range(self.n_splits)):
+                raise ValueError(f"В {self.output_dir} есть фолды без run.json: укажите другую папку")
+            write_json(path, fingerprint)
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        mismatched = sorted(key for key in fingerprint.keys() | saved.keys() if saved.get(key) != fingerprint.get(key))
+        if mismatched:
+            raise ValueError(
+                f"{self.output_dir} относится к другому прогону (отличаются: {', '.join(mismatched)}): "
+                f"укажите другую папку"
+            )
+
+    def fold_dir(self, fold: int) -> str:
+        return os.path.join(self.output_dir, f'fold_{fold + 1}')
+
+    def completed(self, fold: int) -> Optional[Dict]:
+        path = os.path.join(self.fold_dir(fold), 'metrics.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def run(self, data: pd.DataFrame, target_labels: List[str]) -> Tuple[List[Dict], str]:
+        """Обучение недостающих фолдов и финальная оценка; возвращает метрики фолдов и отчёт на тесте"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.check_fingerprint(self.fingerprint(data, target_labels))
+        main_df, final_test_df, folds = self.split(data, target_labels)
+
+        results = {}
+        tasks = []
+        for fold, (train_idx, val_idx) in enumerate(folds):
+            result = self.completed(fold)
+            if result is not None:
+                results[fold] = result
+                continue
+            tasks.append({
+                'fold': fold,
+                'fold_dir': self.fold_dir(fold),
+                'train_df': main_df.iloc[train_idx],
+                'val_df': main_df.iloc[val_idx],
+                'target_labels': target_labels,
+                'model_name': self.model_name,
+                'truncation_side': self.truncation_side,
+                'text_column': self.text_column,
+                'config': self.config_options(target_labels),
+                'epochs': self.epochs,
+                'patience': self.patience,
+                'batch_size': self.batch_size,
+                'max_len': self.max_len,
+                'learning_rate': self.learning_rate,
+                'random_state': self.random_state,
+                'device': self.device,
+                'threads': self.threads,
+                'cache_dir': self.cache_dir,
+            })
+        logger.info(
+            f"Фолдов готово: {len(results)}, к обучению: {len(tasks)}; "
+            f"процессов {min(self.workers, len(tasks))}, потоков torch на процесс {self.threads}"
+        )
+
+        if tasks:
+            # Финальная модель берётся из последнего фолда: после переобучения любого фолда она устарела
+            shutil.rmtree(self.final_dir, ignore_errors=True)
+            # spawn: дочерние процессы не наследуют пулы потоков OpenMP родителя
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)), mp_context=context,
+                                     initializer=init_worker, initargs=(logging.getLogger().level,)) as executor:
+                futures = {executor.submit(train_fold, task): task['fold'] for task in tasks}
+                for future in as_completed(futures):
+                    fold = futures[future]
+                    results[fold] = future.result()
+                    logger.info(f"Фолд {fold + 1} готов: val loss {results[fold]['best_val_loss']:.4f}")
+
+        fold_metrics = [results[fold] for fold in range(self.n_splits)]
+        test_report = self.final_evaluation(main_df.iloc[folds[-1][0]], final_test_df, target_labels)
+        return fold_metrics, test_report
+
+    def final_evaluation(self, last_train_df: pd.DataFrame, final_test_df: pd.DataFrame,
+                         target_labels: List[str]) -> str:
+        """Оценка модели последнего фолда на финальном тесте и сохранение её в формате save_model"""
+        final_dir = self.final_dir
+        report_path = os.path.join(final_dir, 'test_report.txt')
+        if os.path.exists(report_path):
+            with open(report_path, 'r', encoding='utf-8') as f:
+                return f.read()
+
+        torch.set_num_threads(os.cpu_count() or 1)
+        device = torch.device(self.device)
+        tokenizer = BertTokenizerFast.from_pretrained(self.model_name, truncation_side=self.truncation_side)
+        config = BertConfig.from_pretrained(self.model_name, **self.config_options(target_labels))
+        model = BertForSequenceClassification.from_pretrained(self.model_name, config=config)
+        model.load_state_dict(torch.load(os.path.join(self.fold_dir(self.n_splits - 1), 'best_model.pt'), map_location='cpu'))
+        model.to(device)
+
+        loss_fn = torch.nn.BCEWithLogitsLoss(
+            pos_weight=get_pos_weights(last_train_df['binary_label_descriptors'].tolist()).to(device)
+        )
+        _, test_loader = create_data_loaders(
+            final_test_df, final_test_df, tokenizer, batch_size=self.batch_size,
+            cache=TokenCache(self.cache_dir), num_workers=0, text_column=self.text_column
+        )
+        test_loss, test_report = evaluate(model, test_loader, loss_fn, device, target_labels)
+
+        model.save_pretrained(final_dir)
+        tokenizer.save_pretrained(final_dir)
+        write_json(os.path.join(final_dir, 'metrics.json'), {
+            'target_labels': target_labels,
+            'num_labels': len(target_labels),
+            'model_config': {
+                'model_name': self.model_name,
+                'dropout': self.dropout,
+                'batch_size': self.batch_size,
+                'learning_rate': self.learning_rate
+            },
+            'test_loss': test_loss,
+        })
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(test_report)
+        logger.info(f"Финальная модель сохранена в {final_dir}, потери на тесте {test_loss:.4f}")
+        return test_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Кросс-валидация классификатора дескрипторов с параллельными фолдами')
+    parser.add_argument('data', help='обучающая таблица (например, processed_df_aug_LLM.xlsx)')
+    parser.add_argument('output_dir', help='папка прогона: фолды, финальная модель, кеш токенов')
+    parser.add_argument('--catalog', help='каталог, по которому составляется список дескрипторов '
+                                          '(по умолчанию - сама обучающая таблица)')
+    parser.add_argument('--with-catalog', action='store_true',
+                        help='добавить к обучающей таблице позиции каталога с дескрипторами, как в ноутбуках '
+                             'с синонимами (processed_df_aug_syn.xlsx); требует --catalog')
+    parser.add_argument('--text-column', default='augmented_text',
+                        help="колонка с текстами: augmented_text (LLM) или description_with_comments (синонимы)")
+    parser.add_argument('--truncation-side', choices=['left', 'right'], default='left')
+    parser.add_argument('--model-name', default="cointegrated/rubert-tiny")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--n-splits', type=int, default=5)
+    parser.add_argument('--epochs', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.with_catalog and not args.catalog:
+        parser.error('--with-catalog требует --catalog')
+
+    data, target_labels = load_training_data(args.data, args.catalog, args.with_catalog)
+
+    runner = FoldRunner(
+        args.output_dir, model_name=args.model_name, truncation_side=args.truncation_side,
+        n_splits=args.n_splits, epochs=args.epochs, workers=args.workers, text_column=args.text_column
+    )
+    fold_metrics, test_report = runner.run(data, target_labels)
+    for result in fold_metrics:
+        print(f"Фолд {result['fold']}: val loss {result['best_val_loss']:.4f}, эпох {result['epochs']}")
+    print("\nОтчет на тесте:")
+    print(test_report)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+import warnings
+from typing import Dict, List
+import numpy as np
+import torch
+from sklearn.metrics import f1_score
+from transformers import BertForSequenceClassification, BertTokenizerFast
+from descriptor_inference import BaseDescriptorPredictor, load_predictor
+from fold_runner import final_test_split, load_training_data
+
+logger = logging.getLogger(__name__)
+
+
+def export_onnx(model_dir: str, output_dir: str, quantize: bool = True, opset: int = 17) -> List[str]:
+    """Экспорт модели из папки save_model в ONNX и (по умолчанию) динамическое квантование весов в int8.
+
+    Граф оптимизируется под BERT средствами ONNX Runtime (слияние внимания,
+    LayerNorm и GELU в единые операторы). В output_dir кладутся model.onnx,
+    model_int8.onnx, токенизатор и metrics.json, так что папку можно сразу
+    открыть через OnnxDescriptorPredictor.
+    """
+    from onnxruntime.transformers import optimizer
+
+    # Обычная реализация внимания: её шаблон ONNX Runtime умеет сливать в оператор Attention
+    model = BertForSequenceClassification.from_pretrained(model_dir, attn_implementation='eager').eval()
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, 'model.onnx')
+
+    # В примере есть дополнение, чтобы маска внимания попала в граф как вход, а не константа
+    sample = tokenizer(['Пример описания чая для экспорта модели', 'Чай'], padding=True, return_tensors='pt')
+    # Экспортёр на TorchScript: новый (dynamo) требует onnxscript и пока не везде работает с BERT
+    export_options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        torch.onnx.export(
+            model,
+            (sample['input_ids'], sample['attention_mask']),
+            onnx_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'},
+            },
+            opset_version=opset,
+            **export_options
+        )
+    optimized = optimizer.optimize_model(
+        onnx_path, model_type='bert',
+        num_heads=model.config.num_attention_heads, hidden_size=model.config.hidden_size
+    )
+    optimized.save_model_to_file(onnx_path)
+    fused = {name: count for name, count in optimized.get_fused_operator_statistics().items() if count}
+    logger.info(f"Слитые операторы: {fused}")
+
+    tokenizer.save_pretrained(output_dir)
+    shutil.copy(os.path.join(model_dir, 'metrics.json'), os.path.join(output_dir, 'metrics.json'))
+    paths = [onnx_path]
+    logger.info(f"Модель экспортирована в {onnx_path}")
+
+    if quantize:
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(output_dir, 'model_int8.onnx')
+        # Типы выходов слитых операторов (домен com.microsoft) не выводятся автоматически
+        quantize_dynamic(
+            onnx_path, int8_path, weight_type=QuantType.QInt8,
+            extra_options={'DefaultTensorType': onnx.TensorProto.FLOAT}
+        )
+        paths.append(int8_path)
+        logger.info(
+            f"Квантованная модель: {int8_path} ({os.path.getsize(int8_path) / 2 ** 20:.1f} МБ "
+            f"вместо {os.path.getsize(onnx_path) / 2 ** 20:.1f} МБ)"
+        )
+    return paths
+
+
+def measure_speed(predictor: BaseDescriptorPredictor, texts: List[str], latency_samples: int = 50) -> Dict[str, float]:
+    """Пропускная способность батчами и задержка на одиночный текст"""
+    predictor.predict_proba(texts[:predictor.batch_size])
+    started = time.perf_counter()
+    predictor.predict_proba(texts)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for text in texts[:latency_samples]:
+        started = time.perf_counter()
+        predictor.predict_proba([text])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        'throughput_texts_per_second': len(texts) / elapsed,
+        'latency_ms_p50': float(np.percentile(latencies, 50)),
+        'latency_ms_p95': float(np.percentile(latencies, 95)),
+    }
+
+
+def compare_backends(reference: BaseDescriptorPredictor, candidates: Dict[str, BaseDescriptorPredictor],
+                     texts: List[str], true_labels: np.ndarray, percentile: float = 95, threshold: float = 0.3,
+                     latency_samples: int = 50) -> Dict:
+    """Сравнение сред выполнения с эталонной (PyTorch): расхождение вероятностей по дескрипторам,
+    совпадение выбранных дескрипторов, F1 на тестовом наборе, скорость"""
+    labels = reference.target_labels
+
+    def evaluate(predictor: BaseDescriptorPredictor):
+        probs = predictor.predict_proba(texts)
+        selected = np.zeros_like(true_labels)
+        positions = {label: index for index, label in enumerate(labels)}
+        for row, descriptors in enumerate(predictor.select(probs, percentile, threshold)):
+            for descriptor, _ in descriptors:
+                selected[row, positions[descriptor]] = 1
+        scores = {
+            'f1_micro': float(f1_score(true_labels, selected, average='micro', zero_division=0)),
+            'f1_macro': float(f1_score(true_labels, selected, average='macro', zero_division=0)),
+        }
+        return probs, selected, scores
+
+    reference_probs, reference_selected, reference_scores = evaluate(reference)
+    report = {
+        'texts': len(texts),
+        'reference': {**reference_scores, **measure_speed(reference, texts, latency_samples)},
+        'candidates': {},
+    }
+    for name, predictor in candidates.items():
+        probs, selected, scores = evaluate(predictor)
+        drift = np.abs(probs - reference_probs)
+        label_drift = drift.max(axis=0)
+        worst = np.argsort(-label_drift)[:10]
+        report['candidates'][name] = {
+            **scores,
+            'f1_micro_diff': scores['f1_micro'] - reference_scores['f1_micro'],
+            'f1_macro_diff': scores['f1_macro'] - reference_scores['f1_macro'],
+            'max_abs_drift': float(drift.max()),
+            'mean_abs_drift': float(drift.mean()),
+            'label_max_drift': {labels[i]: float(label_drift[i]) for i in worst},
+            'selection_agreement': float((selected == reference_selected).all(axis=1).mean()),
+            **measure_speed(predictor, texts, latency_samples),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Экспорт классификатора в ONNX и сравнение с PyTorch')
+    parser.add_argument('model_dir', help='папка сохранённой модели (final_tea_model)')
+    parser.add_argument('output_dir', help='папка для ONNX-моделей')
+    parser.add_argument('--no-quantize', action='store_true', help='не создавать int8-версию')
+    parser.add_argument('--data', help='таблица, на которой обучалась модель (например, processed_df_aug_LLM.xlsx): '
+                                       'сравнение проводится на её финальном тестовом наборе')
+    parser.add_argument('--catalog', help='каталог, как при обучении в fold_runner.py')
+    parser.add_argument('--with-catalog', action='store_true',
+                        help='модель с синонимами: обучающая таблица дополнялась позициями каталога; требует --catalog')
+    parser.add_argument('--text-column', default='augmented_text',
+                        help="колонка с текстами: augmented_text (LLM) или description_with_comments (синонимы)")
+    parser.add_argument('--report', default='parity_report.json')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+    if args.with_catalog and not args.catalog:
+        parser.error('--with-catalog требует --catalog')
+
+    export_onnx(args.model_dir, args.output_dir, quantize=not args.no_quantize)
+    if not args.data:
+        return
+
+    options = {'batch_size': args.batch_size, 'num_threads': args.threads}
+    reference = load_predictor(args.model_dir, 'torch', **options)
+    candidates = {'onnx': load_predictor(args.output_dir, 'onnx', **options)}
+    if not args.no_quantize:
+        candidates['onnx-int8'] = load_predictor(args.output_dir, 'onnx-int8', **options)
+
+    # Тестовый набор собирается теми же функциями, что и при обучении в fold_runner.py
+    data, target_labels = load_training_data(args.data, args.catalog, args.with_catalog)
+    if target_labels != reference.target_labels:
+        raise ValueError('Дескрипторы модели не совпадают с дескрипторами данных: проверьте --data и --catalog')
+    _, test_df, _ = final_test_split(data, target_labels)
+    true_labels = np.array(test_df['binary_label_descriptors'].tolist(), dtype=np.int64)
+    report = compare_backends(reference, candidates, test_df[args.text_column].astype(str).tolist(), true_labels)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    reference_report = report['reference']
+    print(f"torch: F1 micro {reference_report['f1_micro']:.4f}, {reference_report['throughput_texts_per_second']:.1f} текстов/с, "
+          f"p50 {reference_report['latency_ms_p50']:.1f} мс")
+    for name, result in report['candidates'].items():
+        print(f"{name}: F1 micro {result['f1_micro']:.4f} ({result['f1_micro_diff']:+.4f}), "
+              f"макс. расхождение {result['max_abs_drift']:.4f}, совпадение {result['selection_agreement']:.1%}, "
+              f"{result['throughput_texts_per_second']:.1f} текстов/с, p50 {result['latency_ms_p50']:.1f} мс")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
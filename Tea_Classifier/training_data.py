@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+logger = logging.getLogger(__name__)
+
+
+class TokenizedTexts:
+    """Токены набора текстов: все id подряд в одном массиве и смещения начала каждого текста.
+
+    Массивы открыты через memory-map, поэтому процессы DataLoader читают их
+    из общего кеша страниц, не копируя.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray):
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = np.diff(offsets)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.ids[self.offsets[index]:self.offsets[index + 1]]
+
+
+class TokenCache:
+    """Токенизация текстов один раз с сохранением на диск.
+
+    Ключ кеша - словарь и класс токенизатора, сторона обрезки, max_len и сами
+    тексты: при изменении любого из них тексты токенизируются заново.
+    """
+
+    def __init__(self, directory: str = 'token_cache'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(tokenizer, max_len: Optional[int], texts: Sequence[str]) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps(
+            [type(tokenizer).__name__, tokenizer.truncation_side, max_len, sorted(tokenizer.get_vocab().items())],
+            ensure_ascii=False
+        ).encode('utf-8'))
+        for text in texts:
+            digest.update(text.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def encode(self, tokenizer, texts: Sequence[str], max_len: Optional[int] = None,
+               batch_size: int = 1000) -> TokenizedTexts:
+        """Токены текстов (с [CLS]/[SEP] и обрезкой, как в TeaDataset, но без дополнения)"""
+        texts = [str(text) for text in texts]
+        key = self.make_key(tokenizer, max_len, texts)
+        ids_path = os.path.join(self.directory, f'{key}.ids.npy')
+        offsets_path = os.path.join(self.directory, f'{key}.offsets.npy')
+
+        if not (os.path.exists(ids_path) and os.path.exists(offsets_path)):
+            lengths = []
+            chunks = []
+            for start in range(0, len(texts), batch_size):
+                encoded = tokenizer(
+                    texts[start:start + batch_size], max_length=max_len, truncation=True,
+                    return_attention_mask=False, return_token_type_ids=False
+                )['input_ids']
+                lengths.extend(len(ids) for ids in encoded)
+                chunks.extend(np.asarray(ids, dtype=np.int32) for ids in encoded)
+            offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+            # Запись через временные файлы: прерванная токенизация не оставит битого кеша
+            for path, array in ((ids_path, ids), (offsets_path, offsets)):
+                tmp_path = f'{path[:-4]}.{os.getpid()}.tmp.npy'
+                np.save(tmp_path, array)
+                os.replace(tmp_path, path)
+            logger.info(f"Токенизировано текстов: {len(texts)}, токенов: {len(ids)}")
+
+        return TokenizedTexts(np.load(ids_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r'))
+
+
+class PretokenizedTeaDataset(Dataset):
+    """Замена TeaDataset на заранее токенизированных текстах: элемент - токены без дополнения и метка"""
+
+    def __init__(self, tokens: TokenizedTexts, labels: Sequence):
+        self.tokens = tokens
+        self.labels = torch.as_tensor(np.asarray(labels), dtype=torch.float)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, idx) -> Dict[str, torch.Tensor]:
+        return {
+            'input_ids': torch.from_numpy(self.tokens[idx].astype(np.int64)),
+            'labels': self.labels[idx]
+        }
+
+
+class LengthBucketSampler(Sampler):
+    """Батчи из текстов близкой длины.
+
+    Индексы перемешиваются, делятся на группы по batch_size * bucket_multiplier,
+    внутри группы сортируются по длине и режутся на батчи; порядок батчей
+    перемешивается. Так батчи остаются случайными, а дополнения почти нет.
+    Без shuffle тексты просто идут по возрастанию длины.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, shuffle: bool = True, bucket_multiplier: int = 50,
+                 seed: int = 42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_multiplier = bucket_multiplier
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind='stable')
+            batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        else:
+            # Новое перемешивание на каждую эпоху, воспроизводимое по seed
+            generator = np.random.default_rng(self.seed + self.epoch)
+            self.epoch += 1
+            order = generator.permutation(len(self.lengths))
+            bucket_size = self.batch_size * self.bucket_multiplier
+            batches = []
+            for start in range(0, len(order), bucket_size):
+                bucket = order[start:start + bucket_size]
+                bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+                batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+            batches = [batches[i] for i in generator.permutation(len(batches))]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+class DynamicPaddingCollator:
+    """Дополнение батча до самого длинного текста в нём вместо max_length"""
+
+    def __init__(self, pad_token_id: int):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, batch: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        length = max(len(item['input_ids']) for item in batch)
+        input_ids = torch.full((len(batch), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for row, item in enumerate(batch):
+            input_ids[row, :len(item['input_ids'])] = item['input_ids']
+            attention_mask[row, :len(item['input_ids'])] = 1
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': torch.stack([item['labels'] for item in batch])
+        }
+
+
+def create_data_loaders(train_df: pd.DataFrame, test_df: pd.DataFrame, tokenizer, max_len: Optional[int] = None,
+                        batch_size: int = 16, cache: Optional[TokenCache] = None,
+                        num_workers: Optional[int] = None, seed: int = 42,
+                        text_column: str = 'augmented_text') -> Tuple[DataLoader, DataLoader]:
+    """Замена TeaModelTrainer.create_data_loaders: токены из кеша, батчи по длине, динамическое дополнение.
+
+    Как и в исходном методе, обучающие тексты обрезаются до max_len, а тестовые -
+    до предела токенизатора. Батчи подаются в модель в том же формате
+    (input_ids, attention_mask, labels), поэтому train_epoch и evaluate не меняются.
+    text_column - колонка с текстами: 'augmented_text' в ноутбуках с LLM,
+    'description_with_comments' в ноутбуках с синонимами
+    """
+    cache = cache or TokenCache()
+    if num_workers is None:
+        num_workers = min(4, (os.cpu_count() or 2) // 2)
+    collator = DynamicPaddingCollator(tokenizer.pad_token_id)
+
+    loaders = []
+    for data, length, shuffle in ((train_df, max_len, True), (test_df, None, False)):
+        tokens = cache.encode(tokenizer, data[text_column].tolist(), length)
+        dataset = PretokenizedTeaDataset(tokens, data['binary_label_descriptors'].tolist())
+        loaders.append(DataLoader(
+            dataset,
+            batch_sampler=LengthBucketSampler(tokens.lengths, batch_size, shuffle=shuffle, seed=seed),
+            collate_fn=collator,
+            num_workers=num_workers
+        ))
+    return loaders[0], loaders[1]
@@ -0,0 +1,134 @@
+import logging
+from typing import Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Позиции k наибольших значений по убыванию (argpartition вместо полной сортировки)"""
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind='stable')]
+
+
+class IVFIndex:
+    """Инвертированный индекс по кластерам (IVF) для приближённого поиска ближайших соседей.
+
+    Векторы разбиваются на n_lists кластеров сферическим k-means; запрос
+    сравнивается только с векторами из nprobe ближайших кластеров.
+    nprobe задаёт баланс между полнотой и скоростью поиска.
+    """
+
+    def __init__(self, embeddings: np.ndarray, n_lists: Optional[int] = None, nprobe: int = 8,
+                 n_iter: int = 10, sample_size: int = 100000, seed: int = 42,
+                 centroids: Optional[np.ndarray] = None, assignments: Optional[np.ndarray] = None):
+        self.embeddings = embeddings
+        self.nprobe = nprobe
+        size = len(embeddings)
+
+        if centroids is None:
+            self.n_lists = max(1, min(n_lists or int(np.sqrt(size)), size))
+            rng = np.random.default_rng(seed)
+            sample = embeddings[rng.choice(size, min(size, sample_size), replace=False)]
+            self.centroids = self.__train(np.asarray(sample, dtype=np.float32), n_iter, rng)
+        else:
+            self.centroids = centroids
+            self.n_lists = len(centroids)
+
+        # Списки кластеров хранятся как один массив номеров строк со смещениями
+        if assignments is None:
+            assignments = self.__assign(embeddings)
+        self.assignments = assignments
+        self.list_ids = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.n_lists))])
+        logger.info(f"IVF индекс построен: {size} векторов, {self.n_lists} кластеров")
+
+    def __train(self, sample: np.ndarray, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+        """Сферический k-means по выборке"""
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(self.n_lists):
+                members = sample[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms > 0, norms, 1.0)
+        return centroids
+
+    def __assign(self, embeddings: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        """Номер ближайшего кластера для каждого вектора"""
+        if len(embeddings) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([
+            np.argmax(embeddings[i:i + chunk_size] @ self.centroids.T, axis=1)
+            for i in range(0, len(embeddings), chunk_size)
+        ])
+
+    def updated(self, embeddings: np.ndarray, previous_positions: np.ndarray) -> 'IVFIndex':
+        """Индекс для новой версии каталога с прежними центроидами.
+
+        previous_positions[i] - позиция неизменённой строки i в текущем индексе или -1;
+        заново по кластерам распределяются только новые и изменённые строки.
+        """
+        assignments = np.empty(len(embeddings), dtype=np.int64)
+        reused = previous_positions >= 0
+        assignments[reused] = self.assignments[previous_positions[reused]]
+        if not reused.all():
+            assignments[~reused] = self.__assign(embeddings[np.flatnonzero(~reused)])
+        return IVFIndex(embeddings, nprobe=self.nprobe, centroids=self.centroids, assignments=assignments)
+
+    def search(self, query: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """k ближайших строк среди разрешённых маской"""
+        probe = top_k(self.centroids @ query, min(self.nprobe, self.n_lists))
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[cluster]:self.list_offsets[cluster + 1]] for cluster in probe
+        ])
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        scores = self.embeddings[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+
+class HNSWIndex:
+    """Граф HNSW на основе hnswlib (опционально); ef задаёт баланс полноты и скорости"""
+
+    def __init__(self, embeddings: np.ndarray, ef: int = 64, M: int = 16, ef_construction: int = 200):
+        import hnswlib
+
+        self.index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+        self.index.init_index(max_elements=len(embeddings), M=M, ef_construction=ef_construction)
+        self.index.add_items(embeddings, np.arange(len(embeddings)))
+        self.index.set_ef(ef)
+        logger.info(f"HNSW индекс построен: {len(embeddings)} векторов")
+
+    def search(self, query: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """k ближайших строк среди разрешённых маской"""
+        allowed = int(mask.sum()) if mask is not None else self.index.get_current_count()
+        k = min(k, allowed)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        labels, distances = self.index.knn_query(
+            query, k=k, filter=(lambda label: bool(mask[label])) if mask is not None else None
+        )
+        # Для space='ip' hnswlib возвращает 1 - скалярное произведение
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+
+ANN_INDEXES = {
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+}
+
+
+def create_ann_index(kind: str, embeddings: np.ndarray, **params):
+    """Создание индекса приближённого поиска по названию ('ivf' или 'hnsw')"""
+    if kind not in ANN_INDEXES:
+        raise ValueError(f"Неизвестный тип ANN индекса: {kind}")
+    return ANN_INDEXES[kind](embeddings, **params)
@@ -0,0 +1,131 @@
+import logging
+from typing import Dict, Iterable, List
+import numpy as np
+import pandas as pd
+from text_index import TextIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogIndex:
+    """Фасетный индекс каталога.
+
+    Для каждой категории, дескриптора, партии и провинции хранится
+    отсортированный список номеров строк (int32), цены разобраны в числовой
+    массив один раз. Память индекса пропорциональна числу вхождений значений,
+    а не произведению числа строк на словарь. Фильтры сводятся к пересечению
+    списков и возвращают номера строк без копирования DataFrame.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.size = len(data)
+        self.available = data['available_tea'].to_numpy(dtype=bool)
+        self.prices = pd.to_numeric(data['price'], errors='coerce').to_numpy(dtype=float)
+        # Все строки в порядке выдачи без фильтров: сначала чаи в наличии
+        self.__all_rows = self.__available_first(np.arange(self.size, dtype=np.int32))
+        # Массив отдаётся вызывающему коду без копирования
+        self.__all_rows.flags.writeable = False
+
+        # Точные совпадения по спискам значений
+        self.categories = self.__build_postings(data['tea_category'])
+        self.descriptors = self.__build_postings(data['descriptors'], data['bert_descriptors'])
+
+        # Значения характеристик: партия и провинция ищутся по вхождению подстроки
+        self.shipments = self.__build_postings(data['feature'].apply(lambda x: self.__feature_values(x, 'Партия:')))
+        self.provinces = self.__build_postings(data['feature'].apply(lambda x: self.__feature_values(x, 'Провинция:')))
+
+        # Инвертированный индекс описаний и отзывов (дескрипторы) и combined_text (BM25)
+        self.text = TextIndex(data)
+
+        # Строки, найденные по запросам (словарь значений ограничен каталогом)
+        self.__descriptor_rows: Dict[str, np.ndarray] = {}
+        self.__feature_rows: Dict[tuple, np.ndarray] = {}
+        logger.info(f"Индекс каталога построен: {self.size} позиций")
+
+    @staticmethod
+    def __feature_values(feature, key: str) -> List[str]:
+        if isinstance(feature, dict) and isinstance(feature.get(key), str):
+            return [feature[key]]
+        return []
+
+    @staticmethod
+    def __build_postings(*columns: Iterable) -> Dict[str, np.ndarray]:
+        """Отсортированные номера строк для каждого значения (в нижнем регистре)"""
+        postings: Dict[str, list] = {}
+        for column in columns:
+            for row_id, values in enumerate(column):
+                if not isinstance(values, (list, tuple, set, dict)):
+                    continue
+                for value in values:
+                    postings.setdefault(value.lower(), []).append(row_id)
+        # Значение может повториться в строке или встретиться в обеих колонках
+        return {value: np.unique(np.asarray(rows, dtype=np.int32)) for value, rows in postings.items()}
+
+    def __available_first(self, rows: np.ndarray) -> np.ndarray:
+        available = self.available[rows]
+        return np.concatenate([rows[available], rows[~available]])
+
+    @staticmethod
+    def __union(postings: List[np.ndarray]) -> np.ndarray:
+        if not postings:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(postings)).astype(np.int32, copy=False)
+
+    def category_rows(self, categories: List[str]) -> np.ndarray:
+        """Строки, относящиеся хотя бы к одной из категорий"""
+        return self.__union([
+            self.categories[category.lower()] for category in categories if category.lower() in self.categories
+        ])
+
+    def descriptor_rows(self, descriptor: str) -> np.ndarray:
+        """Строки с дескриптором в разметке, в описании или в отзывах"""
+        key = descriptor.lower()
+        rows = self.__descriptor_rows.get(key)
+        if rows is None:
+            postings = [self.text.phrase_rows(key)]
+            if key in self.descriptors:
+                postings.append(self.descriptors[key])
+            rows = self.__descriptor_rows[key] = self.__union(postings)
+        return rows
+
+    def feature_rows(self, postings: Dict[str, np.ndarray], value: str) -> np.ndarray:
+        """Строки, у которых значение характеристики содержит value"""
+        key = (id(postings), value.lower())
+        rows = self.__feature_rows.get(key)
+        if rows is None:
+            rows = self.__feature_rows[key] = self.__union([
+                posting for feature_value, posting in postings.items() if key[1] in feature_value
+            ])
+        return rows
+
+    def filter(self, filters: Dict) -> np.ndarray:
+        """Номера строк, прошедших фильтры; сначала чаи в наличии"""
+        postings = []
+        if filters['category']:
+            postings.append(self.category_rows(filters['category']))
+        for descriptor in filters['descriptors']:
+            postings.append(self.descriptor_rows(descriptor))
+        if filters['shipment']:
+            postings.append(self.feature_rows(self.shipments, filters['shipment']))
+        if filters['province']:
+            postings.append(self.feature_rows(self.provinces, filters['province']))
+
+        # Пересечение начинается с самого короткого списка
+        if postings:
+            postings.sort(key=len)
+            rows = postings[0]
+            for posting in postings[1:]:
+                rows = np.intersect1d(rows, posting, assume_unique=True)
+            rows = self.__available_first(rows)
+        else:
+            rows = self.__all_rows
+
+        # Фильтры по цене сохраняют порядок строк.
+        # Сравнение с NaN даёт False, как и при pd.to_numeric(errors='coerce')
+        if filters['price_max']:
+            rows = rows[self.prices[rows] <= filters['price_max']]
+
+        if filters['price_min']:
+            rows = rows[self.prices[rows] >= filters['price_min']]
+
+        return rows
@@ -0,0 +1,60 @@
+import hashlib
+import logging
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from catalog_index import CatalogIndex
+from vocabulary_matcher import VocabularyMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot:
+    """Снимок каталога: данные, эмбеддинги и построенные по ним индексы.
+
+    После построения снимок не изменяется. Перезагрузка каталога собирает
+    новый снимок и подменяет ссылку на него, а запросы, начатые на старом
+    снимке, дорабатывают на нём.
+    """
+
+    KEY_COLUMN = 'id'
+
+    def __init__(self, data: pd.DataFrame, embeddings: np.ndarray, vocabulary: VocabularyMatcher,
+                 index: CatalogIndex, ann_index, version: int):
+        self.data = data
+        self.embeddings = embeddings
+        self.vocabulary = vocabulary
+        self.index = index
+        self.ann_index = ann_index
+        self.version = version
+        self.row_hashes = self.hash_rows(data)
+
+    @staticmethod
+    def hash_rows(data: pd.DataFrame) -> Dict:
+        """Хеш содержимого каждой строки по её id"""
+        columns = [column for column in data.columns if column != 'combined_text']
+        return {
+            row[0]: hashlib.sha1(repr(row[1:]).encode('utf-8')).hexdigest()
+            for row in data[[CatalogSnapshot.KEY_COLUMN] + columns].itertuples(index=False, name=None)
+        }
+
+    def diff(self, new_data: pd.DataFrame) -> Dict[str, List]:
+        """Сравнение с новой версией каталога по id: добавленные, изменённые и удалённые позиции"""
+        new_hashes = self.hash_rows(new_data)
+        return {
+            'added': [key for key in new_hashes if key not in self.row_hashes],
+            'changed': [key for key, value in new_hashes.items()
+                        if key in self.row_hashes and self.row_hashes[key] != value],
+            'removed': [key for key in self.row_hashes if key not in new_hashes],
+        }
+
+    def previous_positions(self, new_data: pd.DataFrame) -> np.ndarray:
+        """Для каждой строки нового каталога - позиция той же неизменённой строки в этом снимке, иначе -1"""
+        old_positions = {key: i for i, key in enumerate(self.data[self.KEY_COLUMN])}
+        old_texts = self.data['combined_text'].tolist()
+        positions = np.full(len(new_data), -1, dtype=np.int64)
+        for i, (key, text) in enumerate(zip(new_data[self.KEY_COLUMN], new_data['combined_text'])):
+            old_position = old_positions.get(key)
+            if old_position is not None and old_texts[old_position] == text:
+                positions[i] = old_position
+        return positions
@@ -0,0 +1,26 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+async def catalog_changes(path: str, interval: float) -> AsyncIterator[float]:
+    """Время изменения файла каталога после каждого изменения, когда файл уже дописан"""
+    last_mtime = os.path.getmtime(path)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime == last_mtime:
+                continue
+            # Ждём, пока файл допишется: время изменения должно перестать меняться
+            await asyncio.sleep(1.0)
+            if os.path.getmtime(path) != mtime:
+                continue
+        except OSError as e:
+            logger.error(f"Не удалось проверить файл каталога {path}: {e}")
+            continue
+        last_mtime = mtime
+        yield mtime
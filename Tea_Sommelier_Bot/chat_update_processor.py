@@ -0,0 +1,58 @@
+import asyncio
+from typing import Awaitable, Dict, Hashable, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обработка обновлений разных чатов параллельно, а одного чата - строго по порядку.
+
+    Очередь внутри чата выдерживается до получения слота из max_concurrent_updates:
+    обновления, ждущие предыдущих сообщений своего чата, слотов не занимают, и
+    один активный чат не может задержать остальные.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self.chat_waiting: Dict[Hashable, int] = {}
+
+    @staticmethod
+    def chat_key(update: object) -> Optional[Hashable]:
+        """Чат (или пользователь), к которому относится обновление"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        # Помечен в PTB как final только для проверки типов: здесь порядок чата выдерживается
+        # до семафора базового класса, а не внутри занятого слота
+        key = self.chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self.chat_locks.setdefault(key, asyncio.Lock())
+        self.chat_waiting[key] = self.chat_waiting.get(key, 0) + 1
+        try:
+            # asyncio.Lock отдаёт блокировку в порядке ожидания
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self.chat_waiting[key] -= 1
+            if not self.chat_waiting[key]:
+                del self.chat_waiting[key]
+                del self.chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
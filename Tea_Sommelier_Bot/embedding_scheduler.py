@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Микробатчинг эмбеддингов запросов.
+
+    Запросы, пришедшие в течение max_wait секунд (но не больше max_batch_size),
+    кодируются одним батчевым вызовом в пуле потоков, и каждый вызывающий
+    получает свой вектор.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], executor: Executor,
+                 max_wait: float = 0.005, max_batch_size: int = 32):
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        # Ссылки на задачи кодирования: event loop хранит только слабые, и задачу мог бы собрать GC
+        self.tasks: Set[asyncio.Task] = set()
+
+        # Метрики батчинга
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch = 0
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Эмбеддинг одного текста в составе ближайшего батча"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self):
+        """Отправка накопленных запросов на кодирование"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        task = asyncio.get_running_loop().create_task(self.__encode_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(functools.partial(self.__batch_done, batch))
+
+    def __batch_done(self, batch: List[Tuple[str, asyncio.Future]], task: asyncio.Task):
+        """Задача батча завершена: непредвиденная ошибка логируется и передаётся ожидающим"""
+        self.tasks.discard(task)
+        if task.cancelled():
+            error = asyncio.CancelledError()
+        elif task.exception() is not None:
+            error = task.exception()
+            logger.error(f"Сбой задачи батчевого кодирования: {error!r}")
+        else:
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def __encode_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Одинаковые тексты внутри батча кодируются один раз
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.items += len(batch)
+        self.max_observed_batch = max(self.max_observed_batch, len(batch))
+
+        try:
+            loop = asyncio.get_running_loop()
+            embeddings = await loop.run_in_executor(self.executor, self.encode_fn, texts)
+        except Exception as e:
+            logger.error(f"Ошибка батчевого кодирования запросов: {e!r}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        positions = {text: i for i, text in enumerate(texts)}
+        for text, future in batch:
+            if not future.done():
+                future.set_result(embeddings[positions[text]])
+
+    def stats(self) -> Dict:
+        return {
+            'max_wait': self.max_wait,
+            'max_batch_size': self.max_batch_size,
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_observed_batch': self.max_observed_batch,
+        }
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """Дисковое хранилище эмбеддингов каталога.
+
+    Эмбеддинги лежат в одной матрице .npy, которая открывается через memory-map,
+    а строки адресуются хешем текста. При перезапуске пересчитываются только
+    новые или изменившиеся тексты.
+
+    Каждое сохранение пишет матрицу в новый файл поколения, а манифест keys.json
+    с ключами и именем этого файла подменяется последним. Читатель всегда видит
+    согласованную пару: старую или новую.
+    """
+
+    MATRIX_FILE = 'embeddings.{generation}.{pid}.npy'
+    KEYS_FILE = 'keys.json'
+
+    def __init__(self, store_dir: str, fingerprint: str, batch_size: int = 256):
+        """
+        :param store_dir: директория хранилища
+        :param fingerprint: идентификатор модели и параметров кодирования;
+            при его смене хранилище пересобирается целиком
+        :param batch_size: размер батча при кодировании новых текстов
+        """
+        self.store_dir = store_dir
+        self.fingerprint = fingerprint
+        self.batch_size = batch_size
+        self.keys_path = os.path.join(store_dir, self.KEYS_FILE)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Хеш содержимого текста, по которому адресуется эмбеддинг"""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_embeddings(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Возвращает матрицу эмбеддингов в порядке texts, досчитывая недостающие"""
+        keys = [self.text_hash(text) for text in texts]
+        stored_keys, matrix = self.__load()
+
+        # Каталог не изменился - отдаём memory-mapped матрицу без копирования
+        if matrix is not None and stored_keys == keys:
+            logger.info(f"Эмбеддинги каталога загружены из {self.store_dir}")
+            return matrix
+
+        stored_positions = {key: i for i, key in enumerate(stored_keys)}
+        # Повторяющиеся тексты кодируются один раз
+        missing_positions = {}
+        missing = []
+        for i, key in enumerate(keys):
+            if key not in stored_positions and key not in missing_positions:
+                missing_positions[key] = len(missing)
+                missing.append(i)
+        logger.info(f"Эмбеддинги: {len(keys) - len(missing)} из кеша, {len(missing)} к пересчёту")
+
+        encoded = self.__encode(encode_fn, [texts[i] for i in missing])
+        if matrix is not None:
+            dim = matrix.shape[1]
+        elif len(encoded):
+            dim = encoded.shape[1]
+        else:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        result = np.empty((len(keys), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in missing_positions:
+                result[i] = encoded[missing_positions[key]]
+            else:
+                result[i] = matrix[stored_positions[key]]
+
+        # Сохраняем в порядке каталога, чтобы следующий запуск обошёлся без копирования
+        self.__save(keys, result)
+        return self.__load()[1]
+
+    def __encode(self, encode_fn: Callable[[List[str]], np.ndarray], texts: List[str]) -> np.ndarray:
+        """Кодирование текстов батчами"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = [
+            np.asarray(encode_fn(texts[i:i + self.batch_size]), dtype=np.float32)
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return np.vstack(batches)
+
+    def __read_manifest(self) -> dict:
+        if not os.path.exists(self.keys_path):
+            return {}
+        with open(self.keys_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def __load(self):
+        """Чтение ключей и memory-map матрицы; при несовпадении fingerprint хранилище считается пустым"""
+        try:
+            meta = self.__read_manifest()
+            if not meta.get('matrix'):
+                return [], None
+            if meta.get('fingerprint') != self.fingerprint:
+                logger.info("Параметры модели эмбеддингов изменились, хранилище будет пересобрано")
+                return [], None
+            matrix = np.load(os.path.join(self.store_dir, meta['matrix']), mmap_mode='r')
+            if matrix.shape[0] != len(meta['keys']):
+                logger.warning("Хранилище эмбеддингов повреждено, будет пересобрано")
+                return [], None
+            return meta['keys'], matrix
+        except Exception as e:
+            logger.error(f"Ошибка чтения хранилища эмбеддингов: {e}")
+            return [], None
+
+    def __save(self, keys: List[str], matrix: np.ndarray):
+        """Атомарная запись: матрица нового поколения, затем подмена манифеста"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        try:
+            previous = self.__read_manifest()
+        except Exception:
+            previous = {}
+        # pid в имени: воркеры могут сохранять хранилище одновременно
+        matrix_file = self.MATRIX_FILE.format(generation=previous.get('generation', 0) + 1, pid=os.getpid())
+        tmp_matrix_path = os.path.join(self.store_dir, f'{matrix_file}.tmp')
+        tmp_keys_path = f'{self.keys_path}.{os.getpid()}.tmp'
+        with open(tmp_matrix_path, 'wb') as f:
+            np.save(f, matrix)
+        os.replace(tmp_matrix_path, os.path.join(self.store_dir, matrix_file))
+        with open(tmp_keys_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'fingerprint': self.fingerprint,
+                'generation': previous.get('generation', 0) + 1,
+                'matrix': matrix_file,
+                'keys': keys,
+            }, f)
+        os.replace(tmp_keys_path, self.keys_path)
+
+        # Прежнее поколение больше не адресуется манифестом; уже открытые
+        # memory-map остаются валидными и после удаления файла
+        if previous.get('matrix') and previous['matrix'] != matrix_file:
+            try:
+                os.remove(os.path.join(self.store_dir, previous['matrix']))
+            except FileNotFoundError:
+                pass
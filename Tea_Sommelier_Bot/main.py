@@ -1,5 +1,13 @@
+import os
+import sys
+
+# Общий модуль catalog_io лежит в корне репозитория
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from tea_sommelier_bot import TeaSommelierBot
 from telegram_bot import TelegramBot
+from webhook_server import WebhookServer
+from metrics import MetricsServer, set_trace_sample_rate
 import logging
 
 # Настройка логгирования
@@ -13,12 +21,47 @@ if __name__ == "__main__":
     EXCEL_PATH = "../daochai_classified.xlsx"
     OLLAMA_URL = "http://192.168.0.32:8080/api/generate"
     MODEL_NAME = "gemma3:1b"
+    EMBEDDING_CACHE_DIR = "../embedding_cache"
+    # Эндпоинт Prometheus (http://127.0.0.1:9108/metrics) и доля запросов с подробной трассировкой в логе.
+    # В режиме webhook у каждого воркера свой эндпоинт: 9108, 9109, ...
+    METRICS_PORT = 9108
+    TRACE_SAMPLE_RATE = 0.01
+
+    # Режим работы: "polling" - один процесс; "webhook" - приём обновлений через вебхук
+    # и обработка в WORKERS процессах, разделяющих загруженный каталог и индекс
+    SERVING_MODE = "polling"
+    WEBHOOK_URL = "https://example.com/telegram"
+    WEBHOOK_SECRET = "SECRET"
+    WEBHOOK_PORT = 8443
+    WORKERS = os.cpu_count()
+
+    set_trace_sample_rate(TRACE_SAMPLE_RATE)
+
+    if SERVING_MODE == "webhook":
+        # Воркеры создаются через fork от этого процесса: до загрузки каталога
+        # отключаются пулы потоков torch и токенизаторов
+        WebhookServer.prepare_parent_process()
+
     # Инициализация чайного бота
-    tea_bot = TeaSommelierBot(EXCEL_PATH, OLLAMA_URL, MODEL_NAME)
+    tea_bot = TeaSommelierBot(EXCEL_PATH, OLLAMA_URL, MODEL_NAME, EMBEDDING_CACHE_DIR)
 
     # Токен Telegram бота
     TELEGRAM_TOKEN = "TOKEN"
 
-    # Инициализация и запуск Telegram бота
-    telegram_bot = TelegramBot(TELEGRAM_TOKEN, tea_bot)
-    telegram_bot.run()
\ No newline at end of file
+    # Пользователи Telegram, которым доступна команда /reload
+    ADMIN_IDS = []
+
+    if SERVING_MODE == "webhook":
+        # Telegram бот создаётся в каждом воркере после fork
+        server = WebhookServer(
+            TELEGRAM_TOKEN, tea_bot,
+            lambda bot: TelegramBot(TELEGRAM_TOKEN, bot, admin_ids=ADMIN_IDS),
+            WEBHOOK_URL, workers=WORKERS, port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET,
+            metrics_port=METRICS_PORT
+        )
+        server.run()
+    else:
+        # Инициализация и запуск Telegram бота
+        MetricsServer(METRICS_PORT).start()
+        telegram_bot = TelegramBot(TELEGRAM_TOKEN, tea_bot, admin_ids=ADMIN_IDS)
+        telegram_bot.run()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Awaitable, Callable, TypeVar
+from telegram.error import RetryAfter
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+RETRY_AFTER = REGISTRY.counter('tea_telegram_retry_after_total', 'Ответы Telegram 429 (flood control)')
+
+
+class TokenBucket:
+    """Ограничение частоты: rate отправок в секунду с запасом до capacity подряд.
+
+    Ожидающие получают токены в порядке очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                if wait <= 0:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(wait)
+
+    def block(self, seconds: float):
+        """Пауза после flood control: до её окончания токены не выдаются"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def idle(self) -> bool:
+        """Запас восстановлен и никто не ждёт - корзину можно удалить"""
+        now = time.monotonic()
+        self.refill(now)
+        return not self.lock.locked() and self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class MessageScheduler:
+    """Исходящие вызовы Bot API с учётом лимитов Telegram.
+
+    Общий лимит около 30 сообщений в секунду, в личном чате - около одного
+    в секунду с небольшими всплесками, в группе - 20 в минуту. При ответе 429
+    вызов повторяется через указанное Telegram время, а на паузу ставятся и чат,
+    и общий лимит: flood control может относиться ко всему боту.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, max_retries: int = 3,
+                 max_chats: int = 10000):
+        self.global_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.chat_buckets: OrderedDict = OrderedDict()
+
+    def share_global_rate(self, parts: int):
+        """Доля общего лимита для одного из parts процессов, отправляющих от имени одного бота"""
+        rate = self.global_rate / parts
+        self.global_bucket = TokenBucket(rate, max(1.0, rate))
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов отрицательные id
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > self.max_chats:
+                self.__prune()
+        self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def __prune(self):
+        """Удаление корзин давно неактивных чатов"""
+        for chat_id in list(self.chat_buckets):
+            if len(self.chat_buckets) <= self.max_chats // 2:
+                break
+            if self.chat_buckets[chat_id].idle():
+                del self.chat_buckets[chat_id]
+
+    @staticmethod
+    def retry_delay(error: RetryAfter) -> float:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    async def call(self, chat_id: int, method: Callable[[], Awaitable[T]]) -> T:
+        """Вызов method (отправка или правка сообщения в чате chat_id) с соблюдением лимитов"""
+        for attempt in range(self.max_retries + 1):
+            await self.chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await method()
+            except RetryAfter as e:
+                RETRY_AFTER.inc()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_delay(e)
+                logger.warning(f"Flood control в чате {chat_id}, повтор через {delay} с")
+                self.chat_bucket(chat_id).block(delay)
+                self.global_bucket.block(delay)
@@ -0,0 +1,90 @@
+import re
+from typing import List
+
+# Теги и HTML-сущности (&amp; и т.п.), внутри которых сообщение резать нельзя
+HTML_TOKEN = re.compile(r'(<[^<>]*>|&#?\w+;)')
+HTML_TAG_NAME = re.compile(r'<(/?)([\w-]+)')
+
+
+def utf16_length(text: str) -> int:
+    """Длина текста так, как её считает Telegram: в кодовых единицах UTF-16"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_message(text: str, limit: int, html: bool = False) -> List[str]:
+    """Части текста не длиннее limit (в UTF-16): по границам строк, а слишком длинные строки - по словам.
+
+    При html=True текст не режется внутри тегов и сущностей, а теги, открытые
+    на границе части, закрываются в её конце и открываются заново в следующей.
+    """
+    parts = []
+    open_tags = []  # (имя, открывающий тег)
+    current = reopened = ''
+
+    def with_tag(tags: list, token: str) -> list:
+        match = HTML_TAG_NAME.match(token)
+        if not match:
+            return tags
+        if not match.group(1):
+            return tags + [(match.group(2), token)]
+        # Закрывающий тег снимает последний открытый с тем же именем
+        for i in range(len(tags) - 1, -1, -1):
+            if tags[i][0] == match.group(2):
+                return tags[:i] + tags[i + 1:]
+        return tags
+
+    def closing(tags: list) -> str:
+        return ''.join(f'</{name}>' for name, _ in reversed(tags))
+
+    def flush():
+        nonlocal current, reopened
+        parts.append(current + closing(open_tags))
+        current = reopened = ''.join(tag for _, tag in open_tags)
+
+    for line in text.splitlines(keepends=True):
+        tokens = [token for token in (HTML_TOKEN.split(line) if html else [line]) if token]
+        if current != reopened:
+            # Строка, которая не помещается в текущую часть, начинает новую
+            tags = open_tags
+            for token in tokens:
+                if html and HTML_TOKEN.fullmatch(token):
+                    tags = with_tag(tags, token)
+            if utf16_length(current + line + closing(tags)) > limit:
+                flush()
+
+        for token in tokens:
+            if html and HTML_TOKEN.fullmatch(token):
+                tags = with_tag(open_tags, token)
+                if current != reopened and utf16_length(current + token + closing(tags)) > limit:
+                    flush()
+                current += token
+                open_tags = tags
+                continue
+
+            while token:
+                room = limit - utf16_length(current + closing(open_tags))
+                if utf16_length(token) <= room:
+                    current += token
+                    break
+                # Сколько символов помещается (символ вне BMP занимает две единицы UTF-16)
+                cut, used = 0, 0
+                for char in token:
+                    used += 2 if ord(char) > 0xFFFF else 1
+                    if used > room:
+                        break
+                    cut += 1
+                boundary = token.rfind(' ', 0, cut)
+                if boundary > 0:
+                    cut = boundary + 1
+                if cut == 0:
+                    if current != reopened:
+                        flush()
+                        continue
+                    cut = 1
+                current += token[:cut]
+                token = token[cut:]
+                flush()
+
+    if current != reopened:
+        parts.append(current + closing(open_tags))
+    return parts
@@ -0,0 +1,267 @@
+import bisect
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('tea_trace')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label_value(value) -> str:
+    """Экранирование значения метки по текстовому формату Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape_label_value(value)}"' for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name: str, labels: Dict[str, str]) -> List[str]:
+        with self.lock:
+            lines = []
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": "+Inf"})} {self.count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {self.sum}')
+            lines.append(f'{name}_count{_format_labels(labels)} {self.count}')
+            return lines
+
+
+class Counter:
+    """Монотонно растущий счётчик"""
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name: str, labels: Dict[str, str]) -> List[str]:
+        return [f'{name}{_format_labels(labels)} {self.value}']
+
+
+class MetricFamily:
+    """Метрика с набором меток: отдельный экземпляр на каждое сочетание значений"""
+
+    def __init__(self, name: str, description: str, kind: str, factory: Callable, label_names: Tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.factory = factory
+        self.label_names = label_names
+        self.children: Dict[Tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.factory())
+        return child
+
+    # Методы для метрик без меток
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, child in list(self.children.items()):
+            lines.extend(child.render(self.name, dict(zip(self.label_names, key))))
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.families: List[MetricFamily] = []
+        # Функции, возвращающие текущие значения (name, kind, description, labels, value)
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict, float]]]] = []
+
+    def histogram(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> MetricFamily:
+        family = MetricFamily(name, description, 'histogram', lambda: Histogram(buckets), labels)
+        self.families.append(family)
+        return family
+
+    def counter(self, name: str, description: str, labels: Tuple[str, ...] = ()) -> MetricFamily:
+        family = MetricFamily(name, description, 'counter', Counter, labels)
+        self.families.append(family)
+        return family
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict, float]]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+
+        # Значения одной метрики в формате Prometheus должны идти подряд
+        collected: Dict[str, List[str]] = {}
+        for collector in self.collectors:
+            try:
+                for name, kind, description, labels, value in collector():
+                    if name not in collected:
+                        collected[name] = [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                    collected[name].append(f'{name}{_format_labels(labels)} {value}')
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e!r}")
+        for metric_lines in collected.values():
+            lines.extend(metric_lines)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    'tea_stage_duration_seconds', 'Длительность этапов обработки запроса', labels=('stage',)
+)
+FILTER_CANDIDATES = REGISTRY.histogram(
+    'tea_filter_candidates', 'Число чаев после фильтрации',
+    buckets=(0, 1, 3, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000, 50000, 100000)
+)
+LLM_TOKENS = REGISTRY.counter('tea_llm_tokens_total', 'Токены LLM (prompt - промпт, completion - ответ)', labels=('kind',))
+REQUESTS = REGISTRY.counter('tea_requests_total', 'Обработанные сообщения по результату', labels=('status',))
+
+
+def observe_llm_response(response: Dict):
+    """Учёт токенов из ответа Ollama (prompt_eval_count и eval_count)"""
+    if response.get('prompt_eval_count'):
+        LLM_TOKENS.labels(kind='prompt').inc(response['prompt_eval_count'])
+    if response.get('eval_count'):
+        LLM_TOKENS.labels(kind='completion').inc(response['eval_count'])
+
+
+class RequestTrace:
+    """Трассировка одного запроса: этапы и их длительности"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.spans: List[Tuple[str, float]] = []
+        self.attributes: Dict = {}
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar('current_trace', default=None)
+trace_sample_rate = 0.0
+
+
+def set_trace_sample_rate(rate: float):
+    """Доля запросов, для которых в лог tea_trace пишется подробная трассировка"""
+    global trace_sample_rate
+    trace_sample_rate = rate
+
+
+def observe_stage(stage: str, duration: float):
+    """Длительность этапа: в гистограмму и в трассировку текущего запроса"""
+    STAGE_LATENCY.labels(stage=stage).observe(duration)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append((stage, round(duration, 6)))
+
+
+@contextmanager
+def span(stage: str):
+    """Замер длительности блока кода как этапа stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def annotate(**attributes):
+    """Дополнительные сведения для трассировки текущего запроса"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+@contextmanager
+def trace_request(name: str):
+    """Трассировка запроса с вероятностью trace_sample_rate"""
+    if trace_sample_rate <= 0 or random.random() >= trace_sample_rate:
+        yield None
+        return
+
+    trace = RequestTrace(name)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace_logger.info(json.dumps({
+            'request': trace.name,
+            'started': trace.started,
+            'total': round(time.time() - trace.started, 6),
+            'spans': trace.spans,
+            **trace.attributes
+        }, ensure_ascii=False))
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в фоновом потоке"""
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Метрики доступны на http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
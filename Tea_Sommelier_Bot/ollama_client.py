@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Optional
+import aiohttp
+from metrics import observe_llm_response
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOllamaClient:
+    """Асинхронный клиент Ollama API.
+
+    Держит пул keep-alive соединений, ограничивает общее число одновременных
+    запросов к модели и повторяет запрос при сетевых ошибках и 5xx.
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, ollama_url: str, model_name: str, timeout: float = 120.0, connect_timeout: float = 5.0,
+                 retries: int = 2, backoff_factor: float = 1.0, max_concurrency: int = 4, pool_size: int = 16):
+        self.ollama_url = ollama_url
+        self.ollama_model = model_name
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Сессия создаётся лениво внутри работающего event loop"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def generate(self, prompt: str) -> str:
+        """Запрос к /api/generate без стриминга"""
+        payload = {
+            "model": self.ollama_model,
+            "prompt": prompt,
+            "stream": False
+        }
+
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self.get_session().post(self.ollama_url, json=payload) as response:
+                        response.raise_for_status()
+                        result = await response.json()
+                        observe_llm_response(result)
+                        return result['response']
+                except aiohttp.ClientResponseError as e:
+                    if e.status not in self.RETRY_STATUSES or attempt >= self.retries:
+                        raise
+                    error = e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt >= self.retries:
+                        raise
+                    error = e
+
+                delay = self.backoff_factor * (2 ** attempt)
+                logger.warning(f"Ошибка при запросе к Ollama ({error!r}), повтор через {delay} с")
+                await asyncio.sleep(delay)
+
+    async def generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Запрос к /api/generate со стримингом: выдаёт фрагменты текста по мере генерации.
+
+        Повтор возможен только до получения первого фрагмента.
+        """
+        payload = {
+            "model": self.ollama_model,
+            "prompt": prompt,
+            "stream": True
+        }
+
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                received = False
+                try:
+                    async with self.get_session().post(self.ollama_url, json=payload) as response:
+                        response.raise_for_status()
+                        # Ollama присылает по одному JSON-объекту на строку
+                        async for line in response.content:
+                            if not line.strip():
+                                continue
+                            chunk = json.loads(line)
+                            if chunk.get('response'):
+                                received = True
+                                yield chunk['response']
+                            if chunk.get('done'):
+                                # Последний объект содержит статистику генерации
+                                observe_llm_response(chunk)
+                                return
+                        return
+                except aiohttp.ClientResponseError as e:
+                    if e.status not in self.RETRY_STATUSES or attempt >= self.retries:
+                        raise
+                    error = e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if received or attempt >= self.retries:
+                        raise
+                    error = e
+
+                delay = self.backoff_factor * (2 ** attempt)
+                logger.warning(f"Ошибка при запросе к Ollama ({error!r}), повтор через {delay} с")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List
+import numpy as np
+
+
+class TTLCache:
+    """LRU-кеш с ограничением размера, временем жизни записей и счётчиками попаданий"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Значение по ключу или None, если записи нет или она устарела"""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or time.monotonic() - item[0] > self.ttl:
+                if item is not None:
+                    del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value):
+        """Сохранение значения с вытеснением самых старых записей"""
+        with self.lock:
+            self.items[key] = (time.monotonic(), value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+
+class RecommendationCache:
+    """Многоуровневый кеш рекомендаций.
+
+    - эмбеддинги запросов по нормализованному тексту запроса;
+    - результаты поиска по (фильтры, эмбеддинг запроса, top_n);
+    - тексты LLM по упорядоченному набору рекомендованных чаев.
+
+    Очищается целиком при перезагрузке каталога; ключи результатов и текстов
+    дополнительно содержат версию каталога, чтобы запросы, завершающиеся на
+    старом снимке, не вернули устаревшие записи в кеш нового.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        self.query_embeddings = TTLCache(max_size, ttl)
+        self.search_results = TTLCache(max_size, ttl)
+        self.llm_texts = TTLCache(max_size, ttl)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Нормализация текста запроса: регистр и пробелы"""
+        return ' '.join(query.lower().split())
+
+    @staticmethod
+    def search_key(version: int, filters: Dict, query_embedding: np.ndarray, top_n: int) -> tuple:
+        """Ключ результата поиска"""
+        filters_key = tuple(
+            (name, tuple(sorted(set(value))) if isinstance(value, list) else value)
+            for name, value in sorted(filters.items())
+        )
+        embedding_key = hashlib.sha1(np.ascontiguousarray(query_embedding).tobytes()).hexdigest()
+        return version, filters_key, embedding_key, top_n
+
+    @staticmethod
+    def llm_key(version: int, tea_ids: List) -> tuple:
+        """Ключ текста LLM: версия каталога и упорядоченный набор чаев"""
+        return version, tuple(tea_ids)
+
+    def clear(self):
+        self.query_embeddings.clear()
+        self.search_results.clear()
+        self.llm_texts.clear()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            'query_embeddings': self.query_embeddings.stats(),
+            'search_results': self.search_results.stats(),
+            'llm_texts': self.llm_texts.stats(),
+        }
@@ -1,50 +1,226 @@
+import asyncio
+import contextvars
+import functools
 import logging
+import time
 import pandas as pd
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import requests
 import re
-import ast
-from typing import List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple, Union
+from ann_index import create_ann_index, top_k
+from catalog_io import read_catalog
+from embedding_store import EmbeddingStore
+from embedding_scheduler import EmbeddingBatcher
+from catalog_index import CatalogIndex
+from catalog_snapshot import CatalogSnapshot
+from vocabulary_matcher import VocabularyMatcher
+from ollama_client import AsyncOllamaClient
+from recommendation_cache import RecommendationCache
+from metrics import REGISTRY, FILTER_CANDIDATES, annotate, observe_llm_response, observe_stage, span
 
 logger = logging.getLogger(__name__)
 
 class TeaSommelierBot:
-    def __init__(self, excel_path:str, ollama_url: str, model_name: str):
+    EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+    LLM_ERROR_TEXT = "Извините, не могу получить ответ от модели."
+    # Колонки каталога, которые нужны боту; остальные не загружаются
+    CATALOG_COLUMNS = [
+        'id', 'title', 'description', 'comments', 'descriptors', 'bert_descriptors',
+        'feature', 'price', 'available_tea', 'tea_category', 'url'
+    ]
+    # Во сколько раз больше кандидатов отбирает приближённый поиск для точного переранжирования
+    ANN_RERANK_FACTOR = 4
+
+    def __init__(self, excel_path:str, ollama_url: str, model_name: str,
+                 embedding_cache_dir: str = 'embedding_cache', embedding_batch_size: int = 256,
+                 ann_index: Optional[str] = None, ann_params: Optional[Dict] = None, ann_min_candidates: int = 20000,
+                 ollama_timeout: float = 120.0, max_llm_concurrency: int = 4, search_workers: int = 4,
+                 cache_size: int = 10000, cache_ttl: float = 3600.0,
+                 query_batch_window: float = 0.005, query_batch_size: int = 32, text_weight: float = 0.0):
         """
         Инициализация чайного бота
-        """
-        # Загрузка данных
-        self.data = pd.read_excel(excel_path)
 
-        # Преобразование available_tea в булевый тип
-        self.data['available_tea'] = self.data['available_tea'].astype(bool)
-        self.data['descriptors'] = self.data['descriptors'].apply(ast.literal_eval)
-        self.data['feature'] = self.data['feature'].apply(ast.literal_eval)
-        self.data['tea_category'] = self.data['tea_category'].apply(ast.literal_eval)
-        self.data['comments'] = self.data['comments'].apply(ast.literal_eval)
-        self.data['bert_descriptors'] = self.data['bert_descriptors'].apply(ast.literal_eval)
+        ann_index включает приближённый поиск ('ivf' или 'hnsw') для выборок
+        от ann_min_candidates строк; ann_params передаются индексу (nprobe, ef и т.д.)
+
+        search_workers ограничивает число потоков для эмбеддинга и поиска в асинхронном режиме,
+        max_llm_concurrency - число одновременных запросов к Ollama
+
+        cache_size и cache_ttl задают размер и время жизни (в секундах) каждого уровня кеша
+
+        query_batch_window и query_batch_size - окно (в секундах) и размер микробатча
+        эмбеддингов запросов в асинхронном режиме
+
+        text_weight - вес нормированной оценки BM25 в ранжировании рядом со сходством эмбеддингов;
+        по умолчанию 0 - только эмбеддинги, как до появления текстового индекса (например, 0.1 - включить)
+        """
+        self.catalog_path = excel_path
+        self.reload_lock = threading.Lock()
 
         # Инициализация модели для эмбеддингов
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model = SentenceTransformer(self.EMBEDDING_MODEL_NAME)
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_store = EmbeddingStore(
+            embedding_cache_dir, f'{self.EMBEDDING_MODEL_NAME}:normalized', embedding_batch_size
+        )
+
+        # Кеш эмбеддингов запросов, результатов поиска и текстов LLM
+        self.cache = RecommendationCache(cache_size, cache_ttl)
 
-        # Подготовка данных
-        self.prepare_data()
+        # Настройки приближённого поиска
+        self.ann_index_kind = ann_index
+        self.ann_params = ann_params or {}
+        self.ann_min_candidates = ann_min_candidates
+        self.text_weight = text_weight
+
+        # Загрузка и подготовка данных
+        self.snapshot = self.prepare_data(self.load_catalog(excel_path))
 
         # Настройки Ollama
         self.ollama_url = ollama_url
         self.ollama_model = model_name
+        self.ollama_timeout = ollama_timeout
+        self.ollama_client = AsyncOllamaClient(
+            ollama_url, model_name, timeout=ollama_timeout, max_concurrency=max_llm_concurrency
+        )
+
+        # Пул потоков для CPU-нагрузки асинхронного режима
+        self.executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix='tea-search')
+
+        # Запросы параллельных чатов кодируются общими батчами
+        self.query_batcher = EmbeddingBatcher(
+            self.encode_batch, self.executor, max_wait=query_batch_window, max_batch_size=query_batch_size
+        )
+
+        # Состояние кеша, микробатчинга и каталога в /metrics
+        REGISTRY.register_collector(self.collect_metrics)
+
+    def collect_metrics(self) -> Iterator[Tuple[str, str, str, Dict, float]]:
+        """Текущие значения для эндпоинта метрик"""
+        for level, stats in self.cache.stats().items():
+            yield 'tea_cache_hits_total', 'counter', 'Попадания в кеш', {'level': level}, stats['hits']
+            yield 'tea_cache_misses_total', 'counter', 'Промахи кеша', {'level': level}, stats['misses']
+            yield 'tea_cache_size', 'gauge', 'Число записей в кеше', {'level': level}, stats['size']
+
+        batcher_stats = self.query_batcher.stats()
+        yield 'tea_query_batches_total', 'counter', 'Батчи эмбеддингов запросов', {}, batcher_stats['batches']
+        yield 'tea_query_batch_items_total', 'counter', 'Запросы, закодированные в батчах', {}, batcher_stats['items']
+        # Текущие настройки микробатчинга, чтобы сопоставлять их с задержкой запросов
+        yield 'tea_query_batch_max_wait_seconds', 'gauge', 'Окно сбора батча запросов, с', {}, batcher_stats['max_wait']
+        yield 'tea_query_batch_max_size', 'gauge', 'Максимальный размер батча запросов', {}, batcher_stats['max_batch_size']
+
+        snapshot = self.snapshot
+        yield 'tea_catalog_version', 'gauge', 'Версия снимка каталога', {}, snapshot.version
+        yield 'tea_catalog_rows', 'gauge', 'Число чаев в каталоге', {}, len(snapshot.data)
 
-    def prepare_data(self):
-        """Подготовка данных для поиска"""
+    @property
+    def data(self) -> pd.DataFrame:
+        """Данные текущего снимка каталога"""
+        return self.snapshot.data
+
+    def load_catalog(self, catalog_path: str) -> pd.DataFrame:
+        """Загрузка каталога из Parquet или Excel (только нужные боту колонки)"""
+        data = read_catalog(catalog_path, columns=self.CATALOG_COLUMNS)
+
+        # Преобразование available_tea в булевый тип
+        data['available_tea'] = data['available_tea'].astype(bool)
+        return data.reset_index(drop=True)
+
+    def prepare_data(self, data: pd.DataFrame, previous: Optional[CatalogSnapshot] = None) -> CatalogSnapshot:
+        """Подготовка данных для поиска: эмбеддинги и индексы нового снимка каталога"""
         # Очистка и предобработка текстовых полей
-        self.data['combined_text'] = self.data.apply(self.combine_text_fields, axis=1)
+        data['combined_text'] = data.apply(self.combine_text_fields, axis=1)
+
+        # Создание нормированных эмбеддингов батчами; неизменившиеся тексты берутся из хранилища.
+        # Матрица float32 остаётся одним непрерывным блоком (memory-map)
+        texts = data['combined_text'].astype(str).tolist()
+        embeddings = self.embedding_store.get_embeddings(texts, self.encode_batch)
+
+        # Индекс приближённого поиска для больших каталогов; при перезагрузке IVF
+        # сохраняет кластеры и распределяет по ним только изменённые строки
+        ann_index = None
+        if self.ann_index_kind:
+            if previous is not None and hasattr(previous.ann_index, 'updated'):
+                ann_index = previous.ann_index.updated(embeddings, previous.previous_positions(data))
+            else:
+                ann_index = create_ann_index(self.ann_index_kind, embeddings, **self.ann_params)
+
+        return CatalogSnapshot(
+            data,
+            embeddings,
+            # Словарь терминов для извлечения фильтров из запроса
+            VocabularyMatcher(data),
+            # Индекс для фильтрации без копирования данных
+            CatalogIndex(data),
+            ann_index,
+            version=previous.version + 1 if previous is not None else 1
+        )
 
-        # Создание эмбеддингов для каждого чая
-        self.data['embedding'] = self.data['combined_text'].apply(
-            lambda x: self.embedding_model.encode(str(x))
+    def reload_catalog(self, excel_path: Optional[str] = None) -> Dict[str, List]:
+        """Перезагрузка каталога без остановки бота.
+
+        Новый каталог сравнивается с текущим по id, эмбеддинги пересчитываются только
+        для изменившихся текстов. Готовый снимок подменяет текущий одной операцией,
+        запросы в процессе обработки завершаются на старом снимке.
+        """
+        with self.reload_lock:
+            excel_path = excel_path or self.catalog_path
+            previous = self.snapshot
+            data = self.load_catalog(excel_path)
+
+            diff = previous.diff(data)
+            if not any(diff.values()):
+                logger.info("Каталог не изменился, перезагрузка не требуется")
+                return diff
+
+            self.snapshot = self.prepare_data(data, previous)
+            self.catalog_path = excel_path
+
+            # Кешированные результаты относятся к прежнему каталогу
+            self.cache.clear()
+            logger.info(
+                f"Каталог перезагружен (версия {self.snapshot.version}): добавлено {len(diff['added'])}, "
+                f"изменено {len(diff['changed'])}, удалено {len(diff['removed'])}"
+            )
+            return diff
+
+    async def reload_catalog_async(self, excel_path: Optional[str] = None) -> Dict[str, List]:
+        """Перезагрузка каталога в отдельном потоке"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.reload_catalog, excel_path)
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Батчевое кодирование текстов моделью эмбеддингов"""
+        return self.embedding_model.encode(
+            texts, batch_size=self.embedding_batch_size, convert_to_numpy=True, normalize_embeddings=True
         )
 
+    def encode_query(self, query: str) -> np.ndarray:
+        """Нормированный эмбеддинг запроса (кешируется по нормализованному тексту)"""
+        normalized_query = self.cache.normalize_query(query)
+        query_embedding = self.cache.query_embeddings.get(normalized_query)
+        if query_embedding is None:
+            with span('encode_query'):
+                query_embedding = self.embedding_model.encode(
+                    normalized_query, convert_to_numpy=True, normalize_embeddings=True
+                ).astype(np.float32)
+            self.cache.query_embeddings.set(normalized_query, query_embedding)
+        return query_embedding
+
+    async def encode_query_async(self, query: str) -> np.ndarray:
+        """Нормированный эмбеддинг запроса через микробатчинг"""
+        normalized_query = self.cache.normalize_query(query)
+        query_embedding = self.cache.query_embeddings.get(normalized_query)
+        if query_embedding is None:
+            with span('encode_query'):
+                query_embedding = (await self.query_batcher.encode(normalized_query)).astype(np.float32)
+            self.cache.query_embeddings.set(normalized_query, query_embedding)
+        return query_embedding
+
     def combine_text_fields(self, row: pd.Series) -> str:
         """Объединение текстовых полей в один строку для поиска"""
         allText = []
@@ -70,8 +246,9 @@ class TeaSommelierBot:
 
         return ' '.join(allText)
 
-    def extract_filters(self, query: str) -> Dict:
+    def extract_filters(self, query: str, snapshot: Optional[CatalogSnapshot] = None) -> Dict:
         """Извлечение фильтров из пользовательского запроса"""
+        snapshot = snapshot or self.snapshot
         filters = {
             'category': [],
             'price_max': None,
@@ -81,130 +258,106 @@ class TeaSommelierBot:
             'province': None
         }
 
-        # Поиск категории чая
-        tea_categories = self.data['tea_category'].dropna()
-        for category_row in tea_categories:
-            for category in category_row:
-                if category.lower() in query.lower():
-                    filters['category'].append(category)
+        query_lower = query.lower()
+
+        # Поиск категорий, дескрипторов (ноток вкуса/аромата), партии и провинции за один проход
+        matches = snapshot.vocabulary.match(query_lower)
+        filters['category'] = matches['category']
+        filters['descriptors'] = matches['descriptors']
+        if matches['shipment']:
+            filters['shipment'] = max(matches['shipment'], key=len)
+        if matches['province']:
+            filters['province'] = max(matches['province'], key=len)
 
         # Поиск максимальной цены
-        price_matches = re.findall(r'до (\d+)', query.lower())
+        price_matches = re.findall(r'до (\d+)', query_lower)
         if price_matches:
             filters['price_max'] = float(price_matches[0])
 
         # Поиск минимальной цены
-        price_matches = re.findall(r'от (\d+)', query.lower())
+        price_matches = re.findall(r'от (\d+)', query_lower)
         if price_matches:
             filters['price_min'] = float(price_matches[0])
 
-        # Поиск дескрипторов (ноток вкуса/аромата)
-        descriptors = self.data['descriptors'].dropna()
-        for desc_row in descriptors:
-            for desc in desc_row:
-                if desc.lower() in query.lower():
-                    filters['descriptors'].append(desc)
-
-        bert_descriptors = self.data['bert_descriptors'].dropna()
-        for desc_row in bert_descriptors:
-            for desc in desc_row:
-                if desc.lower() in query.lower():
-                    filters['descriptors'].append(desc)
-
-        # Поиск по партии чая
-        shipments = self.data['feature'].dropna()
-        for shipment in shipments:
-            if isinstance(shipment, dict):
-                shipment_value = shipment.get('Партия:')
-                if shipment_value is not None:
-                    if shipment_value.lower() in query.lower():
-                        filters['shipment'] = shipment_value
-
-        # Поиск по провинции чая
-        provinces = self.data['feature'].dropna()
-        for province in provinces:
-            if isinstance(province, dict):
-                province_value = province.get('Провинция:')
-                if province_value is not None:
-                    if province_value.lower() in query.lower():
-                        filters['province'] = province_value
-
         return filters
 
-    def apply_filters(self, filters: Dict) -> pd.DataFrame:
-        """Применение фильтров к данным"""
-        filtered_data = self.data.copy()
-
-        # Фильтр по доступности - сначала всегда доступные чаи
-        filtered_data = filtered_data.sort_values('available_tea', ascending=False)
-
-        # Фильтр по категории
-        if filters['category']:
-            filtered_data = filtered_data[filtered_data['tea_category'].apply(lambda x: any(cat.lower() in [item.lower() for item in x] for cat in filters['category']))]
-
-        # Фильтр по цене
-        if filters['price_max']:
-            filtered_data = filtered_data[
-                pd.to_numeric(filtered_data['price'], errors='coerce') <= filters['price_max']
-            ]
-
-        if filters['price_min']:
-            filtered_data = filtered_data[
-                pd.to_numeric(filtered_data['price'], errors='coerce') >= filters['price_min']
-            ]
-
-            # Фильтр по дескрипторам
-        if filters['descriptors']:
-            for desc in filters['descriptors']:
-                filtered_data = filtered_data[
-                    filtered_data['descriptors'].apply(lambda x: desc.lower() in [item.lower() for item in x]) |
-                    filtered_data['bert_descriptors'].apply(lambda x: desc.lower() in [item.lower() for item in x]) |
-                    filtered_data['description'].str.contains(desc, case=False, na=False) |
-                    filtered_data['comments'].apply(lambda x: any(desc.lower() in str(c).lower() for c in x))
-                ]
-
-        # Фильтр по партии
-        if filters['shipment']:
-            filtered_data = filtered_data[
-                filtered_data['feature'].apply(
-                    lambda x: isinstance(x, dict) and 'Партия:' in x and filters['shipment'].lower() in x['Партия:'].lower()
-                )
-            ]
-
-        # Фильтр по провинции
-        if filters['province']:
-            filtered_data = filtered_data[
-                filtered_data['feature'].apply(
-                    lambda x: isinstance(x, dict) and 'Провинция:' in x and filters['province'].lower() in x['Провинция:'].lower()
-                )
-            ]
-
-        return filtered_data
-
-    def semantic_search(self, query: str, filtered_data: pd.DataFrame, top_n: int = 5) -> pd.DataFrame:
-        """Семантический поиск среди отфильтрованных чаев"""
-        if filtered_data.empty:
-            return filtered_data
+    def filter_row_ids(self, filters: Dict, snapshot: Optional[CatalogSnapshot] = None) -> np.ndarray:
+        """Номера строк, прошедших фильтры (сначала чаи в наличии), без копирования данных"""
+        snapshot = snapshot or self.snapshot
+        return snapshot.index.filter(filters)
+
+    def apply_filters(self, filters: Dict, snapshot: Optional[CatalogSnapshot] = None) -> pd.DataFrame:
+        """Применение фильтров к данным: подходящие строки, сначала доступные чаи"""
+        snapshot = snapshot or self.snapshot
+        return snapshot.data.iloc[self.filter_row_ids(filters, snapshot)]
+
+    def semantic_search(self, query: str, row_ids: Union[np.ndarray, pd.DataFrame], top_n: int = 5,
+                        query_embedding: Optional[np.ndarray] = None,
+                        snapshot: Optional[CatalogSnapshot] = None) -> pd.DataFrame:
+        """Семантический поиск среди отфильтрованных чаев: номера строк из filter_row_ids
+        или DataFrame из apply_filters"""
+        snapshot = snapshot or self.snapshot
+        if isinstance(row_ids, pd.DataFrame):
+            # Индекс данных снимка - номера строк (load_catalog сбрасывает его)
+            row_ids = row_ids.index.to_numpy()
+        if len(row_ids) == 0:
+            return snapshot.data.iloc[[]]
 
         # Эмбеддинг запроса
-        query_embedding = self.embedding_model.encode(query)
-
-        # Вычисление косинусного сходства
-        embeddings = np.stack(filtered_data['embedding'].values)
-        similarities = np.dot(embeddings, query_embedding) / (
-                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding)
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
+
+        if snapshot.ann_index is not None and len(row_ids) >= self.ann_min_candidates:
+            # Приближённый поиск отбирает кандидатов с запасом, окончательный порядок - точный
+            candidates = top_n * self.ANN_RERANK_FACTOR if self.text_weight else top_n
+            row_ids, _ = self.__ann_search(snapshot, query_embedding, row_ids, candidates)
+
+        # Оценка BM25 по тексту запроса дополняет сходство эмбеддингов
+        text_scores = snapshot.index.text.bm25(query, row_ids) if self.text_weight else None
+        result_ids, similarities = self.__exact_search(
+            snapshot, query_embedding, row_ids, top_n, text_scores, self.text_weight
         )
 
-        # Добавление сходства в DataFrame и сортировка
-        filtered_data['similarity'] = similarities
-
-        # Сортировка сначала по доступности, затем по сходству
-        filtered_data = filtered_data.sort_values(
-            ['available_tea', 'similarity'],
-            ascending=[False, False]
+        recommendations = snapshot.data.iloc[result_ids].copy()
+        recommendations['similarity'] = similarities
+        return recommendations
+
+    @staticmethod
+    def __exact_search(snapshot: CatalogSnapshot, query_embedding: np.ndarray, row_ids: np.ndarray, top_n: int,
+                       text_scores: Optional[np.ndarray] = None, text_weight: float = 0.0):
+        """Точный поиск: скалярное произведение с нормированной матрицей и top-k"""
+        # При большой доле кандидатов дешевле умножить всю матрицу, чем копировать строки
+        if len(row_ids) * 3 > len(snapshot.embeddings):
+            similarities = (snapshot.embeddings @ query_embedding)[row_ids]
+        else:
+            similarities = snapshot.embeddings[row_ids] @ query_embedding
+
+        # Сначала чаи в наличии, затем по сходству (сходство лежит в [-1, 1])
+        ranking = similarities + 3.0 * snapshot.index.available[row_ids]
+        if text_scores is not None and len(text_scores) and text_scores.max() > 0:
+            ranking = ranking + text_weight * text_scores / text_scores.max()
+        best = top_k(ranking, top_n)
+        return row_ids[best], similarities[best]
+
+    def __ann_search(self, snapshot: CatalogSnapshot, query_embedding: np.ndarray, row_ids: np.ndarray, top_n: int):
+        """Приближённый поиск: сначала среди чаев в наличии, затем остальные"""
+        allowed = np.zeros(len(snapshot.embeddings), dtype=bool)
+        allowed[row_ids] = True
+
+        result_ids, similarities = snapshot.ann_index.search(
+            query_embedding, top_n, allowed & snapshot.index.available
         )
-
-        return filtered_data.head(top_n)
+        if len(result_ids) < top_n:
+            extra_ids, extra_similarities = snapshot.ann_index.search(
+                query_embedding, top_n - len(result_ids), allowed & ~snapshot.index.available
+            )
+            result_ids = np.concatenate([result_ids, extra_ids])
+            similarities = np.concatenate([similarities, extra_similarities])
+
+        # Индекс может не найти достаточно кандидатов в просмотренных кластерах
+        if len(result_ids) < min(top_n, len(row_ids)):
+            return self.__exact_search(snapshot, query_embedding, row_ids, top_n)
+        return result_ids, similarities
 
     def query_ollama(self, prompt: str) -> str:
         """Запрос к Ollama API"""
@@ -215,24 +368,33 @@ class TeaSommelierBot:
         }
 
         try:
-            response = requests.post(self.ollama_url, json=payload)
-            response.raise_for_status()
-            return response.json()['response']
+            with span('llm'):
+                response = requests.post(self.ollama_url, json=payload, timeout=self.ollama_timeout)
+                response.raise_for_status()
+                result = response.json()
+            observe_llm_response(result)
+            return result['response']
         except Exception as e:
             logger.error(f"Ошибка при запросе к Ollama: {e}")
-            return "Извините, не могу получить ответ от модели."
+            return self.LLM_ERROR_TEXT
 
-    def generate_recommendation(self, query: str, recommendations: List[Dict]) -> str:
-        """Генерация текста рекомендации с помощью LLM"""
-        if not recommendations:
-            return "К сожалению, не нашлось подходящих чаев по вашему запросу."
+    async def query_ollama_async(self, prompt: str) -> str:
+        """Асинхронный запрос к Ollama API"""
+        try:
+            with span('llm'):
+                return await self.ollama_client.generate(prompt)
+        except Exception as e:
+            logger.error(f"Ошибка при запросе к Ollama: {e!r}")
+            return self.LLM_ERROR_TEXT
 
+    def build_prompt(self, recommendations: List[Dict]) -> str:
+        """Промпт для LLM по найденным чаям"""
         # Подготовка информации о рекомендациях для промпта
         recs_text = "\n\n".join(
             f"Чай #{i + 1}:\n"
             f"Название: {rec['title']}\n"
             f"Описание: {rec['description']}\n"
-            f"Дескрипторы вкуса/аромата: {rec['descriptors'].extend(rec['bert_descriptors'])}\n"
+            f"Дескрипторы вкуса/аромата: {list(rec['descriptors']) + list(rec['bert_descriptors'])}\n"
             f"Категория: {rec['tea_category']}\n"
             f"Цена: {rec['price']} руб.\n"
             f"Особенности: {rec.get('feature', 'не указаны')}\n"
@@ -243,7 +405,7 @@ class TeaSommelierBot:
         )
 
         # Создание промпта
-        prompt = f"""
+        return f"""
         Ты — профессиональный чайный сомелье.
 
         Ответь кратко и по делу на русском языке. Обращайся напрямую к собеседнику (на "вы"), не упоминай слово "пользователь" и не описывай запрос — просто сразу переходи к рекомендации.
@@ -254,22 +416,114 @@ class TeaSommelierBot:
         Составь короткую рекомендацию (2–4 предложения), укажи 1–3 чая и объясни, почему они подойдут. Не используй ссылки, не давай длинных описаний. Пиши дружелюбно и уверенно.
         """
 
-        return self.query_ollama(prompt)
+    def llm_cache_key(self, recommendations: List[Dict]) -> tuple:
+        """Ключ кеша текста LLM: версия каталога и id рекомендованных чаев в порядке выдачи.
 
-    def recommend_tea(self, query: str, top_n: int = 3) -> Dict:
-        """Основной метод для рекомендации чая"""
-        # Извлечение фильтров из запроса
-        filters = self.extract_filters(query)
+        Версия берётся из снимка, на котором выполнялся поиск (её проставляет
+        find_recommendations): если каталог перезагрузился между поиском и
+        генерацией, текст по старым данным не попадёт в кеш новой версии.
+        """
+        version = recommendations[0].get('catalog_version', self.snapshot.version)
+        return self.cache.llm_key(version, [rec.get('id', rec['title']) for rec in recommendations])
 
-        # Применение фильтров
-        filtered_data = self.apply_filters(filters)
+    def generate_recommendation(self, query: str, recommendations: List[Dict]) -> str:
+        """Генерация текста рекомендации с помощью LLM"""
+        if not recommendations:
+            return "К сожалению, не нашлось подходящих чаев по вашему запросу."
+
+        key = self.llm_cache_key(recommendations)
+        recommendation_text = self.cache.llm_texts.get(key)
+        annotate(llm_cache_hit=recommendation_text is not None)
+        if recommendation_text is None:
+            recommendation_text = self.query_ollama(self.build_prompt(recommendations))
+            if recommendation_text != self.LLM_ERROR_TEXT:
+                self.cache.llm_texts.set(key, recommendation_text)
+        return recommendation_text
+
+    async def generate_recommendation_async(self, query: str, recommendations: List[Dict]) -> str:
+        """Асинхронная генерация текста рекомендации с помощью LLM"""
+        if not recommendations:
+            return "К сожалению, не нашлось подходящих чаев по вашему запросу."
+
+        key = self.llm_cache_key(recommendations)
+        recommendation_text = self.cache.llm_texts.get(key)
+        annotate(llm_cache_hit=recommendation_text is not None)
+        if recommendation_text is None:
+            recommendation_text = await self.query_ollama_async(self.build_prompt(recommendations))
+            if recommendation_text != self.LLM_ERROR_TEXT:
+                self.cache.llm_texts.set(key, recommendation_text)
+        return recommendation_text
+
+    async def generate_recommendation_stream(self, query: str, recommendations: List[Dict]) -> AsyncIterator[str]:
+        """Генерация текста рекомендации со стримингом фрагментов от LLM"""
+        if not recommendations:
+            yield "К сожалению, не нашлось подходящих чаев по вашему запросу."
+            return
+
+        key = self.llm_cache_key(recommendations)
+        recommendation_text = self.cache.llm_texts.get(key)
+        annotate(llm_cache_hit=recommendation_text is not None)
+        if recommendation_text is not None:
+            yield recommendation_text
+            return
+
+        chunks = []
+        # Время до первого фрагмента и общее время генерации замеряются отдельно
+        started = time.perf_counter()
+        try:
+            async for chunk in self.ollama_client.generate_stream(self.build_prompt(recommendations)):
+                if not chunks:
+                    observe_stage('llm_first_chunk', time.perf_counter() - started)
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"Ошибка при запросе к Ollama: {e!r}")
+            if not chunks:
+                yield self.LLM_ERROR_TEXT
+            return
+        finally:
+            observe_stage('llm', time.perf_counter() - started)
+
+        # В кеш попадают только полностью сгенерированные ответы
+        if chunks:
+            self.cache.llm_texts.set(key, ''.join(chunks))
+
+    def find_recommendations(self, query: str, top_n: int = 3,
+                             query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        """Поиск подходящих чаев без генерации текста"""
+        # Весь запрос обрабатывается на одном снимке каталога, даже если параллельно идёт перезагрузка
+        snapshot = self.snapshot
 
-        # Семантический поиск среди отфильтрованных вариантов
-        recommendations = self.semantic_search(query, filtered_data, top_n)
+        # Извлечение фильтров из запроса
+        with span('extract_filters'):
+            filters = self.extract_filters(query, snapshot)
+
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
+        key = self.cache.search_key(snapshot.version, filters, query_embedding, top_n)
+        recommendations = self.cache.search_results.get(key)
+        annotate(catalog_version=snapshot.version, search_cache_hit=recommendations is not None)
+        if recommendations is None:
+            # Применение фильтров
+            with span('apply_filters'):
+                row_ids = self.filter_row_ids(filters, snapshot)
+            FILTER_CANDIDATES.observe(len(row_ids))
+            annotate(candidates=len(row_ids))
+
+            # Семантический поиск среди отфильтрованных вариантов
+            with span('semantic_search'):
+                recommendations = self.semantic_search(query, row_ids, top_n, query_embedding, snapshot)
+            self.cache.search_results.set(key, recommendations)
 
         # Конвертация рекомендаций в словари
-        recs_dict = recommendations.drop(columns=['embedding', 'similarity'], errors='ignore')
-        recs_dict = recs_dict.to_dict('records')
+        recs_dict = recommendations.drop(columns=['similarity'], errors='ignore').to_dict('records')
+        for rec in recs_dict:
+            rec['catalog_version'] = snapshot.version
+        return recs_dict
+
+    def recommend_tea(self, query: str, top_n: int = 3) -> Dict:
+        """Основной метод для рекомендации чая"""
+        recs_dict = self.find_recommendations(query, top_n)
 
         # Генерация текста рекомендации
         recommendation_text = self.generate_recommendation(query, recs_dict)
@@ -278,3 +532,34 @@ class TeaSommelierBot:
             "recommendations": recs_dict,
             "recommendation_text": recommendation_text
         }
+
+    async def find_recommendations_async(self, query: str, top_n: int = 3) -> List[Dict]:
+        """Поиск подходящих чаев в пуле потоков"""
+        query_embedding = await self.encode_query_async(query)
+        loop = asyncio.get_running_loop()
+        # Контекст копируется, чтобы этапы поиска попали в трассировку текущего запроса
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(context.run, self.find_recommendations, query, top_n, query_embedding)
+        )
+
+    async def recommend_tea_async(self, query: str, top_n: int = 3) -> Dict:
+        """Рекомендация чая без блокировки event loop.
+
+        Эмбеддинг и поиск выполняются в ограниченном пуле потоков,
+        запрос к LLM - через асинхронный клиент.
+        """
+        recs_dict = await self.find_recommendations_async(query, top_n)
+
+        # Генерация текста рекомендации
+        recommendation_text = await self.generate_recommendation_async(query, recs_dict)
+
+        return {
+            "recommendations": recs_dict,
+            "recommendation_text": recommendation_text
+        }
+
+    async def close(self):
+        """Освобождение соединений и потоков"""
+        await self.ollama_client.close()
+        self.executor.shutdown(wait=False)
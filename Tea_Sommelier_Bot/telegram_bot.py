@@ -1,6 +1,12 @@
 import logging
 from tea_sommelier_bot import TeaSommelierBot
-from telegram import Update
+from catalog_watch import catalog_changes
+from message_text import split_message, utf16_length
+from metrics import REQUESTS, annotate, span, trace_request
+from chat_update_processor import ChatOrderedUpdateProcessor
+from message_scheduler import MessageScheduler
+from telegram import Message, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -9,19 +15,52 @@ from telegram.ext import (
     CallbackContext
 )
 import asyncio
+import time
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+
 class TelegramBot:
-    def __init__(self, token: str, tea_bot: TeaSommelierBot):
+    # Максимальная длина сообщения в Telegram (в кодовых единицах UTF-16)
+    MESSAGE_LIMIT = 4096
+
+    def __init__(self, token: str, tea_bot: TeaSommelierBot, max_concurrent_updates: int = 64,
+                 stream_responses: bool = True, stream_edit_interval: float = 1.5,
+                 admin_ids: Optional[List[int]] = None, catalog_watch_interval: Optional[float] = 60.0,
+                 merge_cards: bool = True, scheduler: Optional[MessageScheduler] = None):
         self.token = token
         self.tea_bot = tea_bot
-        self.application = Application.builder().token(self.token).build()
+        # Все отправки и правки сообщений проходят через очередь с лимитами Telegram
+        self.scheduler = scheduler or MessageScheduler()
+        # Карточки чаев добавляются к тексту рекомендации, если всё помещается в одно сообщение
+        self.merge_cards = merge_cards
+        # Пользователи, которым доступна команда /reload
+        self.admin_ids = set(admin_ids or [])
+        # Период проверки файла каталога (None - не следить за файлом)
+        self.catalog_watch_interval = catalog_watch_interval
+        self.watch_task: Optional[asyncio.Task] = None
+        # Очередь запросов /reload к родительскому процессу (воркер за WebhookServer): перезагрузка
+        # выполняется там, чтобы все воркеры получили один и тот же каталог
+        self.reload_requests = None
+        # Стриминг ответа LLM правкой сообщения-заглушки; интервал правок ограничен лимитами Telegram
+        self.stream_responses = stream_responses
+        self.stream_edit_interval = stream_edit_interval
+        # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(ChatOrderedUpdateProcessor(max_concurrent_updates))
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
 
         # Регистрация обработчиков
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help))
+        self.application.add_handler(CommandHandler("reload", self.reload))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
 
         # Добавляем обработчик ошибок
@@ -31,11 +70,12 @@ class TelegramBot:
         """Обработчик ошибок"""
         logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
-        if update and hasattr(update, 'effective_chat'):
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
+        if update and getattr(update, 'effective_chat', None):
+            chat_id = update.effective_chat.id
+            await self.scheduler.call(chat_id, lambda: context.bot.send_message(
+                chat_id=chat_id,
                 text="Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже."
-            )
+            ))
 
     async def start(self, update: Update, context: CallbackContext):
         """Обработчик команды /start"""
@@ -55,18 +95,16 @@ class TelegramBot:
         await update.message.reply_text(welcome_text)
 
     async def send_long_message(self, context: CallbackContext, chat_id: int, text: str, **kwargs):
-        """Отправляет длинное сообщение частями по 4000 символов"""
-        max_length = 4000  # Максимальная длина сообщения в Telegram
-        for i in range(0, len(text), max_length):
-            part = text[i:i + max_length]
+        """Отправляет длинное сообщение частями не длиннее лимита Telegram"""
+        for part in split_message(text, self.MESSAGE_LIMIT, kwargs.get('parse_mode') == 'HTML'):
             try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=part,
-                    **kwargs
-                )
-                # Добавляем небольшую задержку между сообщениями
-                await asyncio.sleep(0.5)
+                # Паузы между частями выдерживает планировщик по лимитам чата
+                with span('telegram_send'):
+                    await self.scheduler.call(chat_id, lambda: context.bot.send_message(
+                        chat_id=chat_id,
+                        text=part,
+                        **kwargs
+                    ))
             except Exception as e:
                 logger.error(f"Ошибка при отправке части сообщения: {e}")
 
@@ -100,61 +138,252 @@ class TelegramBot:
 
         chat_id = update.effective_chat.id
 
+        # Этапы обработки попадают в гистограммы, а у части запросов - в лог трассировки
+        with trace_request('handle_message'), span('handle_message'):
+            await self.__handle_message(update, context, chat_id, text)
+
+    async def __handle_message(self, update: Update, context: CallbackContext, chat_id: int, text: str):
+        """Поиск, генерация и отправка рекомендации"""
         try:
             # Отправляем сообщение о том, что бот думает
-            if hasattr(update, 'message') and update.message:
-                message = await update.message.reply_text("🔍 Ищу подходящие чаи...")
-            else:
-                message = await context.bot.send_message(chat_id, "🔍 Ищу подходящие чаи...")
+            with span('telegram_send'):
+                if hasattr(update, 'message') and update.message:
+                    message = await self.scheduler.call(
+                        chat_id, lambda: update.message.reply_text("🔍 Ищу подходящие чаи...")
+                    )
+                else:
+                    message = await self.scheduler.call(
+                        chat_id, lambda: context.bot.send_message(chat_id, "🔍 Ищу подходящие чаи...")
+                    )
+
+            if self.stream_responses:
+                await self.__stream_recommendation(context, chat_id, text, message)
+                return
 
             # Получаем рекомендации
-            result = self.tea_bot.recommend_tea(text)
+            with span('recommend'):
+                result = await self.tea_bot.recommend_tea_async(text)
 
             if not result['recommendations']:
-                await context.bot.send_message(chat_id,
-                                               "К сожалению, не нашлось подходящих чаев по вашему запросу. Попробуйте изменить параметры поиска.", parse_mode='Markdown')
+                REQUESTS.labels(status='empty').inc()
+                await self.send_not_found(context, chat_id)
                 return
 
             recommendation_text = self.__replace_markdown_with_emojis(result['recommendation_text'])
+            cards_text = self.format_tea_cards(result['recommendations'])
 
-            # Отправляем развернутую рекомендацию
-            await self.send_long_message(
-                context,
-                chat_id,
-                recommendation_text,
-                disable_web_page_preview=True,
-                parse_mode='HTML'  # если нужно форматирование
-            )
-
-            # Отправляем краткую информацию о каждом чае
-            for i, rec in enumerate(result['recommendations'], 1):
-                tea_text = (
-                    f"<b>Чай #{i}: {rec['title']}</b>\n"
-                    f"💵 Цена: {rec['price']} руб.\n"
-                    f"🏷 Категория: {', '.join(rec['tea_category'])}\n"
-                    f"🛒 {'✅ Есть в наличии' if rec.get('available_tea', False) else '❌ Нет в наличии'}\n"
-                    f"🔗 Ссылка: {rec.get('url', 'нет ссылки')}\n"
+            # Рекомендация и карточки одним сообщением, если помещаются
+            if self.merge_cards and utf16_length(f"{recommendation_text}\n\n{cards_text}") <= self.MESSAGE_LIMIT:
+                await self.send_long_message(
+                    context,
+                    chat_id,
+                    f"{recommendation_text}\n\n{cards_text}",
+                    disable_web_page_preview=True,
+                    parse_mode='HTML'
                 )
-
+            else:
+                # Отправляем развернутую рекомендацию
                 await self.send_long_message(
                     context,
                     chat_id,
-                    tea_text,
+                    recommendation_text,
                     disable_web_page_preview=True,
                     parse_mode='HTML'  # если нужно форматирование
                 )
 
+                # Отправляем краткую информацию о каждом чае
+                await self.send_tea_cards(context, chat_id, result['recommendations'])
+            REQUESTS.labels(status='ok').inc()
+
         except Exception as e:
+            REQUESTS.labels(status='error').inc()
+            annotate(error=repr(e))
             logger.error(f"Ошибка при обработке запроса: {e}")
-            await context.bot.send_message(
+            await self.scheduler.call(chat_id, lambda: context.bot.send_message(
                 chat_id,
                 "Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте позже."
+            ))
+
+    async def send_not_found(self, context: CallbackContext, chat_id: int):
+        """Сообщение об отсутствии подходящих чаев"""
+        await self.scheduler.call(chat_id, lambda: context.bot.send_message(
+            chat_id,
+            "К сожалению, не нашлось подходящих чаев по вашему запросу. Попробуйте изменить параметры поиска.",
+            parse_mode='Markdown'
+        ))
+
+    async def __stream_recommendation(self, context: CallbackContext, chat_id: int, text: str, message: Message):
+        """Рекомендация со стримингом: текст LLM постепенно появляется в сообщении-заглушке.
+
+        Карточки чаев добавляются к финальному тексту, если помещаются в сообщение,
+        иначе (или при merge_cards=False) отправляются параллельно с генерацией
+        """
+        with span('find_recommendations'):
+            recommendations = await self.tea_bot.find_recommendations_async(text)
+
+        if not recommendations:
+            REQUESTS.labels(status='empty').inc()
+            await self.send_not_found(context, chat_id)
+            return
+
+        cards_text = self.format_tea_cards(recommendations)
+        cards_task = None
+        if not self.merge_cards:
+            cards_task = asyncio.create_task(self.send_tea_cards(context, chat_id, recommendations))
+
+        recommendation_text = ''
+        shown_text = ''
+        last_edit = time.monotonic()
+        async for chunk in self.tea_bot.generate_recommendation_stream(text, recommendations):
+            recommendation_text += chunk
+            if time.monotonic() - last_edit < self.stream_edit_interval:
+                continue
+            # Промежуточные правки без разметки: HTML-теги могут быть ещё не закрыты
+            partial_text = (split_message(self.__replace_markdown_with_emojis(recommendation_text), self.MESSAGE_LIMIT) or [''])[0]
+            if partial_text != shown_text:
+                await self.__edit_message(message, partial_text)
+                shown_text = partial_text
+            last_edit = time.monotonic()
+
+        recommendation_text = self.__replace_markdown_with_emojis(recommendation_text)
+        if cards_task is None and utf16_length(f"{recommendation_text}\n\n{cards_text}") <= self.MESSAGE_LIMIT:
+            # Финальный текст вместе с карточками - одна правка вместо нескольких сообщений
+            final_text = f"{recommendation_text}\n\n{cards_text}"
+            if not await self.__edit_message(message, final_text, parse_mode='HTML'):
+                await self.__edit_message(message, final_text)
+            REQUESTS.labels(status='ok').inc()
+            return
+
+        # Финальный текст с разметкой; не поместившееся отправляется отдельными сообщениями
+        parts = split_message(recommendation_text, self.MESSAGE_LIMIT, html=True) or ['']
+        if not await self.__edit_message(message, parts[0], parse_mode='HTML'):
+            await self.__edit_message(message, parts[0])
+        for part in parts[1:]:
+            await self.send_long_message(
+                context,
+                chat_id,
+                part,
+                disable_web_page_preview=True,
+                parse_mode='HTML'
+            )
+
+        if cards_task is None:
+            await self.send_long_message(
+                context, chat_id, cards_text, disable_web_page_preview=True, parse_mode='HTML'
+            )
+        else:
+            await cards_task
+        REQUESTS.labels(status='ok').inc()
+
+    async def __edit_message(self, message: Message, text: str, **kwargs) -> bool:
+        """Правка сообщения; ошибки разметки и неизменённого текста не прерывают ответ"""
+        if not text.strip():
+            return True
+        try:
+            with span('telegram_edit'):
+                await self.scheduler.call(
+                    message.chat_id, lambda: message.edit_text(text, disable_web_page_preview=True, **kwargs)
+                )
+            return True
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return True
+            logger.warning(f"Не удалось обновить сообщение: {e}")
+            return False
+
+    @staticmethod
+    def format_tea_card(i: int, rec: dict) -> str:
+        """Краткая информация о чае"""
+        return (
+            f"<b>Чай #{i}: {rec['title']}</b>\n"
+            f"💵 Цена: {rec['price']} руб.\n"
+            f"🏷 Категория: {', '.join(rec['tea_category'])}\n"
+            f"🛒 {'✅ Есть в наличии' if rec.get('available_tea', False) else '❌ Нет в наличии'}\n"
+            f"🔗 Ссылка: {rec.get('url', 'нет ссылки')}\n"
+        )
+
+    def format_tea_cards(self, recommendations: list) -> str:
+        return '\n'.join(self.format_tea_card(i, rec) for i, rec in enumerate(recommendations, 1))
+
+    async def send_tea_cards(self, context: CallbackContext, chat_id: int, recommendations: list):
+        """Отправка краткой информации о каждом чае"""
+        for i, rec in enumerate(recommendations, 1):
+            await self.send_long_message(
+                context,
+                chat_id,
+                self.format_tea_card(i, rec),
+                disable_web_page_preview=True,
+                parse_mode='HTML'  # если нужно форматирование
             )
 
     def run(self):
         """Запуск бота"""
         self.application.run_polling()
 
+    async def serve_updates(self, queue):
+        """Обработка обновлений из очереди процесса (воркер за WebhookServer); None - остановка"""
+        application = self.application
+        await application.initialize()
+        await self.on_startup(application)
+        await application.start()
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            await application.stop()
+            await self.on_shutdown(application)
+            await application.shutdown()
+
+    async def reload(self, update: Update, context: CallbackContext):
+        """Обработчик команды /reload: перезагрузка каталога (только для администраторов)"""
+        if update.effective_user is None or update.effective_user.id not in self.admin_ids:
+            return
+
+        if self.reload_requests is not None:
+            # Результат пришлёт родительский процесс после перезапуска воркеров
+            self.reload_requests.put(update.effective_chat.id)
+            await update.message.reply_text("🔄 Перезагружаю каталог во всех воркерах...")
+            return
+
+        await update.message.reply_text("🔄 Перезагружаю каталог...")
+        try:
+            diff = await self.tea_bot.reload_catalog_async()
+        except Exception as e:
+            logger.error(f"Ошибка при перезагрузке каталога: {e}")
+            await update.message.reply_text("Не удалось перезагрузить каталог, работает прежняя версия.")
+            return
+
+        await update.message.reply_text(
+            f"✅ Каталог обновлён: добавлено {len(diff['added'])}, "
+            f"изменено {len(diff['changed'])}, удалено {len(diff['removed'])}"
+        )
+
+    async def watch_catalog(self):
+        """Перезагрузка каталога при изменении файла"""
+        path = self.tea_bot.catalog_path
+        async for _ in catalog_changes(path, self.catalog_watch_interval):
+            logger.info(f"Файл каталога {path} изменился, перезагружаем")
+            try:
+                await self.tea_bot.reload_catalog_async(path)
+            except Exception as e:
+                logger.error(f"Ошибка при перезагрузке каталога: {e}")
+
+    async def on_startup(self, application: Application):
+        """Запуск наблюдения за файлом каталога"""
+        if self.catalog_watch_interval:
+            self.watch_task = asyncio.create_task(self.watch_catalog())
+
+    async def on_shutdown(self, application: Application):
+        """Закрытие соединений с Ollama при остановке"""
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+        await self.tea_bot.close()
+
     @staticmethod
     def __replace_markdown_with_emojis(text: str) -> str:
         replacements = {
@@ -0,0 +1,169 @@
+import bisect
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-zа-я0-9]+')
+
+# Окончания для упрощённого стемминга, если snowballstemmer не установлен (от длинных к коротким)
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'иях', 'ях', 'ах', 'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их', 'ую', 'юю', 'ом', 'ем', 'ия', 'ью',
+    'ться', 'тся', 'ать', 'ять', 'ить', 'еть', 'ет', 'ит', 'ют', 'ат', 'ят', 'ла', 'ло', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+class RussianStemmer:
+    """Стемминг русских слов: snowballstemmer, если установлен, иначе отсечение типовых окончаний.
+
+    snowballstemmer сам использует быстрый PyStemmer, если установлен и он.
+    """
+
+    def __init__(self):
+        try:
+            import snowballstemmer
+            self.stemmer = snowballstemmer.stemmer('russian')
+        except ImportError:
+            logger.info("snowballstemmer не установлен, используется упрощённый стемминг")
+            self.stemmer = None
+        self.stem = lru_cache(maxsize=200000)(self.__stem)
+
+    def __stem(self, word: str) -> str:
+        if self.stemmer is not None:
+            return self.stemmer.stemWord(word)
+        for ending in RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                return word[:-len(ending)]
+        return word
+
+
+_stemmer = None
+
+
+def get_stemmer() -> RussianStemmer:
+    """Общий стеммер: кеш основ сохраняется между перезагрузками каталога"""
+    global _stemmer
+    if _stemmer is None:
+        _stemmer = RussianStemmer()
+    return _stemmer
+
+
+class TextIndex:
+    """Инвертированный индекс текстов каталога.
+
+    По описаниям и отзывам хранятся списки строк для каждой основы слова - по
+    ним дескриптор ищется без просмотра текстов. По combined_text хранятся
+    частоты основ для оценки BM25.
+    """
+
+    def __init__(self, data, k1: float = 1.5, b: float = 0.75, max_suffix: int = 2):
+        """
+        max_suffix - на сколько букв основа слова в тексте может быть длиннее самого
+        слова дескриптора (ваниль -> ванильный, каштан -> каштановый)
+        """
+        self.size = len(data)
+        self.k1 = k1
+        self.b = b
+        self.max_suffix = max_suffix
+        self.stemmer = get_stemmer()
+
+        # Вхождение основ в описания и отзывы
+        membership = defaultdict(list)
+        for row_id, (description, comments) in enumerate(zip(data['description'], data['comments'])):
+            text = description if isinstance(description, str) else ''
+            if isinstance(comments, (list, tuple)):
+                text = ' '.join([text, *map(str, comments)])
+            for term in set(self.terms(text)):
+                membership[term].append(row_id)
+        self.postings = {term: np.asarray(rows, dtype=np.int32) for term, rows in membership.items()}
+        self.vocabulary = sorted(self.postings)
+
+        # Частоты основ в combined_text для BM25
+        frequencies = defaultdict(lambda: ([], []))
+        self.lengths = np.zeros(self.size, dtype=np.float32)
+        for row_id, text in enumerate(data['combined_text']):
+            terms = self.terms(str(text))
+            self.lengths[row_id] = len(terms)
+            for term, count in Counter(terms).items():
+                rows, counts = frequencies[term]
+                rows.append(row_id)
+                counts.append(count)
+        self.frequencies = {
+            term: (np.asarray(rows, dtype=np.int32), np.asarray(counts, dtype=np.float32))
+            for term, (rows, counts) in frequencies.items()
+        }
+        self.average_length = float(self.lengths.mean()) if self.size else 0.0
+        logger.info(f"Текстовый индекс построен: {len(self.postings)} основ в описаниях, {len(self.frequencies)} в текстах")
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(text.lower().replace('ё', 'е'))
+
+    def terms(self, text: str) -> List[str]:
+        """Основы слов текста"""
+        return [self.stemmer.stem(token) for token in self.tokenize(text)]
+
+    def __word_rows(self, word: str) -> np.ndarray:
+        """Отсортированные строки со словом word или производными от него словами"""
+        stem = self.stemmer.stem(word)
+        rows = []
+        position = bisect.bisect_left(self.vocabulary, stem)
+        while position < len(self.vocabulary):
+            term = self.vocabulary[position]
+            if not term.startswith(stem):
+                break
+            if len(term) <= len(word) + self.max_suffix:
+                rows.append(self.postings[term])
+            position += 1
+        if not rows:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(rows))
+
+    def phrase_rows(self, phrase: str) -> np.ndarray:
+        """Отсортированные строки, в описании или отзывах которых встречаются все слова фразы.
+
+        Варианты через '/' ("Мята/ментол") объединяются по ИЛИ.
+        """
+        result = np.zeros(0, dtype=np.int32)
+        for alternative in phrase.split('/'):
+            words = self.tokenize(alternative)
+            if not words:
+                continue
+            rows = self.__word_rows(words[0])
+            for word in words[1:]:
+                rows = np.intersect1d(rows, self.__word_rows(word), assume_unique=True)
+            result = np.union1d(result, rows)
+        return result.astype(np.int32, copy=False)
+
+    def bm25(self, query: str, row_ids: np.ndarray) -> np.ndarray:
+        """Оценки BM25 запроса для строк row_ids (по combined_text); считаются только эти строки"""
+        scores = np.zeros(len(row_ids), dtype=np.float32)
+        if not len(row_ids):
+            return scores
+        order = np.argsort(row_ids, kind='stable')
+        sorted_ids = row_ids[order]
+        for term in set(self.terms(query)):
+            posting = self.frequencies.get(term)
+            if posting is None:
+                continue
+            rows, counts = posting
+            idf = math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            # Общие строки кандидатов и списка основы: двоичный поиск по более длинному из списков
+            if len(rows) <= len(sorted_ids):
+                positions = np.minimum(np.searchsorted(sorted_ids, rows), len(sorted_ids) - 1)
+                found = sorted_ids[positions] == rows
+                targets, rows, counts = order[positions[found]], rows[found], counts[found]
+            else:
+                positions = np.minimum(np.searchsorted(rows, sorted_ids), len(rows) - 1)
+                found = rows[positions] == sorted_ids
+                targets, rows, counts = order[found], rows[positions[found]], counts[positions[found]]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.average_length)
+            scores[targets] += idf * counts * (self.k1 + 1) / (counts + norm)
+        return scores
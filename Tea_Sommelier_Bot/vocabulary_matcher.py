@@ -0,0 +1,99 @@
+import logging
+from collections import deque
+from typing import Dict, Iterable, List
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик: поиск всех терминов словаря за один проход по тексту"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+
+    def add(self, term: str):
+        """Добавление термина в бор"""
+        state = 0
+        for char in term:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(term)
+
+    def build(self):
+        """Построение суффиксных ссылок обходом в ширину"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find_all(self, text: str) -> List[str]:
+        """Все термины, встретившиеся в тексте (каждый один раз, в порядке появления)"""
+        found = {}
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for term in self.output[state]:
+                found[term] = None
+        return list(found)
+
+
+class VocabularyMatcher:
+    """Словарь категорий, дескрипторов, провинций и партий каталога.
+
+    Строится один раз при загрузке данных, поэтому стоимость разбора запроса
+    зависит от длины запроса, а не от размера каталога.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        # Термин в нижнем регистре -> исходные написания по типам фильтров
+        self.terms: Dict[str, Dict[str, List[str]]] = {}
+
+        for category_row in data['tea_category'].dropna():
+            self.__add_terms('category', category_row)
+        for column in ('descriptors', 'bert_descriptors'):
+            for desc_row in data[column].dropna():
+                self.__add_terms('descriptors', desc_row)
+        for feature in data['feature'].dropna():
+            if isinstance(feature, dict):
+                self.__add_terms('shipment', [feature.get('Партия:')])
+                self.__add_terms('province', [feature.get('Провинция:')])
+
+        self.automaton = AhoCorasick()
+        for term in self.terms:
+            self.automaton.add(term)
+        self.automaton.build()
+        logger.info(f"Словарь фильтров построен: {len(self.terms)} терминов")
+
+    def __add_terms(self, kind: str, values: Iterable):
+        """Добавление значений одного типа с дедупликацией"""
+        for value in values:
+            if not isinstance(value, str) or not value:
+                continue
+            spellings = self.terms.setdefault(value.lower(), {}).setdefault(kind, [])
+            if value not in spellings:
+                spellings.append(value)
+
+    def match(self, query: str) -> Dict[str, List[str]]:
+        """Термины каждого типа, найденные в запросе, в исходном написании"""
+        matches = {'category': [], 'descriptors': [], 'shipment': [], 'province': []}
+        for term in self.automaton.find_all(query.lower()):
+            for kind, spellings in self.terms[term].items():
+                matches[kind].extend(spellings)
+        return matches
@@ -0,0 +1,294 @@
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from typing import Callable, List, Optional
+from aiohttp import web
+from telegram import Bot, Update
+from chat_update_processor import ChatOrderedUpdateProcessor
+from metrics import MetricsServer
+from tea_sommelier_bot import TeaSommelierBot
+from catalog_watch import catalog_changes
+from telegram_bot import TelegramBot
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """Приём обновлений Telegram через вебхук и раздача их нескольким процессам.
+
+    Каталог, индексы и модель эмбеддингов загружаются один раз в родительском
+    процессе, после чего воркеры создаются через fork и разделяют эти страницы
+    памяти (copy-on-write). Матрица эмбеддингов открыта через memory-map и общая
+    через кеш страниц ОС; массивы numpy индексов тоже остаются общими, потому
+    что их данные лежат отдельно от заголовков объектов. Страницы с объектами
+    Python в DataFrame (строки, списки) копируются воркером по мере обращения
+    к ним: счётчик ссылок меняется при чтении. Обновления одного чата всегда
+    попадают в один и тот же воркер, который обрабатывает их по порядку.
+
+    Каталог перезагружает только родительский процесс (по изменению файла или
+    по /reload, который воркер пересылает ему), после чего воркеры по очереди
+    пересоздаются через fork и снова разделяют одну копию нового каталога.
+
+    fork небезопасен, если в родителе работают пулы потоков (OpenMP, токенизаторы):
+    их блокировки могут остаться занятыми в воркере. Поэтому родитель до загрузки
+    каталога вызывает prepare_parent_process, перезагрузка выполняется в потоке,
+    который завершается до fork, а завершения воркеров и запросы /reload
+    ожидаются без вспомогательных потоков.
+    """
+
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+    # Период проверки очереди запросов /reload, с
+    RELOAD_POLL_INTERVAL = 0.5
+
+    def __init__(self, token: str, tea_bot: TeaSommelierBot, bot_factory: Callable[[TeaSommelierBot], TelegramBot],
+                 webhook_url: str, workers: Optional[int] = None, host: str = '127.0.0.1', port: int = 8443,
+                 path: str = '/telegram', secret_token: Optional[str] = None, metrics_port: Optional[int] = None,
+                 supervise_interval: float = 5.0, catalog_watch_interval: Optional[float] = 60.0):
+        """
+        bot_factory создаёт TelegramBot внутри воркера; webhook_url - публичный HTTPS-адрес,
+        проксируемый на host:port/path. metrics_port - порт /metrics первого воркера,
+        следующие воркеры используют порты по порядку. catalog_watch_interval - период
+        проверки файла каталога (None - не следить за файлом)
+        """
+        self.token = token
+        self.tea_bot = tea_bot
+        self.bot_factory = bot_factory
+        self.webhook_url = webhook_url
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.metrics_port = metrics_port
+        self.supervise_interval = supervise_interval
+        self.catalog_watch_interval = catalog_watch_interval
+
+        self.context = multiprocessing.get_context('fork')
+        self.queues: List[multiprocessing.Queue] = [self.context.Queue() for _ in range(self.workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        # Запросы /reload от воркеров: id чата, которому сообщить результат
+        self.reload_requests: multiprocessing.Queue = self.context.Queue()
+        self.reload_lock: Optional[asyncio.Lock] = None
+        self.bot: Optional[Bot] = None
+        self.tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def prepare_parent_process():
+        """Вызывается до загрузки каталога: родитель работает с torch в одном потоке и без
+        параллельных токенизаторов, чтобы к fork у него не было пулов потоков"""
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(1)
+
+    def run(self):
+        """Запуск воркеров и HTTP-сервера вебхука"""
+        self.__freeze()
+        for index in range(self.workers):
+            self.__start_worker(index)
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        web.run_app(app, host=self.host, port=self.port, print=None)
+
+    @staticmethod
+    def __freeze():
+        """Объекты, созданные при загрузке, больше не просматриваются сборщиком мусора,
+        чтобы он не трогал их страницы в воркерах и не вызывал копирование"""
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def __start_worker(self, index: int):
+        process = self.context.Process(
+            target=self.run_worker, args=(index,), name=f'tea-worker-{index}', daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Воркер {index} запущен (pid {process.pid})")
+
+    def run_worker(self, index: int):
+        """Точка входа процесса-воркера"""
+        # Остановкой воркеров управляет родительский процесс. Воркер, пересозданный после запуска
+        # сервера, наследует обработчик SIGTERM и wakeup fd event loop родителя - их нужно сбросить
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        self.__limit_threads()
+        if self.metrics_port:
+            MetricsServer(self.metrics_port + index).start()
+
+        telegram_bot = self.bot_factory(self.tea_bot)
+        # За файлом каталога следит родительский процесс, ему же уходит /reload
+        telegram_bot.catalog_watch_interval = None
+        telegram_bot.reload_requests = self.reload_requests
+        # Общий лимит Telegram относится к боту, а не к процессу: воркеры делят его поровну
+        telegram_bot.scheduler.share_global_rate(self.workers)
+        asyncio.run(telegram_bot.serve_updates(self.queues[index]))
+
+    def __limit_threads(self):
+        """Потоки torch делятся между воркерами, чтобы они не конкурировали за ядра"""
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+
+    def worker_index(self, update: Update) -> int:
+        """Воркер, закреплённый за чатом обновления"""
+        key = ChatOrderedUpdateProcessor.chat_key(update)
+        if key is None:
+            key = update.update_id
+        return hash(key) % self.workers
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Приём обновления от Telegram"""
+        if self.secret_token and request.headers.get(self.SECRET_HEADER) != self.secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление: {e!r}")
+            return web.Response(status=400)
+
+        # Воркер получает исходный JSON и разбирает его со своим экземпляром Bot
+        self.queues[self.worker_index(update)].put(data)
+        return web.Response()
+
+    async def supervise(self):
+        """Перезапуск упавших воркеров (fork от текущего каталога родителя)"""
+        while True:
+            await asyncio.sleep(self.supervise_interval)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаем")
+                    # Упавший воркер мог оставить занятой блокировку чтения своей очереди,
+                    # поэтому новый получает новую; необработанные обновления старой теряются
+                    self.queues[index] = self.context.Queue()
+                    self.__start_worker(index)
+
+    async def restart_workers(self):
+        """Поочерёдная замена воркеров на созданные от нового каталога.
+
+        Новые обновления воркера сразу идут в новую очередь, а новый процесс
+        запускается после того, как старый дообработает свою: порядок обновлений
+        чата сохраняется, остальные воркеры в это время продолжают работу.
+        """
+        self.__freeze()
+        for index in range(self.workers):
+            process, queue = self.processes[index], self.queues[index]
+            # supervise не трогает воркер, пока он заменяется
+            self.processes[index] = None
+            self.queues[index] = self.context.Queue()
+            queue.put(None)
+            if process is not None:
+                await self.__join(process, 30)
+                if process.is_alive():
+                    process.terminate()
+                    await self.__join(process)
+            self.__start_worker(index)
+
+    @staticmethod
+    async def __join(process: multiprocessing.Process, timeout: Optional[float] = None):
+        """Ожидание завершения процесса по его sentinel в event loop, без потока для join"""
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(None))
+        try:
+            await asyncio.wait_for(exited, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(process.sentinel)
+        process.join(0)
+
+    @staticmethod
+    async def __run_in_thread(func: Callable):
+        """Вызов func в отдельном потоке, который завершается до возврата: следующий fork
+        происходит без работающих потоков в родителе"""
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tea-reload')
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func)
+        finally:
+            executor.shutdown(wait=True)
+
+    async def reload_catalog(self, chat_id: Optional[int] = None):
+        """Перезагрузка каталога в родительском процессе и пересоздание воркеров;
+        chat_id - чат администратора, отправившего /reload"""
+        async with self.reload_lock:
+            try:
+                diff = await self.__run_in_thread(self.tea_bot.reload_catalog)
+            except Exception as e:
+                logger.error(f"Ошибка при перезагрузке каталога: {e}")
+                await self.__notify(chat_id, "Не удалось перезагрузить каталог, работает прежняя версия.")
+                return
+            await self.restart_workers()
+        await self.__notify(
+            chat_id,
+            f"✅ Каталог обновлён: добавлено {len(diff['added'])}, "
+            f"изменено {len(diff['changed'])}, удалено {len(diff['removed'])}"
+        )
+
+    async def __notify(self, chat_id: Optional[int], text: str):
+        if chat_id is None or self.bot is None:
+            return
+        try:
+            await self.bot.send_message(chat_id, text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить результат перезагрузки: {e}")
+
+    async def listen_reload_requests(self):
+        """Запросы /reload от воркеров (опрос очереди: поток, ждущий в get, остался бы в родителе к fork)"""
+        while True:
+            try:
+                chat_id = self.reload_requests.get_nowait()
+            except Empty:
+                await asyncio.sleep(self.RELOAD_POLL_INTERVAL)
+                continue
+            await self.reload_catalog(chat_id)
+
+    async def watch_catalog(self):
+        """Перезагрузка каталога при изменении файла"""
+        path = self.tea_bot.catalog_path
+        async for _ in catalog_changes(path, self.catalog_watch_interval):
+            logger.info(f"Файл каталога {path} изменился, перезагружаем")
+            await self.reload_catalog()
+
+    async def on_startup(self, app: web.Application):
+        """Регистрация вебхука в Telegram"""
+        self.bot = Bot(self.token)
+        await self.bot.initialize()
+        await self.bot.set_webhook(
+            url=self.webhook_url, secret_token=self.secret_token, allowed_updates=Update.ALL_TYPES
+        )
+        self.reload_lock = asyncio.Lock()
+        self.tasks = [asyncio.create_task(self.supervise()), asyncio.create_task(self.listen_reload_requests())]
+        if self.catalog_watch_interval:
+            self.tasks.append(asyncio.create_task(self.watch_catalog()))
+        logger.info(f"Вебхук {self.webhook_url} зарегистрирован, воркеров: {self.workers}")
+
+    async def on_cleanup(self, app: web.Application):
+        """Остановка воркеров: каждый дообрабатывает свою очередь"""
+        for task in self.tasks:
+            task.cancel()
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is None:
+                continue
+            await self.__join(process, 30)
+            if process.is_alive():
+                process.terminate()
+        if self.bot is not None:
+            await self.bot.shutdown()
@@ -0,0 +1,152 @@
+"""Чтение и запись каталога чая.
+
+Основной формат - Parquet с нативными колонками-списками и словарями (map),
+поэтому при загрузке не нужен ast.literal_eval. Excel-файлы по-прежнему
+читаются, а команда
+
+    python catalog_io.py daochai_parsed.xlsx "Classifier_Results/<файл>.xlsx"
+
+однократно конвертирует их в .parquet рядом с исходными.
+"""
+import ast
+import logging
+import os
+import sys
+from typing import List, Optional
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые в Excel хранятся как строковое представление списков и словарей
+COLLECTION_COLUMNS = ['descriptors', 'feature', 'tea_category', 'comments', 'bert_descriptors']
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+
+def is_parquet(path: str) -> bool:
+    return path.lower().endswith(PARQUET_EXTENSIONS)
+
+
+def read_catalog(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Загрузка каталога; columns ограничивает набор читаемых колонок"""
+    if is_parquet(path):
+        return _read_parquet(path, columns)
+    return _read_excel(path, columns)
+
+
+def _read_excel(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    data = pd.read_excel(path, usecols=(lambda name: name in columns) if columns else None)
+    for column in COLLECTION_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].apply(ast.literal_eval)
+    return data
+
+
+def _read_parquet(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if columns:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in available]
+    table = pq.read_table(path, columns=columns)
+
+    # Плоские колонки конвертируются средствами Arrow, вложенные - в списки и словари Python
+    nested = {
+        field.name: field.type for field in table.schema
+        if pa.types.is_list(field.type) or pa.types.is_map(field.type)
+    }
+    data = table.select([name for name in table.column_names if name not in nested]).to_pandas()
+    for name, arrow_type in nested.items():
+        values = table.column(name).to_pylist()
+        if pa.types.is_map(arrow_type):
+            values = [_map_to_dict(value, arrow_type.item_type) for value in values]
+        else:
+            values = [value if value is not None else [] for value in values]
+        data[name] = values
+    return data[table.column_names]
+
+
+def _map_to_dict(value, item_type) -> dict:
+    import pyarrow as pa
+
+    if value is None:
+        return {}
+    if pa.types.is_list(item_type):
+        return {key: item if item is not None else [] for key, item in value}
+    return dict(value)
+
+
+def _collection_type(values: pd.Series):
+    """Тип Arrow для колонки со списками или словарями строк"""
+    import pyarrow as pa
+
+    name = values.name
+    values = [value for value in values if value is not None and not (isinstance(value, float) and pd.isna(value))]
+    dicts = sum(isinstance(value, dict) for value in values)
+    if 0 < dicts < len(values):
+        # Одному типу Arrow всё не соответствует: часть значений потерялась бы при записи
+        raise ValueError(f"Колонка {name} содержит и словари, и списки: сохранить её в Parquet без потерь нельзя")
+    if dicts:
+        if any(isinstance(item, list) for value in values for item in value.values()):
+            return pa.map_(pa.string(), pa.list_(pa.string()))
+        return pa.map_(pa.string(), pa.string())
+    return pa.list_(pa.string())
+
+
+def _collection_value(value, arrow_type):
+    """Значение вложенной колонки в виде, который принимает Arrow"""
+    import pyarrow as pa
+
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if pa.types.is_map(arrow_type):
+        return [(str(key), item) for key, item in value.items()]
+    return [str(item) for item in value]
+
+
+def write_catalog(data: pd.DataFrame, path: str):
+    """Сохранение каталога в Parquet (по расширению .parquet) или Excel"""
+    if not is_parquet(path):
+        data = data.copy()
+        for column in COLLECTION_COLUMNS:
+            if column in data.columns:
+                data[column] = data[column].apply(repr)
+        data.to_excel(path, index=False)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    collection_columns = [column for column in data.columns if column in COLLECTION_COLUMNS]
+    flat = data.drop(columns=collection_columns).reset_index(drop=True)
+    table = pa.Table.from_pandas(flat, preserve_index=False)
+    for column in collection_columns:
+        arrow_type = _collection_type(data[column])
+        values = [_collection_value(value, arrow_type) for value in data[column]]
+        table = table.append_column(pa.field(column, arrow_type), pa.array(values, type=arrow_type))
+
+    table = table.select([column for column in data.columns])
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def convert_catalog(source_path: str, target_path: Optional[str] = None) -> str:
+    """Конвертация Excel-каталога в Parquet"""
+    target_path = target_path or os.path.splitext(source_path)[0] + '.parquet'
+    data = read_catalog(source_path)
+    # Безымянная колонка индекса из старых выгрузок to_excel без index=False
+    data = data.drop(columns=[column for column in data.columns if str(column).startswith('Unnamed:')])
+    write_catalog(data, target_path)
+    logger.info(f"{source_path} -> {target_path}: {len(data)} строк")
+    return target_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    for excel_path in sys.argv[1:]:
+        convert_catalog(excel_path)
@@ -0,0 +1,410 @@
+"""Инкрементальный сбор каталога чая с сайта магазина.
+
+Замена цикла из Tea_Parser.ipynb с той же разметкой полей (title, description,
+comments, descriptors, feature, price, available_tea, tea_category, url).
+Страницы запрашиваются параллельно через общий пул соединений с ограничением
+числа одновременных запросов и паузой между запросами к одному хосту.
+Страницы товаров запрашиваются условно (If-None-Match / If-Modified-Since),
+а разобранные записи хранятся в дисковом кеше: неизменённые товары не
+скачиваются и не разбираются заново. Обновление каталога:
+
+    python tea_crawler.py daochai_parsed.xlsx --cache-dir page_cache
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+import aiohttp
+import pandas as pd
+from bs4 import BeautifulSoup
+from catalog_io import write_catalog
+
+logger = logging.getLogger(__name__)
+
+LISTING_PATH = '/vid-chaya/page-{page}/?result_ids=categories_view_pagination_contents&is_ajax=1'
+LISTING_KEY = 'categories_view_pagination_contents'
+
+# Версия разбора страницы: при изменении parse_product записи кеша с другой версией разбираются заново
+PARSER_VERSION = 1
+
+
+def default_parser() -> str:
+    """lxml, если установлен (в несколько раз быстрее), иначе встроенный html.parser"""
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+def parse_listing(content: str, parser: str) -> List[str]:
+    """Ссылки на товары со страницы списка"""
+    soup = BeautifulSoup(content, parser)
+    return [link['href'] for link in soup.find_all('a', class_='product-title') if link.get('href')]
+
+
+def parse_product(html, url: str, parser: str) -> Optional[Dict]:
+    """Поля товара, как в Tea_Parser.ipynb; None, если на странице нет блока товара"""
+    soup_chai = BeautifulSoup(html, parser)
+    root_tag_in_chai = soup_chai.find('div', class_='cm-warehouse-block-depends-by-location')
+    if root_tag_in_chai is None:
+        return None
+    current_tea = {}
+
+    title_root = root_tag_in_chai.find('h1', class_='ut2-pb__title')
+    current_tea['title'] = title_root.text if title_root is not None else ''
+
+    description_tag = root_tag_in_chai.find('div', id='content_description')
+    current_tea['description'] = description_tag.text if description_tag is not None else ''
+
+    comments = []
+    root_tag_for_comment = soup_chai.find('div', id='content_discussion')
+    if root_tag_for_comment is not None:
+        for tea_comment_tag in root_tag_for_comment.find_all('div', class_='ty-discussion-post__message'):
+            comments.append(tea_comment_tag.text)
+    current_tea['comments'] = comments
+
+    descriptors_final = {}
+    for descriptors_root_tag in root_tag_in_chai.find_all('div', class_='descriptors-descriptor-data'):
+        descriptor_key = descriptors_root_tag.find('div', class_='descriptors-descriptor-data-name')
+        if descriptor_key is None:
+            continue
+        descriptors_final[descriptor_key.text] = [
+            tag.text for tag in descriptors_root_tag.find_all('span', class_='descriptor-data-name')
+        ]
+    current_tea['descriptors'] = descriptors_final
+
+    feature_final = {}
+    for feature_tag in root_tag_in_chai.find_all('div', class_='ty-product-feature'):
+        feature_key = feature_tag.find('span', class_='ty-product-feature__label')
+        feature_value = feature_tag.find('div', class_='ty-product-feature__value')
+        if feature_key is not None and feature_value is not None:
+            feature_final[feature_key.text] = feature_value.text
+    current_tea['feature'] = feature_final
+
+    price = ''
+    if root_tag_in_chai.find('span', class_='ty-price') is not None:
+        price_tag = root_tag_in_chai.find('span', class_='ty-price-num')
+        if price_tag is not None:
+            price = price_tag.text.replace('\xa0', '')
+    current_tea['price'] = price
+
+    current_tea['available_tea'] = root_tag_in_chai.find('i', class_='ty-icon-ok') is not None
+
+    # Первые три ссылки "хлебных крошек" - главная и общие разделы каталога
+    current_tea['tea_category'] = [
+        tag.text for tag in root_tag_in_chai.find_all('a', class_='ty-breadcrumbs__a')[3:]
+    ]
+
+    current_tea['url'] = url
+    return current_tea
+
+
+class PageCache:
+    """Дисковый кеш страниц товаров: валидаторы ответа (ETag, Last-Modified),
+    хеш содержимого и разобранная запись. Файл на URL, запись через временный файл."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self.__path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Повреждённая запись кеша страниц для {url}: {e!r}")
+            return None
+        if entry.get('parser_version') != PARSER_VERSION:
+            return None
+        return entry
+
+    def put(self, url: str, entry: Dict):
+        path = self.__path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({**entry, 'url': url, 'parser_version': PARSER_VERSION}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def prune(self, keep_urls) -> int:
+        """Удаление записей товаров, которых больше нет в каталоге; возвращает число удалённых"""
+        keep = {os.path.basename(self.__path(url)) for url in keep_urls}
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json') and name not in keep:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+
+class HostLimiter:
+    """Вежливость к одному хосту: не больше concurrency запросов одновременно
+    и не чаще одного начала запроса в delay секунд; pause задерживает все
+    следующие запросы (например, по Retry-After)"""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            async with self.lock:
+                loop = asyncio.get_running_loop()
+                wait = self.next_start - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.next_start = loop.time() + self.delay
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+    def pause(self, seconds: float):
+        self.next_start = max(self.next_start, asyncio.get_running_loop().time() + seconds)
+
+
+class TeaCrawler:
+    """Параллельный инкрементальный сборщик каталога.
+
+    base_url - адрес магазина; concurrency - общий предел одновременных
+    запросов, per_host и delay - предел и пауза для одного хоста; max_pages -
+    предел страниц списка, как max_attempts в ноутбуке.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url: str = 'https://daochai.ru', cache_dir: str = 'page_cache', concurrency: int = 16,
+                 per_host: int = 8, delay: float = 0.05, timeout: float = 30, retries: int = 3,
+                 backoff_factor: float = 0.5, max_pages: int = 200, parser: Optional[str] = None,
+                 user_agent: str = 'Mozilla/5.0 (compatible; tea-crawler)'):
+        self.base_url = base_url.rstrip('/')
+        self.cache = PageCache(cache_dir)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_pages = max_pages
+        self.parser = parser or default_parser()
+        self.user_agent = user_agent
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+        # Пройден ли список товаров до конца при последнем сборе
+        self.complete = False
+        self.counters = {'downloaded': 0, 'not_modified': 0, 'unchanged': 0, 'failed': 0, 'bytes': 0}
+
+    def __host(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(self.per_host, self.delay)
+        return self.hosts[host]
+
+    @staticmethod
+    def retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+        """Пауза из заголовка Retry-After (секунды или HTTP-дата)"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Mapping[str, str], bytes]:
+        """GET с повторами при сетевых ошибках и ответах 429/5xx; возвращает статус, заголовки и тело"""
+        host = self.__host(url)
+        for attempt in range(self.retries + 1):
+            delay = self.backoff_factor * (2 ** attempt)
+            try:
+                async with host:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status in self.RETRY_STATUSES:
+                            delay = self.retry_after(response) or delay
+                            host.pause(delay)
+                            error = f'ответ {response.status}'
+                        else:
+                            body = await response.read()
+                            self.counters['bytes'] += len(body)
+                            return response.status, response.headers.copy(), body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt >= self.retries:
+                raise RuntimeError(f"{url} недоступен после {self.retries + 1} попыток: {error}")
+            logger.warning(f"Ошибка при запросе {url} ({error}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    async def __listing_page(self, page: int) -> Optional[List[str]]:
+        """Ссылки со страницы списка: пустой список - страниц больше нет (пустой блок товаров),
+        None - страницу не удалось получить или разобрать"""
+        url = self.base_url + LISTING_PATH.format(page=page)
+        try:
+            status, _, body = await self.fetch(url)
+        except RuntimeError as e:
+            logger.error(f"Страница списка {page}: {e}")
+            return None
+        if status != 200:
+            logger.error(f"Страница списка {page}: ответ {status}")
+            return None
+        try:
+            blocks = json.loads(body)['html']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Страница списка {page}: неожиданный ответ ({e!r})")
+            return None
+        if not isinstance(blocks, dict):
+            logger.error(f"Страница списка {page}: неожиданный ответ")
+            return None
+        # За последней страницей магазин отдаёт ответ без блока товаров или с пустым блоком
+        links = parse_listing(blocks.get(LISTING_KEY) or '', self.parser)
+        return [urljoin(self.base_url + '/', link) for link in links]
+
+    async def collect_links(self) -> Tuple[List[str], bool]:
+        """Ссылки на все товары и признак того, что список пройден до конца.
+
+        Страницы запрашиваются окнами по concurrency штук; как и в ноутбуке,
+        обход останавливается на первой странице без товаров. Если страницу не
+        удалось получить, список считается неполным.
+        """
+        links = []
+        for start in range(1, self.max_pages + 1, self.concurrency):
+            pages = range(start, min(start + self.concurrency, self.max_pages + 1))
+            results = await asyncio.gather(*(self.__listing_page(page) for page in pages))
+            for page, page_links in zip(pages, results):
+                if page_links is None:
+                    logger.error(f"Список товаров неполный: ошибка на странице {page}")
+                    return list(dict.fromkeys(links)), False
+                if not page_links:
+                    logger.info(f"Остановка на {page}")
+                    return list(dict.fromkeys(links)), True
+                links.extend(page_links)
+        logger.warning(f"Достигнут лимит ({self.max_pages} страниц)")
+        return list(dict.fromkeys(links)), False
+
+    async def __product(self, url: str) -> Optional[Dict]:
+        """Запись товара: из кеша, если страница не изменилась, иначе разбор свежей страницы"""
+        cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            status, response_headers, body = await self.fetch(url, headers)
+        except RuntimeError as e:
+            self.counters['failed'] += 1
+            logger.warning(f"{e}; {'используется запись из кеша' if cached else 'товар пропущен'}")
+            return cached['record'] if cached else None
+
+        if status == 304 and cached is not None:
+            self.counters['not_modified'] += 1
+            return cached['record']
+        if status != 200:
+            self.counters['failed'] += 1
+            logger.warning(f"{url}: ответ {status}")
+            return cached['record'] if cached else None
+
+        # Сервер без валидаторов: страница скачана, но разбирать её не нужно, если содержимое то же
+        digest = hashlib.sha256(body).hexdigest()
+        if cached is not None and cached.get('sha256') == digest:
+            self.counters['unchanged'] += 1
+            record = cached['record']
+        else:
+            self.counters['downloaded'] += 1
+            record = parse_product(body, url, self.parser)
+            if record is None:
+                logger.warning(f"{url}: на странице нет блока товара")
+                return None
+        self.cache.put(url, {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'sha256': digest,
+            'record': record,
+        })
+        return record
+
+    async def crawl(self) -> pd.DataFrame:
+        """Каталог в формате daochai_parsed.xlsx.
+
+        Если список товаров пройден не до конца (self.complete = False), каталог
+        содержит только найденные товары, а кеш не очищается.
+        """
+        started = time.monotonic()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, keepalive_timeout=60)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=self.timeout, headers={'User-Agent': self.user_agent}
+        ) as self.session:
+            links, self.complete = await self.collect_links()
+            logger.info(f"Товаров в каталоге: {len(links)}")
+            records = await asyncio.gather(*(self.__product(url) for url in links))
+        self.session = None
+
+        if self.complete and links:
+            removed = self.cache.prune(links)
+            if removed:
+                logger.info(f"Из кеша удалено товаров, которых больше нет в каталоге: {removed}")
+        logger.info(
+            f"Каталог собран за {time.monotonic() - started:.1f} с: разобрано {self.counters['downloaded']}, "
+            f"не изменилось {self.counters['not_modified'] + self.counters['unchanged']}, "
+            f"ошибок {self.counters['failed']}, скачано {self.counters['bytes'] / 2 ** 20:.1f} МБ"
+        )
+        return pd.DataFrame([record for record in records if record is not None])
+
+    def run(self) -> pd.DataFrame:
+        return asyncio.run(self.crawl())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сбор каталога чая с сайта магазина')
+    parser.add_argument('output', nargs='?', default='daochai_parsed.xlsx', help='каталог (Excel или Parquet)')
+    parser.add_argument('--base-url', default='https://daochai.ru')
+    parser.add_argument('--cache-dir', default='page_cache', help='кеш страниц товаров')
+    parser.add_argument('--concurrency', type=int, default=16, help='всего одновременных запросов')
+    parser.add_argument('--per-host', type=int, default=8, help='одновременных запросов к одному хосту')
+    parser.add_argument('--delay', type=float, default=0.05, help='пауза между запросами к одному хосту, с')
+    parser.add_argument('--max-pages', type=int, default=200)
+    parser.add_argument('--parser', choices=['lxml', 'html.parser'], default=None)
+    args = parser.parse_args()
+
+    crawler = TeaCrawler(
+        args.base_url, args.cache_dir, concurrency=args.concurrency, per_host=args.per_host, delay=args.delay,
+        max_pages=args.max_pages, parser=args.parser
+    )
+    tea_df = crawler.run()
+    if not crawler.complete:
+        # Неполный каталог не должен заменить собранный ранее
+        logger.error(f"Список товаров пройден не до конца, {args.output} не изменён")
+        sys.exit(1)
+    write_catalog(tea_df, args.output)
+    logger.info(f"Сохранено {len(tea_df)} товаров в {args.output}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
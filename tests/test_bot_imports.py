@@ -0,0 +1,46 @@
+"""Проверка, что модули бота импортируются и имена, которые они берут друг у друга, существуют"""
+import ast
+import importlib
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_DIR = os.path.join(ROOT, 'Tea_Sommelier_Bot')
+sys.path[:0] = [ROOT, BOT_DIR]
+
+BOT_MODULES = sorted(name[:-3] for name in os.listdir(BOT_DIR) if name.endswith('.py'))
+
+
+def defined_names(module: str) -> set:
+    """Имена верхнего уровня модуля бота: функции, классы, присваивания и импорты"""
+    with open(os.path.join(BOT_DIR, f'{module}.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.update(target.id for target in targets if isinstance(target, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+    return names
+
+
+@pytest.mark.parametrize('module', BOT_MODULES)
+def test_local_imports_resolve(module):
+    # Проверяется без сторонних зависимостей: только импорты между модулями бота
+    with open(os.path.join(BOT_DIR, f'{module}.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module in BOT_MODULES:
+            missing = {alias.name for alias in node.names} - defined_names(node.module)
+            assert not missing, f'{module}: в {node.module} нет {sorted(missing)}'
+
+
+@pytest.mark.parametrize('module', ['main', 'webhook_server'])
+def test_entry_points_import(module):
+    for dependency in ('telegram', 'torch', 'sentence_transformers', 'aiohttp'):
+        pytest.importorskip(dependency)
+    importlib.import_module(module)
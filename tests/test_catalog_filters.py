@@ -0,0 +1,121 @@
+"""Проверка фильтров каталога: CatalogIndex против прежней реализации на pandas"""
+import itertools
+import os
+import sys
+import types
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'Tea_Sommelier_Bot')]
+
+from catalog_index import CatalogIndex  # noqa: E402
+
+# Тексты подобраны так, чтобы поиск по словам индекса и поиск подстроки давали одно и то же
+CATALOG = [
+    # tea_category, descriptors, bert_descriptors, description, comments, feature, price, available_tea
+    (['Улун'], ['Цветочный'], [], 'Светлый улун', ['Очень понравился'],
+     {'Партия:': 'Весна 2023', 'Провинция:': 'Фуцзянь'}, '1200', True),
+    (['Улун'], [], ['Дымный'], 'Тёмный улун с цветочный ароматом', [],
+     {'Партия:': 'Осень 2022', 'Провинция:': 'Фуцзянь'}, '800', False),
+    (['Пуэр'], ['Дымный', 'Древесный'], ['Древесный'], 'Шу пуэр', ['Дымный и плотный'],
+     {'Провинция:': 'Юньнань'}, '450', True),
+    (['Пуэр', 'Шэн пуэр'], [], [], 'Молодой шэн', ['Древесный оттенок'],
+     {'Партия:': 'Весна 2021', 'Провинция:': 'Юньнань'}, 'по запросу', True),
+    (['Зелёный чай'], ['Цветочный', 'Свежий'], ['Свежий'], 'Лунцзин', ['Свежий вкус'],
+     {'Партия:': 'Весна 2023', 'Провинция:': 'Чжэцзян'}, '2000', False),
+    (['Красный чай'], [], ['Медовый'], 'Дяньхун', [],
+     {'Провинция:': 'Юньнань'}, '650', True),
+    (['Улун'], ['Медовый'], [], 'Улун медовый', ['Цветочный тоже'],
+     'нет данных', '950', False),
+    (['Белый чай'], [], [], 'Бай му дань', ['Свежий и сладкий'],
+     {'Партия:': 'Весна 2022', 'Провинция:': 'Фуцзянь'}, None, True),
+]
+
+FILTER_VALUES = {
+    'category': [[], ['улун'], ['Пуэр', 'Белый чай'], ['Чёрный чай']],
+    'descriptors': [[], ['цветочный'], ['Дымный'], ['свежий', 'цветочный'], ['Медовый'], ['Пряный']],
+    'price_min': [None, 600],
+    'price_max': [None, 1000],
+    'shipment': [None, 'весна', '2023'],
+    'province': [None, 'юньнань', 'Фуцзянь'],
+}
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    columns = ['tea_category', 'descriptors', 'bert_descriptors', 'description', 'comments', 'feature', 'price',
+               'available_tea']
+    data = pd.DataFrame(CATALOG, columns=columns)
+    data['combined_text'] = data['description'] + ' ' + data['comments'].apply(' '.join)
+    return data
+
+
+def pandas_filter(data: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """TeaSommelierBot.apply_filters до перехода на CatalogIndex (сортировка сделана устойчивой)"""
+    filtered_data = data.sort_values('available_tea', ascending=False, kind='stable')
+    if filters['category']:
+        filtered_data = filtered_data[filtered_data['tea_category'].apply(
+            lambda x: any(cat.lower() in [item.lower() for item in x] for cat in filters['category']))]
+    if filters['price_max']:
+        filtered_data = filtered_data[pd.to_numeric(filtered_data['price'], errors='coerce') <= filters['price_max']]
+    if filters['price_min']:
+        filtered_data = filtered_data[pd.to_numeric(filtered_data['price'], errors='coerce') >= filters['price_min']]
+    for desc in filters['descriptors']:
+        if filtered_data.empty:
+            break
+        filtered_data = filtered_data[
+            filtered_data['descriptors'].apply(lambda x: desc.lower() in [item.lower() for item in x]) |
+            filtered_data['bert_descriptors'].apply(lambda x: desc.lower() in [item.lower() for item in x]) |
+            filtered_data['description'].str.contains(desc, case=False, na=False) |
+            filtered_data['comments'].apply(lambda x: any(desc.lower() in str(c).lower() for c in x))
+        ]
+    for column, key in (('shipment', 'Партия:'), ('province', 'Провинция:')):
+        # apply на пустой выборке даёт пустой DataFrame, и индексация по нему теряет колонки
+        if filters[column] and not filtered_data.empty:
+            filtered_data = filtered_data[filtered_data['feature'].apply(
+                lambda x: isinstance(x, dict) and key in x and filters[column].lower() in x[key].lower())]
+    return filtered_data
+
+
+def all_filters():
+    names = list(FILTER_VALUES)
+    for values in itertools.product(*FILTER_VALUES.values()):
+        yield dict(zip(names, values))
+
+
+def test_index_matches_pandas_filters(catalog):
+    index = CatalogIndex(catalog)
+    non_empty = 0
+    for filters in all_filters():
+        expected = pandas_filter(catalog, filters).index.tolist()
+        rows = index.filter(filters)
+        assert rows.tolist() == expected, filters
+        non_empty += bool(expected)
+    # Проверка не сводится к пустым результатам
+    assert non_empty > 100
+
+
+def test_no_filters_returns_available_first(catalog):
+    rows = CatalogIndex(catalog).filter({name: values[0] for name, values in FILTER_VALUES.items()})
+    assert rows.tolist() == [0, 2, 3, 5, 7, 1, 4, 6]
+    # Общий массив без фильтров защищён от изменения вызывающим кодом
+    assert not rows.flags.writeable
+
+
+def test_apply_filters_returns_filtered_dataframe(catalog):
+    pytest.importorskip('sentence_transformers')
+    from tea_sommelier_bot import TeaSommelierBot
+
+    bot = TeaSommelierBot.__new__(TeaSommelierBot)
+    bot.snapshot = types.SimpleNamespace(data=catalog, index=CatalogIndex(catalog))
+    filters = {**{name: values[0] for name, values in FILTER_VALUES.items()},
+               'category': ['Улун', 'Пуэр'], 'price_max': 1000}
+
+    row_ids = bot.filter_row_ids(filters)
+    filtered = bot.apply_filters(filters)
+    assert isinstance(filtered, pd.DataFrame)
+    assert filtered.index.tolist() == row_ids.tolist() == pandas_filter(catalog, filters).index.tolist()
+    pd.testing.assert_frame_equal(filtered, pandas_filter(catalog, filters))
+    assert np.array_equal(filtered.index.to_numpy(), row_ids)
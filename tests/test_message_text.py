@@ -0,0 +1,97 @@
+"""Проверка разбиения длинных сообщений на части по лимиту Telegram (4096 единиц UTF-16)"""
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'Tea_Sommelier_Bot')]
+
+from message_text import split_message, utf16_length  # noqa: E402
+
+LIMIT = 4096
+TAG = re.compile(r'<[^<>]*>')
+
+
+def without_tags(text: str) -> str:
+    return TAG.sub('', text)
+
+
+def assert_balanced(part: str):
+    """Теги части закрыты в обратном порядке, и ни один тег не разрезан"""
+    assert part.count('<') == part.count('>') == len(TAG.findall(part))
+    stack = []
+    for tag in TAG.findall(part):
+        if tag.startswith('</'):
+            assert stack and stack.pop() == tag[2:-1]
+        else:
+            stack.append(re.match(r'<([\w-]+)', tag).group(1))
+    assert not stack
+
+
+def test_utf16_length_counts_surrogate_pairs():
+    assert utf16_length('чай') == 3
+    assert utf16_length('🍵') == 2
+    assert utf16_length('a🍵b') == 4
+
+
+def test_short_text_is_single_part():
+    assert split_message('Пуэр\nУлун', LIMIT) == ['Пуэр\nУлун']
+    assert split_message('', LIMIT) == []
+
+
+def test_surrogate_pair_is_not_cut_at_limit():
+    # Эмодзи начинается на 4096-й единице и целиком не помещается
+    text = 'a' * 4095 + '🍵' + 'b'
+    assert split_message(text, LIMIT) == ['a' * 4095, '🍵b']
+
+
+def test_emoji_text_fits_by_utf16_length():
+    # В символах текст короче лимита, в единицах UTF-16 - длиннее
+    text = '🍵' * 3000
+    parts = split_message(text, LIMIT)
+    assert len(parts) == 2
+    assert ''.join(parts) == text
+    assert all(utf16_length(part) <= LIMIT for part in parts)
+
+
+def test_long_line_is_split_by_words():
+    text = ' '.join(['улун'] * 2000)
+    parts = split_message(text, LIMIT)
+    assert ''.join(parts) == text
+    assert all(utf16_length(part) <= LIMIT for part in parts)
+    assert all(part.endswith(' ') for part in parts[:-1])
+
+
+def test_lines_are_kept_whole():
+    lines = [f'{i}. ' + 'ж' * 100 + '\n' for i in range(100)]
+    parts = split_message(''.join(lines), LIMIT)
+    assert len(parts) > 1
+    assert ''.join(parts) == ''.join(lines)
+    assert all(part.endswith('\n') for part in parts)
+
+
+def test_html_tag_is_not_cut_at_limit():
+    text = 'x' * 4090 + '<b>жирный</b>'
+    parts = split_message(text, LIMIT, html=True)
+    assert len(parts) == 2
+    for part in parts:
+        assert utf16_length(part) <= LIMIT
+        assert_balanced(part)
+    assert without_tags(''.join(parts)) == without_tags(text)
+
+
+def test_html_entity_is_not_cut_at_limit():
+    text = 'a' * 4094 + '&amp;b'
+    parts = split_message(text, LIMIT, html=True)
+    assert parts == ['a' * 4094, '&amp;b']
+
+
+def test_html_tags_are_reopened_in_next_part():
+    text = '<b><i>' + 'слово 🍵 ' * 1000 + '</i></b>'
+    parts = split_message(text, LIMIT, html=True)
+    assert len(parts) > 1
+    for part in parts:
+        assert utf16_length(part) <= LIMIT
+        assert_balanced(part)
+        assert part.startswith('<b><i>') and part.endswith('</i></b>')
+    assert without_tags(''.join(parts)) == without_tags(text)
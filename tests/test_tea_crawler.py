@@ -0,0 +1,106 @@
+"""Проверка tea_crawler.py на локальной заглушке магазина (Benchmark/shop_stub.py)"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'Benchmark')]
+
+import tea_crawler  # noqa: E402
+from shop_stub import ShopStub  # noqa: E402
+from tea_crawler import TeaCrawler  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    stub = ShopStub(products=100, page_size=10)
+    stub.start_in_thread()
+    return stub
+
+
+def make_crawler(stub, cache_dir):
+    return TeaCrawler(stub.url, str(cache_dir), per_host=8, delay=0.0, retries=1, backoff_factor=0.01)
+
+
+def cache_entries(cache_dir) -> int:
+    return sum(name.endswith('.json') for _, _, files in os.walk(cache_dir) for name in files)
+
+
+def test_full_crawl_matches_stub(stub, tmp_path):
+    crawler = make_crawler(stub, tmp_path)
+    tea_df = crawler.run()
+
+    assert crawler.complete
+    assert len(tea_df) == 100
+    assert list(tea_df.columns) == [
+        'title', 'description', 'comments', 'descriptors', 'feature', 'price', 'available_tea', 'tea_category', 'url'
+    ]
+    row = tea_df[tea_df['url'].str.endswith('/product-3.html')].iloc[0]
+    assert row['title'] == 'Чай 3'
+    assert row['price'] == '103'
+    assert row['tea_category'] == ['Зелёный чай']
+    assert row['comments'] == ['Отзыв о чае 3']
+    assert row['available_tea']
+    assert cache_entries(tmp_path) == 100
+
+
+def test_incremental_crawl_reuses_unchanged_pages(stub, tmp_path):
+    make_crawler(stub, tmp_path).run()
+    stub.update(5, 'Новое описание')
+    stub.update(100)
+    stub.remove(7)
+
+    crawler = make_crawler(stub, tmp_path)
+    tea_df = crawler.run()
+
+    assert crawler.complete
+    assert len(tea_df) == 100
+    assert crawler.counters['downloaded'] == 2
+    assert crawler.counters['not_modified'] == 98
+    assert tea_df[tea_df['url'].str.endswith('/product-5.html')]['description'].tolist() == ['Новое описание']
+    assert cache_entries(tmp_path) == 100
+
+
+def test_unchanged_pages_are_not_parsed_without_validators(stub, tmp_path):
+    make_crawler(stub, tmp_path).run()
+    stub.validators = False
+
+    crawler = make_crawler(stub, tmp_path)
+    crawler.run()
+
+    assert crawler.counters['downloaded'] == 0
+    assert crawler.counters['unchanged'] == 100
+
+
+def test_failed_listing_page_keeps_cache(stub, tmp_path):
+    make_crawler(stub, tmp_path).run()
+    stub.failing_pages = {4}
+
+    crawler = make_crawler(stub, tmp_path)
+    tea_df = crawler.run()
+
+    assert not crawler.complete
+    assert len(tea_df) == 30
+    assert cache_entries(tmp_path) == 100
+
+    # После восстановления страницы товары не скачиваются заново
+    stub.failing_pages = set()
+    crawler = make_crawler(stub, tmp_path)
+    crawler.run()
+    assert crawler.complete
+    assert crawler.counters['downloaded'] == 0
+
+
+def test_main_does_not_overwrite_catalog_after_failed_listing(stub, tmp_path, monkeypatch):
+    output = tmp_path / 'catalog.xlsx'
+    output.write_bytes(b'previous catalog')
+    stub.failing_pages = {2}
+    monkeypatch.setattr(sys, 'argv', [
+        'tea_crawler.py', str(output), '--base-url', stub.url, '--cache-dir', str(tmp_path / 'cache'), '--delay', '0'
+    ])
+
+    with pytest.raises(SystemExit) as exit_info:
+        tea_crawler.main()
+
+    assert exit_info.value.code == 1
+    assert output.read_bytes() == b'previous catalog'